@@ -1,4 +1,14 @@
-# Import routers for easier access
-from .themes import router as themes_router
-from .questions import router as questions_router
-from .documents import router as documents_router
+# Routers for easier access, imported on first use so that importing one router
+# does not load the others (and the question answering dependencies with them)
+import importlib
+
+_ROUTERS = {
+    "themes_router": ".themes",
+    "questions_router": ".questions",
+    "documents_router": ".documents",
+}
+
+def __getattr__(name: str):
+    if name not in _ROUTERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return importlib.import_module(_ROUTERS[name], __name__).router
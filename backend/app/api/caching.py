@@ -0,0 +1,119 @@
+import os
+import sys
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+# Add the scripts directory to sys.path
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "scripts")
+sys.path.append(scripts_dir)
+
+from metrics_registry import CACHE_REQUESTS
+
+# Brotli is optional; without it large bodies are gzip-compressed only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = 1024
+
+# Number of pre-serialized payloads kept in memory
+PAYLOAD_CACHE_SIZE = 256
+
+class CachedPayload:
+    """A serialized response body and its compressed variants for one data version"""
+
+    def __init__(self, version: str, body: bytes):
+        self.version = version
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.body = body
+        self.encoded: Dict[str, bytes] = {}  # Content-Encoding -> compressed body, filled on first request
+
+    def encode(self, encoding: str) -> bytes:
+        """Get the body compressed with an encoding, compressing it once"""
+        if encoding not in self.encoded:
+            self.encoded[encoding] = brotli.compress(self.body) if encoding == "br" else gzip.compress(self.body, compresslevel=6)
+        return self.encoded[encoding]
+
+class PayloadCache:
+    """
+    Pre-serialized JSON payloads for read-heavy GET endpoints.
+
+    Each payload is keyed by view (e.g. themes of one company and category) and
+    tagged with the version of the data it was built from. A request whose
+    If-None-Match matches the current payload gets a 304; otherwise the cached bytes
+    are sent as they are. The data is only loaded and serialized again when its
+    version changes.
+    """
+
+    def __init__(self, max_entries: int = PAYLOAD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._payloads: "OrderedDict[Hashable, CachedPayload]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def response(self, request: Request, key: Hashable, version: str, load: Callable[[], Any], response_type: Any) -> Response:
+        """
+        Answer a GET from the cache.
+
+        version identifies the current state of the data behind key; load returns
+        the data and is only called when no payload exists for that version.
+        response_type is the endpoint's response model, used to serialize it.
+        """
+        payload = self._get(key, version)
+        CACHE_REQUESTS.inc("payload", "miss" if payload is None else "hit")
+        if payload is None:
+            body = TypeAdapter(response_type).dump_json(load())
+            payload = self._put(key, CachedPayload(version, body))
+
+        headers = {"ETag": payload.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if payload.etag in _parse_etags(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+
+        body = payload.body
+        encoding = _pick_encoding(request.headers.get("accept-encoding", "")) if len(body) >= COMPRESSION_MIN_BYTES else None
+        if encoding:
+            body = payload.encode(encoding)
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def _get(self, key: Hashable, version: str) -> Optional[CachedPayload]:
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is None or payload.version != version:
+                return None
+            self._payloads.move_to_end(key)
+            return payload
+
+    def _put(self, key: Hashable, payload: CachedPayload) -> CachedPayload:
+        with self._lock:
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            while len(self._payloads) > self.max_entries:
+                self._payloads.popitem(last=False)
+            return payload
+
+def _parse_etags(header: Optional[str]) -> set:
+    """The entity tags listed in an If-None-Match header"""
+    if not header:
+        return set()
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+def _pick_encoding(accept_encoding: str) -> Optional[str]:
+    """The best compression the client accepts: brotli if available, then gzip"""
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+# Shared by all routers
+payload_cache = PayloadCache()
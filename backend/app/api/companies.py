@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List, Optional
 
+from app.api.caching import payload_cache
+
 from app.models.company import Company
 from app.services.company_service import CompanyService
 
@@ -10,9 +12,12 @@ def get_company_service():
     return CompanyService()
 
 @router.get("/", response_model=List[Company])
-async def get_all_companies(company_service: CompanyService = Depends(get_company_service)):
+async def get_all_companies(request: Request, company_service: CompanyService = Depends(get_company_service)):
     """Get all companies"""
-    return company_service.get_all_companies()
+    return payload_cache.response(
+        request, ("companies",), company_service.get_companies_version(),
+        company_service.get_all_companies, List[Company]
+    )
 
 @router.get("/{company_id}", response_model=Company)
 async def get_company_by_id(company_id: str, company_service: CompanyService = Depends(get_company_service)):
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional
 
-from app.models.document import Document, DocumentList
-from app.services.document_service import DocumentService
+from app.api.caching import payload_cache
+from app.api.index import get_index_service
+
+from app.models.document import Document, DocumentList, DocumentUpload
+from app.services.document_service import DocumentService, DuplicateDocumentError, DocumentNameConflictError
+from app.services.index_service import IndexService
 
 router = APIRouter()
 
@@ -11,26 +16,73 @@ def get_document_service():
 
 @router.get("/", response_model=List[Document])
 async def get_all_documents(
+    request: Request,
     company_id: Optional[str] = Query(None, description="Filter documents by company ID"),
+    type: Optional[str] = Query(None, description="Filter documents by type (PDF, JSON)"),
     document_service: DocumentService = Depends(get_document_service)
 ):
-    """Get all documents, optionally filtered by company_id"""
-    if company_id:
-        return document_service.get_documents_by_company(company_id)
-    return document_service.get_all_documents()
+    """Get all documents, optionally filtered by company_id and type"""
+    return await run_in_threadpool(_documents_response, request, document_service, company_id, type)
 
 @router.get("/company/{company_id}", response_model=List[Document])
 async def get_documents_by_company(
+    request: Request,
     company_id: str,
     document_service: DocumentService = Depends(get_document_service)
 ):
     """Get all documents for a specific company"""
-    return document_service.get_documents_by_company(company_id)
+    return await run_in_threadpool(_documents_response, request, document_service, company_id, None)
+
+@router.post("/company/{company_id}/upload", response_model=DocumentUpload, status_code=202)
+async def upload_document(
+    company_id: str,
+    file: UploadFile = File(..., description="PDF or JSON document to add"),
+    document_service: DocumentService = Depends(get_document_service),
+    index_service: IndexService = Depends(get_index_service)
+):
+    """
+    Upload a document for a company and queue its ingestion into the company's index.
+
+    The file is streamed to disk and hashed in chunks; a document the company already
+    has (same content), or a different document with the same file name, is rejected
+    with 409. Only the new document is extracted and
+    embedded, by a background index job returned with the stored document.
+    """
+    if document_service.company_service.get_company_by_id(company_id) is None:
+        raise HTTPException(status_code=404, detail=f"Company with ID '{company_id}' not found")
+    
+    try:
+        document = await run_in_threadpool(document_service.store_upload, company_id, file.filename, file.file)
+    except DuplicateDocumentError as e:
+        raise HTTPException(status_code=409, detail=f"Document already exists: {e.document.path}")
+    except DocumentNameConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+    
+    return DocumentUpload(document=document, job=index_service.start_ingest(company_id, document.path))
+
+def _documents_response(request: Request, document_service: DocumentService, company_id: Optional[str], doc_type: Optional[str]):
+    """
+    Serve a document listing from the payload cache, revalidated against the document catalog.
+
+    Revalidation stats the company directories and hashes changed files, so routes
+    run this in the threadpool, off the event loop.
+    """
+    def load() -> List[Document]:
+        if doc_type:
+            return document_service.get_documents_by_type(doc_type, company_id)
+        return document_service.get_all_documents(company_id)
+
+    key = ("documents", company_id.lower() if company_id else None, doc_type.upper() if doc_type else None)
+    return payload_cache.response(request, key, document_service.get_documents_version(company_id), load, List[Document])
 
 @router.get("/{path:path}", response_model=Document)
 async def get_document_by_path(path: str, document_service: DocumentService = Depends(get_document_service)):
     """Get a document by path"""
-    document = document_service.get_document_by_path(path)
+    document = await run_in_threadpool(document_service.get_document_by_path, path)
     if document is None:
         raise HTTPException(status_code=404, detail=f"Document with path '{path}' not found")
     return document
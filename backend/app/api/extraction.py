@@ -0,0 +1,76 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import os
+import json
+import threading
+
+from app.models.extraction import ExtractionJob, ExtractionJobList
+from app.services.company_service import CompanyService
+from app.services.extraction_service import ExtractionService
+from app.api.questions import OPENAI_API_KEY, DEFAULT_TRACKEDCOMPANIES_DIR, DEFAULT_OUTPUT_DIR
+
+router = APIRouter()
+
+# Number of theme extraction runs that may run at the same time (for different companies)
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", "1"))
+
+# Process-wide extraction service, created on first use
+_extraction_service: Optional[ExtractionService] = None
+_extraction_service_lock = threading.Lock()
+
+def get_extraction_service() -> ExtractionService:
+    """Get the process-wide extraction service that runs theme extraction in the background"""
+    global _extraction_service
+    with _extraction_service_lock:
+        if _extraction_service is None:
+            _extraction_service = ExtractionService(OPENAI_API_KEY, DEFAULT_TRACKEDCOMPANIES_DIR, DEFAULT_OUTPUT_DIR, max_workers=EXTRACTION_WORKERS)
+        return _extraction_service
+
+@router.post("/company/{company_id}/run", response_model=ExtractionJob, status_code=202)
+async def start_extraction(company_id: str, extraction_service: ExtractionService = Depends(get_extraction_service)):
+    """Start extracting a company's themes in the background; returns the running job if there already is one"""
+    if CompanyService().get_company_by_id(company_id) is None:
+        raise HTTPException(status_code=404, detail=f"Company with ID '{company_id}' not found")
+    return extraction_service.start_extraction(company_id)
+
+@router.get("/jobs", response_model=ExtractionJobList)
+async def list_jobs(
+    company_id: Optional[str] = Query(None, description="Filter jobs by company ID"),
+    extraction_service: ExtractionService = Depends(get_extraction_service)
+):
+    """Get theme extraction jobs, newest first"""
+    return ExtractionJobList(jobs=extraction_service.list_jobs(company_id))
+
+@router.get("/jobs/{job_id}", response_model=ExtractionJob)
+async def get_job(job_id: str, extraction_service: ExtractionService = Depends(get_extraction_service)):
+    """Get the status and progress of a theme extraction job"""
+    job = extraction_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Extraction job with ID '{job_id}' not found")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str, extraction_service: ExtractionService = Depends(get_extraction_service)):
+    """
+    Stream a theme extraction job's progress as Server-Sent Events.
+
+    A `progress` event carries the job whenever its counters change, and a final
+    `done` event carries it once it has completed, failed or been cancelled.
+    """
+    if extraction_service.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Extraction job with ID '{job_id}' not found")
+
+    async def events():
+        async for event in extraction_service.watch(job_id):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/jobs/{job_id}/cancel", response_model=ExtractionJob)
+async def cancel_job(job_id: str, extraction_service: ExtractionService = Depends(get_extraction_service)):
+    """Cancel a theme extraction job; themes of the documents it already finished are kept"""
+    job = extraction_service.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Extraction job with ID '{job_id}' not found")
+    return job
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional
+import os
+import threading
+
+from app.models.index import IndexJob, IndexJobList, IndexReadiness
+from app.services.index_service import IndexService
+from app.api.questions import get_engine_pool
+
+router = APIRouter()
+
+# Number of index builds that may run at the same time
+INDEX_BUILD_WORKERS = int(os.environ.get("INDEX_BUILD_WORKERS", "1"))
+
+# Process-wide index service, created on first use
+_index_service: Optional[IndexService] = None
+_index_service_lock = threading.Lock()
+
+def get_index_service() -> IndexService:
+    """Get the process-wide index service that runs background builds"""
+    global _index_service
+    with _index_service_lock:
+        if _index_service is None:
+            _index_service = IndexService(get_engine_pool(), max_workers=INDEX_BUILD_WORKERS)
+        return _index_service
+
+@router.get("/ready", response_model=IndexReadiness)
+async def get_readiness(index_service: IndexService = Depends(get_index_service)):
+    """Get which companies have an index that questions can be answered from"""
+    return index_service.readiness()
+
+@router.post("/company/{company_id}/build", response_model=IndexJob, status_code=202)
+async def start_build(company_id: str, index_service: IndexService = Depends(get_index_service)):
+    """Start rebuilding a company's index in the background; returns the running job if there already is one"""
+    return index_service.start_build(company_id)
+
+@router.get("/jobs", response_model=IndexJobList)
+async def list_jobs(
+    company_id: Optional[str] = Query(None, description="Filter jobs by company ID"),
+    index_service: IndexService = Depends(get_index_service)
+):
+    """Get index build jobs, newest first"""
+    return IndexJobList(jobs=index_service.list_jobs(company_id))
+
+@router.get("/jobs/{job_id}", response_model=IndexJob)
+async def get_job(job_id: str, index_service: IndexService = Depends(get_index_service)):
+    """Get the status of an index build job"""
+    job = index_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Index job with ID '{job_id}' not found")
+    return job
+
+@router.post("/jobs/{job_id}/cancel", response_model=IndexJob)
+async def cancel_job(job_id: str, index_service: IndexService = Depends(get_index_service)):
+    """Cancel an index build job; the live index is kept"""
+    job = index_service.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Index job with ID '{job_id}' not found")
+    return job
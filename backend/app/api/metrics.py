@@ -0,0 +1,96 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.api import questions
+from metrics_registry import registry
+
+router = APIRouter()
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = registry.counter("http_requests", "HTTP requests by method, route and status code", ("method", "route", "status"))
+HTTP_LATENCY = registry.histogram("http_request_duration_seconds", "HTTP request latency until the response is fully sent", ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP requests being handled", ("method", "route"))
+
+class MetricsMiddleware:
+    """
+    Counts requests and measures their latency per route.
+
+    Requests are labeled with the route's path template (e.g. /api/themes/{theme_id}),
+    not the requested path, so label values stay bounded; requests that match no route
+    are labeled "unmatched". The route is known once the router has run, so a request
+    is counted as in flight from its endpoint's first read or write. Streaming
+    responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = None
+        status = 500
+
+        def routed() -> None:
+            nonlocal route
+            if route is None and "route" in scope:
+                route = _route_template(scope)
+                HTTP_IN_FLIGHT.inc(method, route)
+
+        async def receive_routed():
+            routed()
+            return await receive()
+
+        async def send_routed(message) -> None:
+            nonlocal status
+            routed()
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive_routed, send_routed)
+        finally:
+            if route is not None:
+                HTTP_IN_FLIGHT.dec(method, route)
+            else:
+                route = "unmatched"
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_LATENCY.observe(time.perf_counter() - start_time, method, route)
+
+def _route_template(scope: Scope) -> str:
+    """The path template of the route that matched the request, including its router's prefix"""
+    # FastAPI versions that resolve included routers lazily keep the unprefixed route in scope["route"]
+    route = (scope.get("fastapi") or {}).get("effective_route_context") or scope["route"]
+    return getattr(route, "path", None) or "unmatched"
+
+def _collect_engines(field: str):
+    """Per-company samples of the warm question answering engines"""
+    if questions._engine_pool is None:
+        return
+    for company in questions._engine_pool.stats()["companies"]:
+        yield (f"qa_engine_{field}", {"company": company["company_id"]}, company[field])
+
+def _collect_coalescing():
+    """Questions that did the work versus questions that shared an identical in-flight question's answer"""
+    stats = questions.get_question_coalescer().stats()
+    yield ("question_coalescing_total", {"result": "leader"}, stats["leaders"])
+    yield ("question_coalescing_total", {"result": "coalesced"}, stats["coalesced"])
+
+registry.add_collector("qa_engine_load_seconds", "gauge", "Time taken to load each warm question answering engine", lambda: _collect_engines("load_seconds"))
+registry.add_collector("qa_engine_bytes", "gauge", "Approximate memory held by each warm question answering engine", lambda: _collect_engines("bytes"))
+registry.add_collector("question_coalescing", "counter", "Questions answered (leader) or coalesced with an identical in-flight question", _collect_coalescing)
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,246 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import weakref
+import threading
+import contextvars
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.models.profile import RequestProfile, RequestProfileList
+
+router = APIRouter()
+
+# Profiling is opt-in: without PROFILING_ENABLED the middleware and routes are not installed at all
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILING_INTERVAL_MS = float(os.environ.get("PROFILING_INTERVAL_MS", "5"))  # Time between stack samples
+PROFILES_KEPT = int(os.environ.get("PROFILES_KEPT", "50"))  # Most recent profiles kept in memory
+
+# Request header or query parameter that asks for a request to be profiled
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_PARAMETER = "profile"
+
+# Leaf frames of threads that are only waiting for work, left out of profiles: anything
+# in these files, or an executor worker blocked on its work queue
+IDLE_FRAME_FILES = ("threading.py", "queue.py")
+IDLE_FRAMES = {("thread.py", "_worker")}
+
+# The sampler of the request being handled, inherited by its tasks and by the work it hands to threads
+_current_sampler: contextvars.ContextVar[Optional["StackSampler"]] = contextvars.ContextVar("current_sampler", default=None)
+
+class StackSampler:
+    """
+    Samples the call stacks of one request's work at a fixed interval on a background thread.
+
+    A request's work is split between the event loop and worker threads (search,
+    tokenization, blocking OpenAI calls), so both are sampled, but only while they
+    work for this request. The event loop thread is sampled while it runs one of the
+    request's tasks (tasks it creates inherit its context, see _install_task_factory),
+    or while it waits on its selector, as that is where a request spends time waiting
+    on the network. A worker thread is sampled while it runs a call that carries the
+    request's context, as the threadpool (run_in_threadpool, sync endpoints) and the
+    engines' CPU executor pass it on. Threads idling in a queue or condition wait are
+    skipped. Stacks are counted in collapsed form, "thread;outer;...;inner", one line
+    per stack.
+    """
+
+    def __init__(self, interval: float, loop: asyncio.AbstractEventLoop):
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Dict[str, int] = {}
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()  # The request's tasks
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampler thread (which blocks, so not on the event loop)"""
+        self._stopped.set()
+        self._thread.join()
+
+    def _works_for_request(self, thread_id: int, frame) -> bool:
+        """Whether a thread is doing this request's work at the moment"""
+        if thread_id == self._loop_thread_id:
+            task = asyncio.current_task(self._loop)
+            return task is None or task in self.tasks
+        context = _call_context(frame)
+        return context is not None and context.get(_current_sampler) is self
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                leaf_file = os.path.basename(frame.f_code.co_filename)
+                if thread_id == own_id or leaf_file in IDLE_FRAME_FILES or (leaf_file, frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                if not self._works_for_request(thread_id, frame):
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack = f"{names.get(thread_id, thread_id)};" + ";".join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """The samples in collapsed-stack format, as read by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+def _call_context(frame) -> Optional[contextvars.Context]:
+    """
+    The context a worker thread's current call runs in, found in its worker's frame.
+
+    anyio's worker threads (run_in_threadpool and sync endpoints) hold it in a
+    "context" local, and executor work items submitted as a Context.run partial (as
+    run_in_executor calls that pass their context on do) hold it as their function.
+    """
+    while frame is not None:
+        if frame.f_code.co_name == "run":
+            for value in frame.f_locals.values():
+                if isinstance(value, contextvars.Context):
+                    return value
+                function = getattr(getattr(value, "fn", None), "func", None)
+                if isinstance(getattr(function, "__self__", None), contextvars.Context):
+                    return function.__self__
+        frame = frame.f_back
+    return None
+
+# Event loops the task factory is installed on
+_factory_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop) -> None:
+    """Record the tasks created during a profiled request as the request's, wrapping the loop's own task factory"""
+    if loop in _factory_loops:
+        return
+    _factory_loops.add(loop)
+    previous_factory = loop.get_task_factory()
+
+    def task_factory(loop, coro, **kwargs):
+        task = previous_factory(loop, coro, **kwargs) if previous_factory else asyncio.Task(coro, loop=loop, **kwargs)
+        sampler = _current_sampler.get()
+        if sampler is not None:
+            sampler.tasks.add(task)
+        return task
+    loop.set_task_factory(task_factory)
+
+class ProfileStore:
+    """The most recent request profiles, by request ID"""
+
+    def __init__(self, max_entries: int = PROFILES_KEPT):
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, tuple]" = OrderedDict()  # request ID -> (RequestProfile, collapsed stacks)
+        self._lock = threading.Lock()
+
+    def put(self, profile: RequestProfile, collapsed: str) -> None:
+        with self._lock:
+            self._profiles[profile.request_id] = (profile, collapsed)
+            self._profiles.move_to_end(profile.request_id)
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+
+    def list(self) -> List[RequestProfile]:
+        """Profiles, newest first"""
+        with self._lock:
+            return [profile for profile, _ in reversed(self._profiles.values())]
+
+    def get(self, request_id: str) -> Optional[str]:
+        """A profile's collapsed stacks"""
+        with self._lock:
+            entry = self._profiles.get(request_id)
+            return entry[1] if entry else None
+
+profile_store = ProfileStore()
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests on demand.
+
+    A request carrying an X-Profile header, or a profile=1 query parameter, is sampled
+    from arrival until its response (including a streamed body) is fully sent; only
+    the work done for it is sampled, not that of concurrent requests. The
+    profile is stored under the request's X-Request-ID, or a generated ID, which is
+    returned in the X-Profile-Id response header. Other requests pass straight through.
+    """
+
+    def __init__(self, app: ASGIApp, interval: float = PROFILING_INTERVAL_MS / 1000):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not _wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        status = 500
+
+        async def send_with_id(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        loop = asyncio.get_running_loop()
+        _install_task_factory(loop)
+        sampler = StackSampler(self.interval, loop)
+        sampler.tasks.add(asyncio.current_task())
+        token = _current_sampler.set(sampler)
+        started_at = datetime.now()
+        start_time = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current_sampler.reset(token)
+            await run_in_threadpool(sampler.stop)
+            profile_store.put(RequestProfile(
+                request_id=request_id,
+                method=scope["method"],
+                path=scope["path"],
+                status=status,
+                duration_ms=round((time.perf_counter() - start_time) * 1000, 1),
+                samples=sampler.samples,
+                interval_ms=self.interval * 1000,
+                created_at=started_at
+            ), sampler.collapsed())
+
+def _wants_profile(scope: Scope) -> bool:
+    """Whether a request asks to be profiled"""
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return value.lower() not in (b"", b"0", b"false", b"no")
+    if PROFILE_QUERY_PARAMETER.encode() in scope.get("query_string", b""):
+        values = parse_qs(scope["query_string"].decode("latin-1")).get(PROFILE_QUERY_PARAMETER, [])
+        return any(value.lower() not in ("", "0", "false", "no") for value in values)
+    return False
+
+@router.get("", response_model=RequestProfileList)
+async def list_profiles():
+    """Get the most recent request profiles, newest first"""
+    return RequestProfileList(profiles=profile_store.list())
+
+@router.get("/{request_id}", response_class=PlainTextResponse)
+async def get_profile(request_id: str):
+    """Get a request's profile as collapsed stacks, for flamegraph.pl or speedscope"""
+    collapsed = profile_store.get(request_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail=f"Profile for request '{request_id}' not found")
+    return PlainTextResponse(collapsed)
@@ -1,29 +1,113 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Dict, Any, AsyncIterator
 import os
+import json
+import threading
 
-from app.models.question import QuestionRequest, QuestionResponse
+from app.models.question import QuestionRequest, QuestionResponse, BatchQuestionRequest, BatchQuestionResponse, EnginePoolStats, OpenAIGatewayStats, CoalescingStats
 from app.services.question_service import QuestionService
+from app.services.engine_pool import EnginePool, IndexNotReadyError, openai_gateway, get_engine_pool as get_shared_engine_pool
+from app.services.question_coalescer import QuestionCoalescer
 
 router = APIRouter()
 
 # Get OpenAI API key from environment variable or use a dummy key for development
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "dummy-key")
 
+# Retrieval mode for question answering ("chunk" or "passage")
+QA_RETRIEVAL_MODE = os.environ.get("QA_RETRIEVAL_MODE", "chunk")
+
+# Maximum concurrent completions when answering a batch of questions
+QA_BATCH_CONCURRENCY = int(os.environ.get("QA_BATCH_CONCURRENCY", "8"))
+
+# Relevance/diversity weight for MMR re-selection of retrieved chunks (unset disables MMR)
+QA_MMR_LAMBDA = float(os.environ["QA_MMR_LAMBDA"]) if os.environ.get("QA_MMR_LAMBDA") else None
+
+# Worker threads for CPU-bound question work (search, tokenization) kept off the event loop
+QA_CPU_WORKERS = int(os.environ.get("QA_CPU_WORKERS", "4"))
+
+# Memory budget for warm per-company ThemeQA engines; least recently used companies are evicted beyond it
+QA_ENGINE_MEMORY_MB = int(os.environ.get("QA_ENGINE_MEMORY_MB", "1024"))
+
 # Default paths
 DEFAULT_TRACKEDCOMPANIES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "trackedcompanies")
 DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "output")
 DEFAULT_CACHE_DIR = os.path.join(DEFAULT_OUTPUT_DIR, "cache")
 
+# Process-wide pool of warm engines, created on first use
+_engine_pool: Optional[EnginePool] = None
+_engine_pool_lock = threading.Lock()
+
+def get_engine_pool() -> EnginePool:
+    """Get the process-wide engine pool shared by all question requests"""
+    global _engine_pool
+    with _engine_pool_lock:
+        if _engine_pool is None:
+            _engine_pool = get_shared_engine_pool(
+                api_key=OPENAI_API_KEY,
+                trackedcompanies_dir=DEFAULT_TRACKEDCOMPANIES_DIR,
+                output_dir=DEFAULT_OUTPUT_DIR,
+                retrieval_mode=QA_RETRIEVAL_MODE,
+                mmr_lambda=QA_MMR_LAMBDA,
+                memory_budget_bytes=QA_ENGINE_MEMORY_MB * 1024 * 1024,
+                cpu_workers=QA_CPU_WORKERS
+            )
+        return _engine_pool
+
+# Process-wide coalescer, so identical questions asked at the same time are answered once
+_question_coalescer = QuestionCoalescer()
+
+def get_question_coalescer() -> QuestionCoalescer:
+    """Get the process-wide coalescer for in-flight questions"""
+    return _question_coalescer
+
 def get_question_service(company_id: Optional[str] = None):
     """Get a question service instance, optionally for a specific company"""
     return QuestionService(
         api_key=OPENAI_API_KEY,
         company_id=company_id,
         output_dir=DEFAULT_OUTPUT_DIR,
-        cache_dir=DEFAULT_CACHE_DIR
+        cache_dir=DEFAULT_CACHE_DIR,
+        retrieval_mode=QA_RETRIEVAL_MODE,
+        batch_concurrency=QA_BATCH_CONCURRENCY,
+        mmr_lambda=QA_MMR_LAMBDA,
+        engine_pool=get_engine_pool(),
+        coalescer=get_question_coalescer()
+    )
+
+async def _sse_stream(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Format answer events as Server-Sent Events, reporting failures as an error event"""
+    try:
+        async for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'message': f'Error answering question: {str(e)}'})}\n\n"
+
+def _sse_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """Wrap answer events in an unbuffered text/event-stream response"""
+    return StreamingResponse(
+        _sse_stream(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+@router.get("/engines", response_model=EnginePoolStats)
+async def get_engine_stats():
+    """Get the companies with warm question answering engines, the memory they hold and their load times"""
+    return get_engine_pool().stats()
+
+@router.get("/gateway", response_model=OpenAIGatewayStats)
+async def get_gateway_stats():
+    """Get the shared OpenAI gateway's request, retry and rate limit queueing counters"""
+    return openai_gateway.get_openai_gateway(OPENAI_API_KEY).stats()
+
+@router.get("/coalescing", response_model=CoalescingStats)
+async def get_coalescing_stats():
+    """Get how many questions shared the answer of an identical question already in flight"""
+    return get_question_coalescer().stats()
+
 @router.post("/ask", response_model=QuestionResponse)
 async def ask_question(
     question_request: QuestionRequest,
@@ -34,10 +118,48 @@ async def ask_question(
     try:
         # Use company_id from query parameter or from request body
         company_id = company_id or question_request.company_id
-        return question_service.answer_question(question_request, company_id)
+        return await question_service.aanswer_question(question_request, company_id)
+    except IndexNotReadyError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
+@router.post("/ask/batch", response_model=BatchQuestionResponse)
+async def ask_questions(
+    batch_request: BatchQuestionRequest,
+    company_id: Optional[str] = Query(None, description="ID of the company to ask about"),
+    question_service: QuestionService = Depends(get_question_service)
+):
+    """
+    Ask a batch of questions about one company.
+    
+    Results are returned in order; a question that fails carries an `error` instead of failing the batch.
+    """
+    try:
+        company_id = company_id or batch_request.company_id
+        return await run_in_threadpool(question_service.answer_questions, batch_request, company_id)
+    except IndexNotReadyError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error answering questions: {str(e)}")
+
+@router.post("/ask/stream")
+async def ask_question_stream(
+    question_request: QuestionRequest,
+    company_id: Optional[str] = Query(None, description="ID of the company to ask about"),
+    question_service: QuestionService = Depends(get_question_service)
+):
+    """
+    Ask a question and stream the answer as Server-Sent Events.
+    
+    Emits a `sources` event with the retrieved chunks, `token` events as the answer
+    is generated, and a final `done` event with the full answer, cited sources and timings.
+    """
+    company_id = company_id or question_request.company_id
+    # Load the company's engine before the response starts, so an index that is not built yet is a 503, not an error event
+    await question_service.aload_engine(company_id)
+    return _sse_response(question_service.astream_answer(question_request, company_id))
+
 @router.post("/company/{company_id}/ask", response_model=QuestionResponse)
 async def ask_question_for_company(
     company_id: str,
@@ -46,7 +168,37 @@ async def ask_question_for_company(
     """Ask a question about themes for a specific company"""
     try:
         # Create a question service for this company
-        question_service = get_question_service(company_id)
-        return question_service.answer_question(question_request, company_id)
+        question_service = await run_in_threadpool(get_question_service, company_id)
+        return await question_service.aanswer_question(question_request, company_id)
+    except IndexNotReadyError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error answering question for company {company_id}: {str(e)}")
+
+@router.post("/company/{company_id}/ask/batch", response_model=BatchQuestionResponse)
+async def ask_questions_for_company(
+    company_id: str,
+    batch_request: BatchQuestionRequest
+):
+    """Ask a batch of questions for a specific company"""
+    try:
+        question_service = await run_in_threadpool(get_question_service, company_id)
+        return await run_in_threadpool(question_service.answer_questions, batch_request, company_id)
+    except IndexNotReadyError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error answering questions for company {company_id}: {str(e)}")
+
+@router.post("/company/{company_id}/ask/stream")
+async def ask_question_stream_for_company(
+    company_id: str,
+    question_request: QuestionRequest
+):
+    """Ask a question for a specific company and stream the answer as Server-Sent Events"""
+    try:
+        question_service = await run_in_threadpool(get_question_service, company_id)
+    except IndexNotReadyError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error answering question for company {company_id}: {str(e)}")
+    return _sse_response(question_service.astream_answer(question_request, company_id))
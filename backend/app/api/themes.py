@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from typing import List, Optional
 
+from app.api.caching import payload_cache
+
 from app.models.theme import Theme, ThemeCreate, ThemeList
 from app.services.theme_service import ThemeService
 
@@ -11,21 +13,31 @@ def get_theme_service():
 
 @router.get("/", response_model=List[Theme])
 async def get_all_themes(
+    request: Request,
     company_id: Optional[str] = Query(None, description="Filter themes by company ID"),
+    category: Optional[str] = Query(None, description="Filter themes by category"),
     theme_service: ThemeService = Depends(get_theme_service)
 ):
-    """Get all themes, optionally filtered by company_id"""
-    if company_id:
-        return theme_service.get_themes_by_company(company_id)
-    return theme_service.get_all_themes()
+    """Get all themes, optionally filtered by company_id and category"""
+    return _themes_response(request, theme_service, company_id, category)
 
 @router.get("/company/{company_id}", response_model=List[Theme])
 async def get_themes_by_company(
+    request: Request,
     company_id: str,
+    category: Optional[str] = Query(None, description="Filter themes by category"),
     theme_service: ThemeService = Depends(get_theme_service)
 ):
-    """Get all themes for a specific company"""
-    return theme_service.get_themes_by_company(company_id)
+    """Get all themes for a specific company, optionally filtered by category"""
+    return _themes_response(request, theme_service, company_id, category)
+
+def _themes_response(request: Request, theme_service: ThemeService, company_id: Optional[str], category: Optional[str]):
+    """Serve a theme listing from the payload cache, revalidated against the theme files"""
+    key = ("themes", company_id.lower() if company_id else None, category.lower() if category else None)
+    return payload_cache.response(
+        request, key, theme_service.get_themes_version(company_id),
+        lambda: theme_service.get_all_themes(company_id, category), List[Theme]
+    )
 
 @router.get("/{name}", response_model=Theme)
 async def get_theme_by_name(
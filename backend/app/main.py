@@ -1,5 +1,7 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import uvicorn
 import os
 import sys
@@ -12,12 +14,43 @@ from app.api.themes import router as themes_router
 from app.api.questions import router as questions_router
 from app.api.documents import router as documents_router
 from app.api.companies import router as companies_router
+from app.api.index import router as index_router, get_index_service
+from app.api.extraction import router as extraction_router, get_extraction_service
+from app.api.metrics import router as metrics_router, MetricsMiddleware
+from app.api.profiling import router as profiling_router, ProfilingMiddleware, PROFILING_ENABLED
+from app.api.questions import DEFAULT_TRACKEDCOMPANIES_DIR
+from app.services.engine_pool import IndexNotReadyError
+from app.services.document_service import DocumentService
+from app.services.filings_watcher import FilingsWatcher
+
+# Watch the tracked company directories and ingest new or changed documents as they appear
+FILINGS_WATCH = os.environ.get("FILINGS_WATCH", "").lower() in ("1", "true", "yes")
+FILINGS_WATCH_DEBOUNCE_SECONDS = float(os.environ.get("FILINGS_WATCH_DEBOUNCE_SECONDS", "2"))
+FILINGS_WATCH_POLL_SECONDS = float(os.environ.get("FILINGS_WATCH_POLL_SECONDS", "5"))  # Only used without inotify
+
+def ingest_new_document(company_id: str, path: str) -> None:
+    """Make a new or changed document visible: list it, add it to the company's index and extract its themes"""
+    DocumentService().catalog.invalidate(company_id)
+    get_index_service().start_ingest(company_id, path)
+    get_extraction_service().start_extraction(company_id, documents=[path])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watcher = None
+    if FILINGS_WATCH:
+        watcher = FilingsWatcher(DEFAULT_TRACKEDCOMPANIES_DIR, ingest_new_document,
+                                 debounce=FILINGS_WATCH_DEBOUNCE_SECONDS, poll_interval=FILINGS_WATCH_POLL_SECONDS)
+        watcher.start()
+    yield
+    if watcher is not None:
+        watcher.stop()
 
 # Create FastAPI app
 app = FastAPI(
     title="Company Theme Extraction API",
     description="API for extracting and querying themes from company documents",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -29,11 +62,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profile requests that ask for it; not installed at all unless enabled
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Count and time every request per route, for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(companies_router, prefix="/api/companies", tags=["companies"])
 app.include_router(themes_router, prefix="/api/themes", tags=["themes"])
 app.include_router(questions_router, prefix="/api/questions", tags=["questions"])
 app.include_router(documents_router, prefix="/api/documents", tags=["documents"])
+app.include_router(index_router, prefix="/api/index", tags=["index"])
+app.include_router(extraction_router, prefix="/api/extraction", tags=["extraction"])
+app.include_router(metrics_router, tags=["metrics"])
+if PROFILING_ENABLED:
+    app.include_router(profiling_router, prefix="/api/profiles", tags=["profiling"])
+
+@app.exception_handler(IndexNotReadyError)
+async def index_not_ready_handler(request: Request, exc: IndexNotReadyError):
+    """Answer 503 while a company's index is built in the background; the engine pool has already queued the build"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "job_id": exc.job_id},
+        headers={"Retry-After": "30"}
+    )
 
 @app.get("/")
 async def root():
@@ -1,4 +1,7 @@
 # Import models for easier access
 from .theme import Theme, ThemeBase, ThemeCreate, ThemeList
-from .question import QuestionRequest, QuestionResponse, QuestionHistory
-from .document import Document, DocumentList
+from .question import QuestionRequest, QuestionResponse, QuestionHistory, QuestionFilters, BatchQuestionRequest, BatchQuestionResult, BatchQuestionResponse, EngineStats, EnginePoolStats, GatewayRateLimit, OpenAIGatewayStats, CoalescingStats
+from .document import Document, DocumentList, DocumentUpload
+from .index import IndexJob, IndexJobList, CompanyIndexStatus, IndexReadiness
+from .extraction import ExtractionJob, ExtractionJobList
+from .profile import RequestProfile, RequestProfileList
@@ -2,6 +2,8 @@ from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
+from .index import IndexJob
+
 class Document(BaseModel):
     """Model for a document"""
     company_id: str = Field(..., description="ID of the company this document belongs to")
@@ -15,3 +17,8 @@ class Document(BaseModel):
 class DocumentList(BaseModel):
     """Model for a list of documents"""
     documents: List[Document] = Field(..., description="List of documents")
+
+class DocumentUpload(BaseModel):
+    """Model for an accepted document upload"""
+    document: Document = Field(..., description="The stored document")
+    job: IndexJob = Field(..., description="Index job ingesting the document")
@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+
+class ExtractionJob(BaseModel):
+    """Model for a background theme extraction run"""
+    job_id: str = Field(..., description="ID of the job")
+    company_id: str = Field(..., description="ID of the company whose themes are being extracted")
+    documents: Optional[List[str]] = Field(None, description="Paths of the documents to extract themes from, or None for all of the company's documents")
+    status: str = Field(..., description="Job status (queued, running, completed, failed, cancelled)")
+    phase: Optional[str] = Field(None, description="Phase of a running job: reading documents, or extracting themes from their chunks")
+    files_total: int = Field(0, description="Documents discovered")
+    files_done: int = Field(0, description="Documents finished or skipped as unchanged")
+    chunks_total: int = Field(0, description="Chunks of the changed documents to extract themes from")
+    chunks_done: int = Field(0, description="Chunks analyzed so far")
+    themes_found: int = Field(0, description="Themes found so far, before merging with existing themes")
+    tokens_used: int = Field(0, description="OpenAI tokens used so far")
+    chunks_per_minute: Optional[float] = Field(None, description="Chunks analyzed per minute since extraction started")
+    eta_seconds: Optional[float] = Field(None, description="Estimated seconds until the remaining chunks are analyzed")
+    error: Optional[str] = Field(None, description="Error message if the job failed")
+    created_at: datetime = Field(..., description="When the job was requested")
+    started_at: Optional[datetime] = Field(None, description="When the job started running")
+    finished_at: Optional[datetime] = Field(None, description="When the job finished")
+
+class ExtractionJobList(BaseModel):
+    """Model for a list of theme extraction jobs"""
+    jobs: List[ExtractionJob] = Field(default_factory=list, description="Theme extraction jobs, newest first")
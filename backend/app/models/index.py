@@ -0,0 +1,35 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+
+class IndexJob(BaseModel):
+    """Model for a background index build job"""
+    job_id: str = Field(..., description="ID of the job")
+    company_id: str = Field(..., description="ID of the company whose index is being built")
+    kind: str = Field("build", description="Job kind: a full index build, or the ingestion of one document")
+    document: Optional[str] = Field(None, description="Path of the document being ingested, for ingest jobs")
+    status: str = Field(..., description="Job status (queued, running, completed, failed, cancelled)")
+    documents_done: int = Field(0, description="Documents processed so far")
+    documents_total: int = Field(0, description="Documents to process")
+    version: Optional[str] = Field(None, description="Index version made live when the job completed")
+    error: Optional[str] = Field(None, description="Error message if the job failed")
+    created_at: datetime = Field(..., description="When the job was requested")
+    started_at: Optional[datetime] = Field(None, description="When the job started running")
+    finished_at: Optional[datetime] = Field(None, description="When the job finished")
+
+class IndexJobList(BaseModel):
+    """Model for a list of index build jobs"""
+    jobs: List[IndexJob] = Field(default_factory=list, description="Index build jobs, newest first")
+
+class CompanyIndexStatus(BaseModel):
+    """Model for whether a company's questions can be answered"""
+    company_id: str = Field(..., description="ID of the company")
+    ready: bool = Field(..., description="Whether the company has an index that questions can be served from")
+    version: Optional[str] = Field(None, description="Live index version")
+    loaded: bool = Field(False, description="Whether the index is loaded in memory")
+    building_job_id: Optional[str] = Field(None, description="ID of the index build in progress, if any")
+
+class IndexReadiness(BaseModel):
+    """Model for index readiness across companies"""
+    companies: List[CompanyIndexStatus] = Field(default_factory=list, description="Index status per company")
+    ready_companies: List[str] = Field(default_factory=list, description="Companies whose questions can be answered")
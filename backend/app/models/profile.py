@@ -0,0 +1,18 @@
+from pydantic import BaseModel, Field
+from typing import List
+from datetime import datetime
+
+class RequestProfile(BaseModel):
+    """Model for a profiled request"""
+    request_id: str = Field(..., description="ID the profile is stored under (the request's X-Request-ID, or a generated one)")
+    method: str = Field(..., description="HTTP method")
+    path: str = Field(..., description="Requested path")
+    status: int = Field(..., description="Response status code")
+    duration_ms: float = Field(..., description="Time from arrival until the response was fully sent")
+    samples: int = Field(..., description="Number of stack samples taken")
+    interval_ms: float = Field(..., description="Time between stack samples")
+    created_at: datetime = Field(..., description="When the request arrived")
+
+class RequestProfileList(BaseModel):
+    """Model for a list of request profiles"""
+    profiles: List[RequestProfile] = Field(default_factory=list, description="Request profiles, newest first")
@@ -1,10 +1,18 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
+class QuestionFilters(BaseModel):
+    """Model for metadata filters that restrict which documents a question searches"""
+    sources: List[str] = Field(default_factory=list, description="Only search these document filenames")
+    types: List[str] = Field(default_factory=list, description="Only search these document types (pdf, json)")
+    periods: List[str] = Field(default_factory=list, description="Only search these fiscal periods (e.g. 'Q3-24', '2024Q3', 'FY24')")
+    companies: List[str] = Field(default_factory=list, description="Search these companies instead of the one asked about ('*' for all companies)")
+
 class QuestionRequest(BaseModel):
     """Model for a question request"""
     question: str = Field(..., description="Question to answer")
     company_id: Optional[str] = Field(None, description="ID of the company to ask about")
+    filters: Optional[QuestionFilters] = Field(None, description="Metadata filters applied inside the vector search")
     
 class QuestionResponse(BaseModel):
     """Model for a question response"""
@@ -13,6 +21,58 @@ class QuestionResponse(BaseModel):
     sources: List[str] = Field(default_factory=list, description="Sources used to answer the question")
     company_id: Optional[str] = Field(None, description="ID of the company the question was about")
     
+class BatchQuestionRequest(BaseModel):
+    """Model for a batch of questions about one company"""
+    questions: List[str] = Field(..., min_length=1, max_length=100, description="Questions to answer")
+    company_id: Optional[str] = Field(None, description="ID of the company to ask about")
+    filters: Optional[QuestionFilters] = Field(None, description="Metadata filters applied to every question")
+
+class BatchQuestionResult(QuestionResponse):
+    """Model for one answer in a batch response"""
+    answer: Optional[str] = Field(None, description="Answer to the question, if one was generated")
+    error: Optional[str] = Field(None, description="Error message if this question could not be answered")
+
+class BatchQuestionResponse(BaseModel):
+    """Model for a batch question response"""
+    results: List[BatchQuestionResult] = Field(default_factory=list, description="Answers, in the order the questions were asked")
+
+class EngineStats(BaseModel):
+    """Model for one company's warm question answering engine"""
+    company_id: str = Field(..., description="ID of the company")
+    bytes: int = Field(..., description="Approximate memory held by the engine's index partition and document text")
+    load_seconds: float = Field(..., description="Time taken to load the engine")
+
+class EnginePoolStats(BaseModel):
+    """Model for the warm engine pool statistics"""
+    companies: List[EngineStats] = Field(default_factory=list, description="Resident companies, most recently used first")
+    partition_bytes: int = Field(0, description="Approximate memory held by index partitions loaded without an engine (cross-company searches, index builds)")
+    total_bytes: int = Field(..., description="Approximate memory held by every loaded index partition, the resident engines' and the others'")
+    memory_budget_bytes: int = Field(..., description="Memory budget beyond which least recently used engines are evicted")
+    hits: int = Field(..., description="Requests served by an already loaded engine")
+    misses: int = Field(..., description="Requests that had to load an engine")
+    evictions: int = Field(..., description="Engines evicted and partitions unloaded to stay within the memory budget")
+
+class GatewayRateLimit(BaseModel):
+    """Model for the rate limits of one operation on one model"""
+    requests_per_minute: int = Field(..., description="Configured requests-per-minute limit")
+    tokens_per_minute: int = Field(..., description="Configured tokens-per-minute limit")
+
+class OpenAIGatewayStats(BaseModel):
+    """Model for the shared OpenAI gateway's admission and retry statistics"""
+    requests: int = Field(..., description="Requests admitted, including retries")
+    retries: int = Field(..., description="Requests retried after a rate limit, server or connection error")
+    errors: int = Field(..., description="Requests that failed after exhausting their retries")
+    throttled: int = Field(..., description="Requests that waited for rate limit admission")
+    queued_seconds: float = Field(..., description="Total time requests waited for admission")
+    max_queued_seconds: float = Field(..., description="Longest time a request waited for admission")
+    limits: Dict[str, GatewayRateLimit] = Field(default_factory=dict, description="Rate limits of each operation/model used so far")
+
+class CoalescingStats(BaseModel):
+    """Model for single-flight coalescing of identical in-flight questions"""
+    leaders: int = Field(..., description="Questions answered by their own retrieval and generation")
+    coalesced: int = Field(..., description="Questions that shared the answer of an identical question already in flight")
+    in_flight: int = Field(..., description="Distinct questions currently being answered")
+
 class QuestionHistory(BaseModel):
     """Model for question history"""
     questions: List[QuestionResponse] = Field(default_factory=list, description="List of previous questions and answers")
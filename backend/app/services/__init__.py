@@ -1,4 +1,16 @@
-# Import services for easier access
-from .theme_service import ThemeService
-from .question_service import QuestionService
-from .document_service import DocumentService
+# Services for easier access, imported on first use so that importing one service
+# does not load the others (and the question answering dependencies with them)
+import importlib
+
+_SERVICES = {
+    "ThemeService": ".theme_service",
+    "QuestionService": ".question_service",
+    "DocumentService": ".document_service",
+    "EnginePool": ".engine_pool",
+    "IndexService": ".index_service",
+}
+
+def __getattr__(name: str):
+    if name not in _SERVICES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_SERVICES[name], __name__), name)
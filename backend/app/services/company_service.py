@@ -1,98 +1,61 @@
 import os
+import sys
 import json
 from typing import List, Dict, Any, Optional
 
+# Add the scripts directory to sys.path
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "scripts")
+sys.path.append(scripts_dir)
+
 from app.models.company import Company
+from filings_db import get_filings_db, COMPANIES_VERSION
 
 # Constants
 DEFAULT_COMPANIES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "companies.json")
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "output")
 
 class CompanyService:
     """Service for managing companies"""
     
-    def __init__(self, companies_file: str = DEFAULT_COMPANIES_FILE):
+    def __init__(self, companies_file: str = DEFAULT_COMPANIES_FILE, output_dir: str = DEFAULT_OUTPUT_DIR):
         self.companies_file = companies_file
         os.makedirs(os.path.dirname(self.companies_file), exist_ok=True)
         
         # Initialize with default companies if file doesn't exist
         if not os.path.exists(self.companies_file):
             self._initialize_default_companies()
+        
+        # Companies are stored in the filings database; companies.json is imported on first use
+        self.db = get_filings_db(output_dir, self.companies_file)
     
     def get_all_companies(self) -> List[Company]:
         """Get all companies"""
-        companies = self._load_companies()
-        return companies
+        return [Company.model_validate(company) for company in self.db.list_companies()]
+    
+    def get_companies_version(self) -> str:
+        """Version of the companies; changes whenever they may have"""
+        return str(self.db.version(COMPANIES_VERSION))
     
     def get_company_by_id(self, company_id: str) -> Optional[Company]:
         """Get a company by ID"""
-        companies = self._load_companies()
-        for company in companies:
-            if company.id.lower() == company_id.lower():
-                return company
-        return None
+        company = self.db.get_company(company_id)
+        return Company.model_validate(company) if company is not None else None
     
     def create_company(self, company: Company) -> Company:
         """Create a new company"""
-        companies = self._load_companies()
-        
-        # Check if company with same ID already exists
-        for existing_company in companies:
-            if existing_company.id.lower() == company.id.lower():
-                raise ValueError(f"Company with ID '{company.id}' already exists")
-        
-        # Add company to list
-        companies.append(company)
-        
-        # Save companies
-        self._save_companies(companies)
-        
+        if not self.db.insert_company(company.model_dump()):
+            raise ValueError(f"Company with ID '{company.id}' already exists")
         return company
     
     def update_company(self, company_id: str, company: Company) -> Optional[Company]:
         """Update an existing company"""
-        companies = self._load_companies()
-        
-        # Find company with matching ID
-        for i, existing_company in enumerate(companies):
-            if existing_company.id.lower() == company_id.lower():
-                # Replace company in list
-                companies[i] = company
-                
-                # Save companies
-                self._save_companies(companies)
-                
-                return company
-        
-        return None
+        if not self.db.update_company(company_id, company.model_dump()):
+            return None
+        return company
     
     def delete_company(self, company_id: str) -> bool:
         """Delete a company"""
-        companies = self._load_companies()
-        
-        # Find company with matching ID
-        for i, existing_company in enumerate(companies):
-            if existing_company.id.lower() == company_id.lower():
-                # Remove company from list
-                companies.pop(i)
-                
-                # Save companies
-                self._save_companies(companies)
-                
-                return True
-        
-        return False
-    
-    def _load_companies(self) -> List[Company]:
-        """Load companies from file"""
-        if os.path.exists(self.companies_file):
-            try:
-                with open(self.companies_file, 'r', encoding='utf-8') as file:
-                    company_data = json.load(file)
-                    return [Company.model_validate(company) for company in company_data]
-            except Exception as e:
-                print(f"Error loading companies: {str(e)}")
-                return self._get_default_companies()
-        return self._get_default_companies()
+        return self.db.delete_company(company_id)
     
     def _save_companies(self, companies: List[Company]) -> None:
         """Save companies to file"""
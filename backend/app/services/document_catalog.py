@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+# Add the scripts directory to sys.path
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "scripts")
+sys.path.append(scripts_dir)
+
+# Import models
+from app.models.document import Document
+from filings_db import FilingsDatabase, PROCESSED_FILES_VERSION
+
+# Document file types tracked by the catalog
+DOCUMENT_EXTENSIONS = ('.pdf', '.json')
+
+# Minimum seconds between stat rescans of a company directory
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("DOCUMENT_CATALOG_REFRESH_SECONDS", "5"))
+
+class DocumentCatalog:
+    """
+    Persistent catalog of the documents in the tracked company directories.
+
+    Entries are keyed by path and indexed by company, type and content hash, so listing a company
+    costs O(results) and looking up a path costs O(1). Freshness comes from stat-based
+    revalidation: at most once per refresh interval, a company directory is walked and
+    each file's size and mtime are compared with the catalog. Only new or changed files
+    are hashed, so the corpus is hashed once and then only as it changes. Files are
+    hashed without holding the catalog lock, so a scan never blocks readers of other
+    companies; scans of the same directory run one at a time. The catalog is saved to
+    disk whenever it changes, so a restart does not re-hash anything.
+    """
+
+    def __init__(self, catalog_file: str, filings_db: FilingsDatabase, refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.catalog_file = catalog_file
+        self.filings_db = filings_db
+        self.refresh_interval = refresh_interval
+
+        self._entries: Dict[str, Dict[str, Any]] = {}  # path -> company_id, filename, type, size, mtime_ns, hash
+        self._by_company: Dict[str, Dict[str, None]] = {}  # company_id -> paths, in scan order
+        self._by_type: Dict[str, Dict[str, None]] = {}  # type -> paths
+        self._by_hash: Dict[str, Dict[str, None]] = {}  # content hash -> paths
+        self._documents: Dict[str, Document] = {}  # path -> Document, built on first read
+        self._scanned_at: Dict[Tuple[str, str], float] = {}  # (company_id, company_dir) -> time of last scan
+        self._scan_locks: Dict[Tuple[str, str], threading.Lock] = {}  # (company_id, company_dir) -> held while scanning it
+        self._processed_files: Dict[str, Any] = {}
+        self._processed_version: Optional[int] = None
+        self._version = 0  # Bumped on every change to the entries or the processed file info
+        self._lock = threading.RLock()
+
+        self._load()
+
+    def list_documents(self, company_id: str, company_dir: str) -> List[Document]:
+        """Get a company's documents, rescanning its directory if the last scan is older than the refresh interval"""
+        self._revalidate(company_id, company_dir)
+        with self._lock:
+            self._refresh_processed_files()
+            return [self._document(path) for path in self._by_company.get(company_id.lower(), {})]
+
+    def list_by_type(self, doc_type: str, roots: List[Tuple[str, str]]) -> List[Document]:
+        """Get the documents of a type ("PDF" or "JSON") under the given (company_id, company_dir) roots"""
+        for company_id, company_dir in roots:
+            self._revalidate(company_id, company_dir)
+        company_ids = {company_id.lower() for company_id, _ in roots}
+        with self._lock:
+            self._refresh_processed_files()
+            return [self._document(path) for path in self._by_type.get(doc_type.upper(), {})
+                    if self._entries[path]["company_id"] in company_ids]
+
+    def version(self, roots: List[Tuple[str, str]]) -> int:
+        """Revalidate the given (company_id, company_dir) roots and return the catalog version"""
+        for company_id, company_dir in roots:
+            self._revalidate(company_id, company_dir)
+        with self._lock:
+            self._refresh_processed_files()
+            return self._version
+
+    def get_document(self, path: str, roots: List[Tuple[str, str]]) -> Optional[Document]:
+        """
+        Get a document by path.
+
+        A cataloged path is revalidated with a single stat. An unknown path may be a
+        new file, so the given (company_id, company_dir) roots are rescanned if stale.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None:
+            self._revalidate_file(path, entry["company_id"])
+        else:
+            for company_id, company_dir in roots:
+                self._revalidate(company_id, company_dir)
+        with self._lock:
+            self._refresh_processed_files()
+            return self._document(path) if path in self._entries else None
+
+    def find_by_hash(self, file_hash: str, company_id: str, company_dir: Optional[str] = None) -> Optional[Document]:
+        """
+        Get a company's document with the given content hash, if there is one.
+
+        company_dir is rescanned first if stale; leave it out while holding exclusive(),
+        since a scan must not start under the catalog lock.
+        """
+        if company_dir is not None:
+            self._revalidate(company_id, company_dir)
+        with self._lock:
+            self._refresh_processed_files()
+            for path in self._by_hash.get(file_hash, {}):
+                if self._entries[path]["company_id"] == company_id.lower():
+                    return self._document(path)
+            return None
+
+    def register(self, path: str, company_id: str, file_hash: str) -> Document:
+        """Add a file whose hash the caller already computed, such as a fresh upload, without re-reading it"""
+        with self._lock:
+            stat = os.stat(path)
+            self._add(path, {
+                "company_id": company_id.lower(),
+                "filename": os.path.basename(path),
+                "type": path.split('.')[-1].upper(),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": file_hash
+            })
+            self._save()
+            return self._document(path)
+
+    def exclusive(self) -> threading.RLock:
+        """The catalog lock, for callers that must look up and then register as one step (without rescanning meanwhile)"""
+        return self._lock
+
+    def invalidate(self, company_id: Optional[str] = None) -> None:
+        """Force the next read to rescan a company's directory (or every directory)"""
+        with self._lock:
+            for root in list(self._scanned_at):
+                if company_id is None or root[0] == company_id.lower():
+                    del self._scanned_at[root]
+
+    def _revalidate(self, company_id: str, company_dir: str) -> None:
+        """Rescan a company directory if the refresh interval has passed (caller must not hold the lock)"""
+        company_id = company_id.lower()
+        root = (company_id, company_dir)
+        with self._lock:
+            scan_lock = self._scan_locks.setdefault(root, threading.Lock())
+        with scan_lock:
+            now = time.monotonic()
+            with self._lock:
+                if now - self._scanned_at.get(root, float("-inf")) < self.refresh_interval:
+                    return
+
+            # Stat and hash outside the lock; each changed file is inserted on its own
+            changed = False
+            seen = set()
+            if os.path.exists(company_dir):
+                for walk_root, _, files in os.walk(company_dir):
+                    for file in files:
+                        if not file.lower().endswith(DOCUMENT_EXTENSIONS):
+                            continue
+                        path = os.path.join(walk_root, file)
+                        seen.add(path)
+                        changed |= self._revalidate_file(path, company_id, save=False)
+
+            with self._lock:
+                # Drop files that were deleted since the last scan (not ones registered during it)
+                for path in [path for path in self._by_company.get(company_id, {}) if path not in seen and not os.path.exists(path)]:
+                    self._remove(path)
+                    changed = True
+                self._scanned_at[root] = now
+                if changed:
+                    self._save()
+
+    def _revalidate_file(self, path: str, company_id: str, save: bool = True) -> bool:
+        """
+        Re-hash a file if its size or mtime changed; returns whether the catalog changed.
+
+        The file is hashed without holding the lock, then stat'ed again: if it changed
+        while being hashed, it is left for the next scan rather than cataloged with a
+        stale hash. The caller must not hold the lock.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                if path not in self._entries:
+                    return False
+                self._remove(path)
+                if save:
+                    self._save()
+                return True
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return False
+
+        file_hash = self._get_file_hash(path)
+        try:
+            hashed_stat = os.stat(path)
+        except OSError:
+            return False
+        if (hashed_stat.st_size, hashed_stat.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return False
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return False  # Cataloged by another thread meanwhile
+            self._add(path, {
+                "company_id": company_id,
+                "filename": os.path.basename(path),
+                "type": path.split('.')[-1].upper(),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": file_hash
+            })
+            if save:
+                self._save()
+            return True
+
+    def _add(self, path: str, entry: Dict[str, Any]) -> None:
+        """Insert or replace an entry and its index references"""
+        if path in self._entries:
+            self._remove(path)
+        self._entries[path] = entry
+        self._version += 1
+        self._by_company.setdefault(entry["company_id"], {})[path] = None
+        self._by_type.setdefault(entry["type"], {})[path] = None
+        self._by_hash.setdefault(entry["hash"], {})[path] = None
+
+    def _remove(self, path: str) -> None:
+        """Remove an entry and its index references"""
+        entry = self._entries.pop(path)
+        self._version += 1
+        self._by_company.get(entry["company_id"], {}).pop(path, None)
+        self._by_type.get(entry["type"], {}).pop(path, None)
+        self._by_hash.get(entry["hash"], {}).pop(path, None)
+        self._documents.pop(path, None)
+
+    def _document(self, path: str) -> Document:
+        """The Document for a cataloged path, built once per entry or processed-files change"""
+        document = self._documents.get(path)
+        if document is None:
+            entry = self._entries[path]
+            processed = path in self._processed_files
+            processed_date = None
+
+            if processed:
+                # Convert timestamp to datetime if available
+                if isinstance(self._processed_files[path], dict) and "timestamp" in self._processed_files[path]:
+                    try:
+                        processed_date = datetime.fromisoformat(self._processed_files[path]["timestamp"])
+                    except:
+                        pass
+
+            document = Document(
+                company_id=entry["company_id"],
+                filename=entry["filename"],
+                path=path,
+                type=entry["type"],
+                processed=processed,
+                processed_date=processed_date,
+                hash=entry["hash"]
+            )
+            self._documents[path] = document
+        return document
+
+    def _refresh_processed_files(self) -> None:
+        """Reload processed file info if it changed in the filings database (caller holds the lock)"""
+        processed_version = self.filings_db.version(PROCESSED_FILES_VERSION)
+        if processed_version == self._processed_version:
+            return
+        self._processed_version = processed_version
+        try:
+            self._processed_files = self.filings_db.get_processed_files()
+        except Exception as e:
+            print(f"Error loading processed files info: {str(e)}")
+            self._processed_files = {}
+        # Processed flags and dates are baked into the cached documents
+        self._documents.clear()
+        self._version += 1
+
+    def _load(self) -> None:
+        """Load the catalog saved by a previous run"""
+        if not os.path.exists(self.catalog_file):
+            return
+        try:
+            with open(self.catalog_file, 'r', encoding='utf-8') as file:
+                for path, entry in json.load(file).get("entries", {}).items():
+                    self._add(path, entry)
+        except Exception as e:
+            print(f"Error loading document catalog: {str(e)}")
+
+    def _save(self) -> None:
+        """Save the catalog, replacing the previous file in one rename"""
+        try:
+            os.makedirs(os.path.dirname(self.catalog_file), exist_ok=True)
+            with open(self.catalog_file + ".tmp", 'w', encoding='utf-8') as file:
+                json.dump({"entries": self._entries}, file)
+            os.replace(self.catalog_file + ".tmp", self.catalog_file)
+        except Exception as e:
+            print(f"Error saving document catalog: {str(e)}")
+
+    @staticmethod
+    def _get_file_hash(file_path: str) -> str:
+        """Calculate MD5 hash of a file to detect changes"""
+        try:
+            md5 = hashlib.md5()
+            with open(file_path, 'rb') as file:
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    md5.update(block)
+            return md5.hexdigest()
+        except Exception as e:
+            print(f"Error calculating file hash: {str(e)}")
+            return ""
+
+# One catalog per catalog file, shared by every DocumentService in the process
+_catalogs: Dict[str, DocumentCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+def get_document_catalog(catalog_file: str, filings_db: FilingsDatabase) -> DocumentCatalog:
+    """Get the process-wide catalog stored in catalog_file"""
+    catalog_file = os.path.abspath(catalog_file)
+    with _catalogs_lock:
+        if catalog_file not in _catalogs:
+            _catalogs[catalog_file] = DocumentCatalog(catalog_file, filings_db)
+        return _catalogs[catalog_file]
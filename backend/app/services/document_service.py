@@ -1,9 +1,8 @@
 import os
 import sys
-import json
+import uuid
 import hashlib
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import List, Optional, Tuple, BinaryIO
 
 # Add the parent directory to sys.path to allow importing the theme_extractor module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -14,11 +13,30 @@ sys.path.append(scripts_dir)
 
 # Import models
 from app.models.document import Document, DocumentList
+from app.models.company import Company
 from app.services.company_service import CompanyService
+from app.services.document_catalog import get_document_catalog, DOCUMENT_EXTENSIONS
+from filings_db import get_filings_db
 
 # Constants
 DEFAULT_PROCESSED_FILES_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "output", "processed_files.json")
 DEFAULT_TRACKEDCOMPANIES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "trackedcompanies")
+DOCUMENT_CATALOG_FILE = "document_catalog.json"  # Saved next to processed_files.json
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Uploads are copied and hashed in chunks of this many bytes
+
+class DuplicateDocumentError(Exception):
+    """Raised when an uploaded document has the same content as one the company already has"""
+
+    def __init__(self, document: Document):
+        super().__init__(f"Document already exists: {document.path}")
+        self.document = document
+
+class DocumentNameConflictError(Exception):
+    """Raised when an uploaded document's file name is taken by a document with different content"""
+
+    def __init__(self, path: str):
+        super().__init__(f"A different document named {os.path.basename(path)} already exists: {path}")
+        self.path = path
 
 class DocumentService:
     """Service for managing documents"""
@@ -32,96 +50,92 @@ class DocumentService:
         self.company_id = company_id
         self.company_service = CompanyService()
         os.makedirs(os.path.dirname(self.processed_files_json), exist_ok=True)
+        
+        # Shared catalog so documents are scanned and hashed once, not on every request
+        # Processed file info lives in the filings database next to processed_files.json, which it is imported from
+        output_dir = os.path.dirname(self.processed_files_json)
+        self.catalog = get_document_catalog(os.path.join(output_dir, DOCUMENT_CATALOG_FILE), get_filings_db(output_dir))
     
     def get_all_documents(self, company_id: Optional[str] = None) -> List[Document]:
         """Get all documents, optionally filtered by company_id"""
         # Use provided company_id or the one set in the constructor
         company_id = company_id or self.company_id
         
-        # Get processed files info
-        processed_files = self._load_processed_files()
-        
-        # Find all PDF and JSON files
         documents = []
-        
+        for root_company_id, company_dir in self._company_dirs(company_id):
+            documents.extend(self.catalog.list_documents(root_company_id, company_dir))
+        return documents
+    
+    def _company_dirs(self, company_id: Optional[str] = None) -> List[Tuple[str, str]]:
+        """The (company_id, directory) pairs to read documents from"""
         # If company_id is provided, only look in that company's directory
         if company_id:
-            company_dir = os.path.join(self.trackedcompanies_dir, company_id.capitalize())
-            if not os.path.exists(company_dir):
-                return []
-            self._process_company_directory(company_dir, company_id, processed_files, documents)
-        else:
-            # Otherwise, look in all company directories
-            for company in self.company_service.get_all_companies():
-                company_dir = os.path.join(self.trackedcompanies_dir, company.name)
-                if os.path.exists(company_dir):
-                    self._process_company_directory(company_dir, company.id, processed_files, documents)
-        
-        return documents
+            company = self.company_service.get_company_by_id(company_id)
+            if company is None:
+                return [(company_id, os.path.join(self.trackedcompanies_dir, company_id.capitalize()))]
+            return [self._company_dir(company)]
+        # Otherwise, look in all company directories
+        return [self._company_dir(company) for company in self.company_service.get_all_companies()]
     
-    def _process_company_directory(self, company_dir: str, company_id: str, processed_files: Dict, documents: List[Document]) -> None:
-        """Process a company directory and add documents to the list"""
-        for root, _, files in os.walk(company_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                
-                if file.lower().endswith('.pdf') or file.lower().endswith('.json'):
-                    # Get file hash
-                    file_hash = self._get_file_hash(file_path)
-                    
-                    # Check if file has been processed
-                    processed = file_path in processed_files
-                    processed_date = None
-                    
-                    if processed:
-                        # Convert timestamp to datetime if available
-                        if isinstance(processed_files[file_path], dict) and "timestamp" in processed_files[file_path]:
-                            try:
-                                processed_date = datetime.fromisoformat(processed_files[file_path]["timestamp"])
-                            except:
-                                pass
-                    
-                    # Create document
-                    document = Document(
-                        company_id=company_id,
-                        filename=file,
-                        path=file_path,
-                        type=file.split('.')[-1].upper(),
-                        processed=processed,
-                        processed_date=processed_date,
-                        hash=file_hash
-                    )
-                    
-                    documents.append(document)
+    def _company_dir(self, company: Company) -> Tuple[str, str]:
+        """A company's (company_id, directory) pair; the same whether one or all companies are listed, so the catalog sees one root per company"""
+        return (company.id, os.path.join(self.trackedcompanies_dir, company.name))
     
     def get_document_by_path(self, path: str) -> Optional[Document]:
         """Get a document by path"""
-        documents = self.get_all_documents()
-        for document in documents:
-            if document.path == path:
-                return document
-        return None
+        return self.catalog.get_document(path, self._company_dirs())
+    
+    def get_documents_by_type(self, doc_type: str, company_id: Optional[str] = None) -> List[Document]:
+        """Get all documents of a type (PDF, JSON), optionally for one company"""
+        return self.catalog.list_by_type(doc_type, self._company_dirs(company_id or self.company_id))
+    
+    def get_documents_version(self, company_id: Optional[str] = None) -> str:
+        """Version of the documents listed for company_id (or all companies); changes whenever they may have"""
+        roots = self._company_dirs(company_id or self.company_id)
+        return f"{self.catalog.version(roots)}:{','.join(root_company_id.lower() for root_company_id, _ in roots)}"
     
     def get_documents_by_company(self, company_id: str) -> List[Document]:
         """Get all documents for a specific company"""
         return self.get_all_documents(company_id)
     
-    def _load_processed_files(self) -> Dict[str, Any]:
-        """Load information about processed files"""
-        if os.path.exists(self.processed_files_json):
-            try:
-                with open(self.processed_files_json, 'r', encoding='utf-8') as file:
-                    return json.load(file)
-            except Exception as e:
-                print(f"Error loading processed files info: {str(e)}")
-                return {}
-        return {}
-    
-    def _get_file_hash(self, file_path: str) -> str:
-        """Calculate MD5 hash of a file to detect changes"""
+    def store_upload(self, company_id: str, filename: str, source: BinaryIO) -> Document:
+        """
+        Save an uploaded document into a company's directory and catalog it.
+
+        The upload is copied in chunks to a temporary file while its MD5 is computed,
+        so memory use does not grow with the file. A document whose content the company
+        already has is rejected with DuplicateDocumentError, and one whose file name is
+        taken by a different document with DocumentNameConflictError; otherwise the file
+        is moved into place with a single rename. The checks, the rename and cataloging
+        the file happen under the catalog lock, so concurrent uploads cannot both pass.
+        """
+        filename = os.path.basename(filename or "")
+        if not filename.lower().endswith(DOCUMENT_EXTENSIONS):
+            raise ValueError(f"Unsupported document type: '{filename}' (expected {', '.join(DOCUMENT_EXTENSIONS)})")
+        
+        root_company_id, company_dir = self._company_dirs(company_id)[0]
+        os.makedirs(company_dir, exist_ok=True)
+        temp_path = os.path.join(company_dir, f".upload-{uuid.uuid4().hex}.tmp")
         try:
-            with open(file_path, 'rb') as file:
-                return hashlib.md5(file.read()).hexdigest()
-        except Exception as e:
-            print(f"Error calculating file hash: {str(e)}")
-            return ""
+            md5 = hashlib.md5()
+            with open(temp_path, 'wb') as file:
+                for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                    md5.update(chunk)
+                    file.write(chunk)
+            file_hash = md5.hexdigest()
+            
+            path = os.path.join(company_dir, filename)
+            # Rescan the directory first; the re-check under the lock only reads the catalog
+            existing = self.catalog.find_by_hash(file_hash, root_company_id, company_dir)
+            with self.catalog.exclusive():
+                existing = existing or self.catalog.find_by_hash(file_hash, root_company_id)
+                if existing is not None:
+                    raise DuplicateDocumentError(existing)
+                if os.path.exists(path):
+                    raise DocumentNameConflictError(path)
+                
+                os.replace(temp_path, path)
+                return self.catalog.register(path, root_company_id, file_hash)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, Tuple
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Add the scripts directory to sys.path
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "scripts")
+sys.path.append(scripts_dir)
+
+from app.services.lazy_module import LazyModule
+from metrics_registry import CACHE_REQUESTS
+
+# theme_qa and the OpenAI client are heavy to import: loaded when the pool is first created
+theme_qa = LazyModule("theme_qa")
+openai_gateway = LazyModule("openai_gateway")
+
+class IndexNotReadyError(Exception):
+    """Raised when a company's vector index has not been built yet, with the ID of the job building it if one was started"""
+
+    def __init__(self, company_id: str, job_id: Optional[str] = None):
+        super().__init__(f"The document index for {company_id} is not ready yet; it is being built in the background")
+        self.company_id = company_id
+        self.job_id = job_id
+
+class EnginePool:
+    """
+    Process-wide pool of warm ThemeQA engines, one per company.
+
+    The first question about a company pays for building its engine and loading its
+    vector index partition; later questions reuse it. All engines share one OpenAI
+    client, one async OpenAI client and one bounded executor for CPU-bound work
+    (search, tokenization, index loads) done on behalf of async requests.
+
+    Every partition loaded into the shared vector index counts against the memory
+    budget, including those loaded without an engine, by cross-company searches or
+    index builds. When over budget, those partitions are unloaded first, oldest
+    first, then the least recently used engines are evicted and their partitions
+    unloaded (stored versions stay on disk, so reloading is cheap).
+
+    Engines are only ever loaded from an existing index, never built inline: a
+    company without one raises IndexNotReadyError and, if on_index_missing is set,
+    reports the company so a background build can be started; the job it returns
+    is carried by the error.
+    """
+
+    def __init__(self, api_key: str, trackedcompanies_dir: str, output_dir: str, retrieval_mode: Optional[str] = None, mmr_lambda: Optional[float] = None, memory_budget_bytes: int = 1024 * 1024 * 1024, openai_client=None, async_openai_client=None, cpu_workers: int = 4):
+        self.trackedcompanies_dir = trackedcompanies_dir
+        self.output_dir = output_dir
+        self.retrieval_mode = retrieval_mode or theme_qa.RETRIEVAL_MODE_CHUNK
+        self.mmr_lambda = mmr_lambda
+        self.memory_budget_bytes = memory_budget_bytes
+        # Every engine shares the process-wide OpenAI gateway unless a client is injected
+        gateway = None if openai_client else openai_gateway.get_openai_gateway(api_key)
+        self.openai_client = openai_client or gateway.client
+        self.async_openai_client = async_openai_client or (None if openai_client else gateway.async_client)
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="qa-cpu")
+        self.vector_index = theme_qa.get_shared_index(os.path.join(output_dir, theme_qa.CACHE_DIR, theme_qa.VECTOR_INDEX_DIR, self.retrieval_mode))
+        self.on_index_missing: Optional[Callable[[str], Any]] = None
+        self.vector_index.on_partition_loaded = self._partition_loaded
+
+        # Engines by company ID, least recently used first
+        self._engines: "OrderedDict[str, theme_qa.ThemeQA]" = OrderedDict()
+        self._engine_bytes: Dict[str, int] = {}
+        # Partitions loaded without an engine, oldest first
+        self._partition_bytes: "OrderedDict[str, int]" = OrderedDict()
+        self._load_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # One lock per company so concurrent first questions load its engine only once
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, company_id: str, input_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> "theme_qa.ThemeQA":
+        """Return the warm engine for a company, loading its index on first use"""
+        company_id = company_id.lower()
+        with self._lock:
+            engine = self._engines.get(company_id)
+            if engine is not None:
+                self._engines.move_to_end(company_id)
+                self.hits += 1
+                CACHE_REQUESTS.inc("engine_pool", "hit")
+                return engine
+            load_lock = self._load_locks.setdefault(company_id, threading.Lock())
+
+        with load_lock:
+            # Another request may have loaded it while we waited
+            with self._lock:
+                engine = self._engines.get(company_id)
+                if engine is not None:
+                    self._engines.move_to_end(company_id)
+                    self.hits += 1
+                    CACHE_REQUESTS.inc("engine_pool", "hit")
+                    return engine
+
+            start_time = time.perf_counter()
+            engine = self.create_engine(company_id, input_dir, cache_dir)
+            if not engine.load_index():
+                job = self.on_index_missing(company_id) if self.on_index_missing else None
+                raise IndexNotReadyError(company_id, getattr(job, "job_id", None))
+            load_seconds = time.perf_counter() - start_time
+
+            with self._lock:
+                self.misses += 1
+                CACHE_REQUESTS.inc("engine_pool", "miss")
+                self._engines[company_id] = engine
+                self._engine_bytes[company_id] = self._measure(engine)
+                self._partition_bytes.pop(company_id, None)
+                self._load_seconds[company_id] = load_seconds
+                self._evict(keep=company_id)
+
+        logger.info(f"Loaded ThemeQA engine for {company_id} in {load_seconds:.2f}s")
+        return engine
+
+    def create_engine(self, company_id: str, input_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> "theme_qa.ThemeQA":
+        """Create a ThemeQA engine for a company using the shared client and vector index, without loading it"""
+        return theme_qa.ThemeQA(
+            api_key=None,
+            input_dir=input_dir or os.path.join(self.trackedcompanies_dir, company_id.capitalize()),
+            output_dir=self.output_dir,
+            cache_dir=cache_dir or os.path.join(self.output_dir, "cache", company_id),
+            company_id=company_id,
+            openai_client=self.openai_client,
+            retrieval_mode=self.retrieval_mode,
+            mmr_lambda=self.mmr_lambda,
+            vector_index=self.vector_index,
+            async_openai_client=self.async_openai_client,
+            cpu_executor=self.cpu_executor
+        )
+
+    @staticmethod
+    def _measure(engine: "theme_qa.ThemeQA") -> int:
+        """Approximate memory held for an engine: its index partition (document text stays on disk in the artifact store)"""
+        return engine.vector_index.partition_bytes(engine.company_id)
+
+    def _partition_loaded(self, company_id: str) -> None:
+        """Account for a partition the shared index loaded or replaced, evicting to stay within the budget"""
+        with self._lock:
+            engine = self._engines.get(company_id)
+            if engine is not None:
+                self._engine_bytes[company_id] = self._measure(engine)
+            else:
+                self._partition_bytes[company_id] = self.vector_index.partition_bytes(company_id)
+                self._partition_bytes.move_to_end(company_id)
+            self._evict(keep=company_id)
+
+    def _total_bytes(self) -> int:
+        """Memory held by every loaded partition, with or without an engine (caller holds the lock)"""
+        return sum(self._engine_bytes.values()) + sum(self._partition_bytes.values())
+
+    def _evict(self, keep: str) -> None:
+        """Unload partitions without an engine, then evict least recently used engines, until the pool fits its memory budget (caller holds the lock)"""
+        for company_id in list(self._partition_bytes):
+            if self._total_bytes() <= self.memory_budget_bytes:
+                return
+            if company_id == keep:
+                continue
+            del self._partition_bytes[company_id]
+            self.vector_index.unload_partition(company_id)
+            self.evictions += 1
+            logger.info(f"Unloaded the vector index partition for {company_id} to stay within the memory budget")
+
+        for company_id in list(self._engines):
+            if self._total_bytes() <= self.memory_budget_bytes:
+                break
+            if company_id == keep:
+                continue
+            self._remove(company_id)
+            self.evictions += 1
+            logger.info(f"Evicted ThemeQA engine for {company_id} to stay within the memory budget")
+
+    def _remove(self, company_id: str) -> None:
+        """Drop an engine and unload its vector index partition (caller holds the lock)"""
+        engine = self._engines.pop(company_id)
+        self._engine_bytes.pop(company_id, None)
+        self._load_seconds.pop(company_id, None)
+        engine.vector_index.unload_partition(company_id)
+
+    def refresh(self, company_id: str) -> None:
+        """Re-measure a resident engine after a new version of its index was swapped in"""
+        with self._lock:
+            engine = self._engines.get(company_id.lower())
+            if engine is not None:
+                self._engine_bytes[company_id.lower()] = self._measure(engine)
+                self._evict(keep=company_id.lower())
+
+    def evict(self, company_id: str) -> bool:
+        """Drop a company's engine, e.g. after its documents changed; False if it was not loaded"""
+        with self._lock:
+            if company_id.lower() not in self._engines:
+                return False
+            self._remove(company_id.lower())
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Resident companies, memory held and load times"""
+        with self._lock:
+            return {
+                "companies": [
+                    {
+                        "company_id": company_id,
+                        "bytes": self._engine_bytes[company_id],
+                        "load_seconds": round(self._load_seconds[company_id], 3)
+                    }
+                    # Most recently used first
+                    for company_id in reversed(self._engines)
+                ],
+                "partition_bytes": sum(self._partition_bytes.values()),
+                "total_bytes": self._total_bytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+# Pools by settings, so services created without one share the API's warm engines
+_pools: Dict[Tuple[Optional[str], str, str, Optional[str], Optional[float]], EnginePool] = {}
+_pools_lock = threading.Lock()
+
+def get_engine_pool(api_key: Optional[str], trackedcompanies_dir: str, output_dir: str, retrieval_mode: Optional[str] = None, mmr_lambda: Optional[float] = None, **kwargs) -> EnginePool:
+    """Get the process-wide pool for these settings, created with kwargs (memory budget, executor size) on first use"""
+    key = (api_key, os.path.abspath(trackedcompanies_dir), os.path.abspath(output_dir), retrieval_mode or theme_qa.RETRIEVAL_MODE_CHUNK, mmr_lambda)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = EnginePool(api_key, trackedcompanies_dir, output_dir, retrieval_mode, mmr_lambda, **kwargs)
+        return _pools[key]
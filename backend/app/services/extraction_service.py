@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+# Add the scripts directory to sys.path
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "scripts")
+sys.path.append(scripts_dir)
+
+# Import models
+from app.models.extraction import ExtractionJob
+from app.services.index_service import JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED, ACTIVE_JOB_STATUSES
+from app.services.lazy_module import LazyModule
+
+# theme_extractor pulls in openai, PyPDF2 and tiktoken: loaded when the first extraction runs
+theme_extractor = LazyModule("theme_extractor")
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between progress checks when streaming a job's progress
+PROGRESS_POLL_INTERVAL = 0.5
+
+class ExtractionService:
+    """
+    Service for running theme extraction in the background.
+
+    Each run is a ThemeExtractionPipeline on a small worker pool; its counters (files,
+    chunks, themes found, tokens used) are kept on the job as it reports them, together
+    with the throughput and an ETA derived from them. A company has at most one active
+    full run; asking for another returns the running job. Runs for the same company
+    never overlap. Cancelling a run keeps the themes of the documents it had already
+    finished. A run merges its themes row by row into the company's current themes,
+    so themes created, edited or deleted through the API while it runs are kept.
+    """
+
+    def __init__(self, api_key: str, trackedcompanies_dir: str, output_dir: str, max_workers: int = 1, openai_client=None):
+        self.api_key = api_key
+        self.trackedcompanies_dir = trackedcompanies_dir
+        self.output_dir = output_dir
+        self.openai_client = openai_client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="theme-extraction")
+        self._jobs: Dict[str, ExtractionJob] = {}
+        self._revisions: Dict[str, int] = {}  # job_id -> number of changes, so watchers only send new states
+        self._cancelled: set = set()
+        self._lock = threading.Lock()
+        # One lock per company so its runs never overlap
+        self._company_locks: Dict[str, threading.Lock] = {}
+
+    def start_extraction(self, company_id: str, documents: Optional[List[str]] = None) -> ExtractionJob:
+        """
+        Queue a theme extraction run for a company, or return the one already queued or running.
+
+        With documents, only those are considered. Such runs queue behind the company's
+        running job instead of being merged into it, and documents arriving while one is
+        still queued are added to it, so a burst of new filings becomes a single run.
+        """
+        company_id = company_id.lower()
+        with self._lock:
+            for job in self._jobs.values():
+                if job.company_id != company_id or job.status not in ACTIVE_JOB_STATUSES:
+                    continue
+                if job.documents is None and (documents is None or job.status == JOB_QUEUED):
+                    return job.model_copy()
+                if documents is not None and job.documents is not None and job.status == JOB_QUEUED:
+                    job.documents.extend(path for path in documents if path not in job.documents)
+                    self._revisions[job.job_id] += 1
+                    return job.model_copy()
+
+            job = ExtractionJob(job_id=uuid.uuid4().hex, company_id=company_id, documents=list(documents) if documents is not None else None,
+                                status=JOB_QUEUED, created_at=datetime.now())
+            self._jobs[job.job_id] = job
+            self._revisions[job.job_id] = 0
+            self._executor.submit(self._run, job.job_id)
+            logger.info(f"Queued theme extraction {job.job_id} for {company_id}")
+            return job.model_copy()
+
+    def get_job(self, job_id: str) -> Optional[ExtractionJob]:
+        """Get a job by ID"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.model_copy() if job else None
+
+    def list_jobs(self, company_id: Optional[str] = None) -> List[ExtractionJob]:
+        """Get all jobs, newest first, optionally for one company"""
+        with self._lock:
+            jobs = [job.model_copy() for job in self._jobs.values() if not company_id or job.company_id == company_id.lower()]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def cancel_job(self, job_id: str) -> Optional[ExtractionJob]:
+        """Cancel a queued or running job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == JOB_QUEUED:
+                self._finish(job, JOB_CANCELLED)
+            elif job.status == JOB_RUNNING:
+                # The run stops before its next document or chunk
+                self._cancelled.add(job_id)
+            return job.model_copy()
+
+    async def watch(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield a job's state as a "progress" event whenever it changes, then a final
+        "done" event once the job has finished.
+        """
+        revision = None
+        while True:
+            with self._lock:
+                job = self._jobs[job_id]
+                changed = self._revisions[job_id] != revision
+                revision = self._revisions[job_id]
+                snapshot = job.model_copy()
+            if snapshot.status not in ACTIVE_JOB_STATUSES:
+                yield {"event": "done", "data": snapshot.model_dump(mode="json")}
+                return
+            if changed:
+                yield {"event": "progress", "data": snapshot.model_dump(mode="json")}
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+
+    def _finish(self, job: ExtractionJob, status: str, error: Optional[str] = None) -> None:
+        """Mark a job as finished (caller holds the lock)"""
+        job.status = status
+        job.phase = None
+        job.eta_seconds = None
+        job.error = error
+        job.finished_at = datetime.now()
+        self._revisions[job.job_id] += 1
+        self._cancelled.discard(job.job_id)
+
+    def _run(self, job_id: str) -> None:
+        """Run a job on a worker thread, one at a time per company"""
+        with self._lock:
+            company_lock = self._company_locks.setdefault(self._jobs[job_id].company_id, threading.Lock())
+        with company_lock:
+            self._run_job(job_id)
+
+    def _run_job(self, job_id: str) -> None:
+        """Run a company's theme extraction"""
+        with self._lock:
+            job = self._jobs[job_id]
+            if job.status != JOB_QUEUED:
+                return
+            job.status = JOB_RUNNING
+            job.started_at = datetime.now()
+            documents = list(job.documents) if job.documents is not None else None
+            self._revisions[job_id] += 1
+
+        extracting_since: Optional[float] = None
+
+        def progress(counters: Dict[str, Any]) -> None:
+            nonlocal extracting_since
+            now = time.monotonic()
+            if counters["phase"] == "extracting" and extracting_since is None:
+                extracting_since = now
+            with self._lock:
+                for field, value in counters.items():
+                    setattr(job, field, value)
+                # Throughput and ETA from the chunks analyzed since extraction started
+                elapsed = now - extracting_since if extracting_since is not None else 0.0
+                if job.chunks_done and elapsed > 0:
+                    job.chunks_per_minute = job.chunks_done / elapsed * 60
+                    job.eta_seconds = (job.chunks_total - job.chunks_done) / job.chunks_done * elapsed
+                self._revisions[job_id] += 1
+
+        input_dir = os.path.join(self.trackedcompanies_dir, job.company_id.capitalize())
+        try:
+            if not os.path.isdir(input_dir):
+                raise FileNotFoundError(f"No documents directory for {job.company_id}: {input_dir}")
+            pipeline = theme_extractor.ThemeExtractionPipeline(
+                api_key=self.api_key,
+                input_dir=input_dir,
+                output_dir=self.output_dir,
+                company_id=job.company_id,
+                openai_client=self.openai_client
+            )
+            pipeline.run(should_cancel=lambda: job_id in self._cancelled, progress=progress, files=documents)
+        except theme_extractor.ExtractionCancelled:
+            with self._lock:
+                self._finish(job, JOB_CANCELLED)
+            logger.info(f"Cancelled theme extraction {job_id} for {job.company_id}")
+            return
+        except Exception as e:
+            with self._lock:
+                self._finish(job, JOB_FAILED, str(e))
+            logger.error(f"Theme extraction {job_id} for {job.company_id} failed: {str(e)}")
+            return
+
+        with self._lock:
+            self._finish(job, JOB_COMPLETED)
+        logger.info(f"Theme extraction {job_id} for {job.company_id} completed: {job.themes_found} themes from {job.chunks_done} chunks")
@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+from typing import Dict, Optional, Tuple, Callable
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Document file types that are watched
+DOCUMENT_EXTENSIONS = ('.pdf', '.json')
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# (size, mtime_ns) of a file
+FileStat = Tuple[int, int]
+
+class FilingsWatcher:
+    """
+    Watches the tracked company directories for new and changed documents.
+
+    On Linux, changes are delivered by inotify, so an idle watcher blocks in select()
+    and uses no CPU; elsewhere, or if inotify is unavailable, the tree is stat-scanned
+    every poll interval. Either way a document is reported only once it has been quiet
+    for the debounce period and its size and mtime have stopped changing, so a file
+    still being written or copied is reported once, when it is complete.
+
+    on_document(company_id, path) is called on the watcher thread for each new or
+    changed document; the company ID is its top-level directory name, lowercased.
+    """
+
+    def __init__(self, root: str, on_document: Callable[[str, str], None], debounce: float = 2.0,
+                 poll_interval: float = 5.0, use_inotify: bool = True):
+        self.root = os.path.abspath(root)
+        self.on_document = on_document
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self._known: Dict[str, FileStat] = {}  # path -> stat when last reported (or first seen)
+        self._pending: Dict[str, Tuple[float, Optional[FileStat]]] = {}  # path -> (time of last change, stat then)
+        self._inotify_fd: Optional[int] = None
+        self._watches: Dict[int, str] = {}  # inotify watch descriptor -> directory
+        self._libc = None
+        if use_inotify and sys.platform.startswith("linux"):
+            self._init_inotify()
+        self._wake_read, self._wake_write = os.pipe()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def mode(self) -> str:
+        """How changes are detected: "inotify" or "polling\""""
+        return "inotify" if self._inotify_fd is not None else "polling"
+
+    def start(self) -> None:
+        """Start watching on a daemon thread; documents already present are not reported"""
+        os.makedirs(self.root, exist_ok=True)
+        if self._inotify_fd is not None:
+            self._watch_tree(self.root)
+        self._known = self._scan()
+        self._thread = threading.Thread(target=self._loop, name="filings-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.root} for new documents ({self.mode})")
+
+    def stop(self) -> None:
+        """Stop watching and wait for the watcher thread to exit"""
+        self._stopped.set()
+        os.write(self._wake_write, b"x")
+        if self._thread is not None:
+            self._thread.join()
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def _loop(self) -> None:
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stopped.is_set():
+            # Sleep until a change arrives, a pending document is due, or (when polling) the next scan
+            now = time.monotonic()
+            deadlines = [changed_at + self.debounce for changed_at, _ in self._pending.values()]
+            if self._inotify_fd is None:
+                deadlines.append(next_poll)
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+
+            readers = [self._wake_read] + ([self._inotify_fd] if self._inotify_fd is not None else [])
+            readable, _, _ = select.select(readers, [], [], timeout)
+            if self._stopped.is_set():
+                return
+
+            try:
+                if self._inotify_fd in readable:
+                    self._read_events()
+                if self._inotify_fd is None and time.monotonic() >= next_poll:
+                    self._rescan()
+                    next_poll = time.monotonic() + self.poll_interval
+                self._report_quiet()
+            except Exception as e:
+                logger.error(f"Error watching {self.root}: {str(e)}")
+
+    def _report_quiet(self) -> None:
+        """Report the pending documents that have been quiet for the debounce period"""
+        now = time.monotonic()
+        for path, (changed_at, stat) in list(self._pending.items()):
+            if now - changed_at < self.debounce:
+                continue
+            current = self._stat(path)
+            if current != stat:
+                # Still being written (or gone): wait another debounce period
+                if current is None:
+                    del self._pending[path]
+                else:
+                    self._pending[path] = (now, current)
+                continue
+
+            del self._pending[path]
+            if self._known.get(path) == current:
+                continue
+            self._known[path] = current
+            company_id = os.path.relpath(path, self.root).split(os.sep)[0].lower()
+            logger.info(f"New or changed document for {company_id}: {path}")
+            try:
+                self.on_document(company_id, path)
+            except Exception as e:
+                logger.error(f"Error handling document {path}: {str(e)}")
+
+    def _changed(self, path: str) -> None:
+        """Note a change to a file, restarting its debounce period"""
+        if self._is_document(path):
+            self._pending[path] = (time.monotonic(), self._stat(path))
+
+    def _rescan(self) -> None:
+        """Mark every document whose stat differs from the last one seen as changed"""
+        for path, stat in self._scan().items():
+            if self._known.get(path) != stat and self._pending.get(path, (None, None))[1] != stat:
+                self._changed(path)
+
+    def _scan(self) -> Dict[str, FileStat]:
+        """Stat every document under the root"""
+        stats = {}
+        for walk_root, _, files in os.walk(self.root):
+            for file in files:
+                path = os.path.join(walk_root, file)
+                if self._is_document(path):
+                    stat = self._stat(path)
+                    if stat is not None:
+                        stats[path] = stat
+        return stats
+
+    def _is_document(self, path: str) -> bool:
+        """Whether a path is a document inside a company directory (hidden and temporary files are skipped)"""
+        name = os.path.basename(path)
+        return (name.lower().endswith(DOCUMENT_EXTENSIONS) and not name.startswith(".")
+                and os.sep in os.path.relpath(path, self.root))
+
+    @staticmethod
+    def _stat(path: str) -> Optional[FileStat]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    # inotify
+
+    def _init_inotify(self) -> None:
+        """Open an inotify instance, leaving the watcher in polling mode if that fails"""
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            self._inotify_fd = fd
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable, falling back to polling: {str(e)}")
+
+    def _watch_tree(self, directory: str) -> None:
+        """Watch a directory and every directory below it"""
+        for walk_root, _, _ in os.walk(directory):
+            wd = self._libc.inotify_add_watch(self._inotify_fd, os.fsencode(walk_root), WATCH_MASK)
+            if wd < 0:
+                logger.warning(f"Cannot watch {walk_root}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._watches[wd] = walk_root
+
+    def _read_events(self) -> None:
+        """Read the queued inotify events and note the files they touch"""
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: fall back to comparing stats
+                logger.warning("inotify queue overflowed, rescanning")
+                self._rescan()
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in a new directory before it is watched
+                    self._watch_tree(path)
+                    for file_path in self._scan_directory(path):
+                        self._changed(file_path)
+            else:
+                self._changed(path)
+
+    def _scan_directory(self, directory: str):
+        """Every file below a directory"""
+        for walk_root, _, files in os.walk(directory):
+            for file in files:
+                yield os.path.join(walk_root, file)
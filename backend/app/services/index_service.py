@@ -0,0 +1,201 @@
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Optional
+
+# Import models
+from app.models.index import IndexJob, CompanyIndexStatus, IndexReadiness
+from app.services.company_service import CompanyService
+from app.services.engine_pool import EnginePool, theme_qa
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Job statuses
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+ACTIVE_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+# Job kinds
+JOB_BUILD = "build"
+JOB_INGEST = "ingest"
+
+class IndexService:
+    """
+    Service for building company vector indexes in the background.
+
+    Builds run on a small worker pool, never on a request. Each build produces a new
+    index version next to the live one and swaps it in only when it completes, so
+    questions keep being answered from the previous version while it runs. A company
+    has at most one active build; asking for another returns the running job.
+
+    Ingest jobs add a single new document to a company's index without rebuilding
+    it. Jobs for the same company never run at the same time.
+    """
+
+    def __init__(self, engine_pool: EnginePool, max_workers: int = 1):
+        self.engine_pool = engine_pool
+        self.company_service = CompanyService()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="index-build")
+        self._jobs: Dict[str, IndexJob] = {}
+        self._cancelled: set = set()
+        self._lock = threading.Lock()
+        # One lock per company so its builds and ingests never overlap
+        self._company_locks: Dict[str, threading.Lock] = {}
+
+        # Questions about a company without an index start its build
+        self.engine_pool.on_index_missing = self.start_build
+
+    def start_build(self, company_id: str) -> IndexJob:
+        """Queue an index build for a company, or return the one already queued or running"""
+        company_id = company_id.lower()
+        with self._lock:
+            active_job = self._active_job(company_id)
+            if active_job is not None:
+                return active_job.model_copy()
+            return self._queue(IndexJob(job_id=uuid.uuid4().hex, company_id=company_id, status=JOB_QUEUED, created_at=datetime.now()))
+
+    def start_ingest(self, company_id: str, document: str) -> IndexJob:
+        """
+        Queue the ingestion of one new or changed document into a company's index.
+
+        Only that document is extracted and embedded, and an unchanged, already indexed
+        document is left as it is. A company without an index gets a full build instead,
+        which picks the document up with the others. Asking again while the ingestion is
+        still queued returns the queued job.
+        """
+        company_id = company_id.lower()
+        if not self.engine_pool.vector_index.has_partition(company_id):
+            return self.start_build(company_id)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.company_id == company_id and job.document == document and job.status == JOB_QUEUED:
+                    return job.model_copy()
+            return self._queue(IndexJob(job_id=uuid.uuid4().hex, company_id=company_id, kind=JOB_INGEST, document=document,
+                                        status=JOB_QUEUED, created_at=datetime.now(), documents_total=1))
+
+    def _queue(self, job: IndexJob) -> IndexJob:
+        """Register a job and submit it to the workers (caller holds the lock)"""
+        self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job.job_id)
+        logger.info(f"Queued index {job.kind} {job.job_id} for {job.company_id}")
+        return job.model_copy()
+
+    def get_job(self, job_id: str) -> Optional[IndexJob]:
+        """Get a job by ID"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.model_copy() if job else None
+
+    def list_jobs(self, company_id: Optional[str] = None) -> List[IndexJob]:
+        """Get all jobs, newest first, optionally for one company"""
+        with self._lock:
+            jobs = [job.model_copy() for job in self._jobs.values() if not company_id or job.company_id == company_id.lower()]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def cancel_job(self, job_id: str) -> Optional[IndexJob]:
+        """Cancel a queued or running job; the live index is left as it was"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == JOB_QUEUED:
+                self._finish(job, JOB_CANCELLED)
+            elif job.status == JOB_RUNNING:
+                # The build stops before its next document
+                self._cancelled.add(job_id)
+            return job.model_copy()
+
+    def readiness(self) -> IndexReadiness:
+        """Report which companies have an index that questions can be served from"""
+        vector_index = self.engine_pool.vector_index
+        company_ids = {company.id.lower() for company in self.company_service.get_all_companies()}
+        company_ids.update(vector_index.available_partitions())
+
+        with self._lock:
+            building = {job.company_id: job.job_id for job in self._jobs.values() if job.status in ACTIVE_JOB_STATUSES}
+
+        statuses = [
+            CompanyIndexStatus(
+                company_id=company_id,
+                ready=vector_index.has_partition(company_id),
+                version=vector_index.current_version(company_id),
+                loaded=company_id in vector_index.loaded,
+                building_job_id=building.get(company_id)
+            )
+            for company_id in sorted(company_ids)
+        ]
+        return IndexReadiness(companies=statuses, ready_companies=[status.company_id for status in statuses if status.ready])
+
+    def _active_job(self, company_id: str) -> Optional[IndexJob]:
+        """The queued or running build for a company (caller holds the lock)"""
+        for job in self._jobs.values():
+            if job.company_id == company_id and job.kind == JOB_BUILD and job.status in ACTIVE_JOB_STATUSES:
+                return job
+        return None
+
+    def _finish(self, job: IndexJob, status: str, error: Optional[str] = None) -> None:
+        """Mark a job as finished (caller holds the lock)"""
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.now()
+        self._cancelled.discard(job.job_id)
+
+    def _run(self, job_id: str) -> None:
+        """Run a job on a worker thread, one at a time per company"""
+        with self._lock:
+            company_lock = self._company_locks.setdefault(self._jobs[job_id].company_id, threading.Lock())
+        with company_lock:
+            self._run_job(job_id)
+
+    def _run_job(self, job_id: str) -> None:
+        """Build or update a company's index and swap it in when done"""
+        with self._lock:
+            job = self._jobs[job_id]
+            if job.status != JOB_QUEUED:
+                return
+            job.status = JOB_RUNNING
+            job.started_at = datetime.now()
+
+        def progress(done: int, total: int) -> None:
+            with self._lock:
+                job.documents_done = done
+                job.documents_total = total
+
+        try:
+            engine = self.engine_pool.create_engine(job.company_id)
+            if job.kind == JOB_INGEST:
+                partition = engine.ingest_document(job.document)
+                progress(1, 1)
+                if partition is None:
+                    # Already indexed: the live version stays
+                    with self._lock:
+                        job.version = self.engine_pool.vector_index.current_version(job.company_id)
+                        self._finish(job, JOB_COMPLETED)
+                    return
+            else:
+                partition = engine.build_partition(should_cancel=lambda: job_id in self._cancelled, progress=progress)
+                if partition is None:
+                    raise FileNotFoundError(f"No documents directory for {job.company_id}: {engine.input_dir}")
+            version = self.engine_pool.vector_index.put_partition(job.company_id, partition)
+        except theme_qa.IndexBuildCancelled:
+            with self._lock:
+                self._finish(job, JOB_CANCELLED)
+            logger.info(f"Cancelled index {job.kind} {job_id} for {job.company_id}")
+            return
+        except Exception as e:
+            with self._lock:
+                self._finish(job, JOB_FAILED, str(e))
+            logger.error(f"Index {job.kind} {job_id} for {job.company_id} failed: {str(e)}")
+            return
+
+        self.engine_pool.refresh(job.company_id)
+        with self._lock:
+            job.version = version
+            self._finish(job, JOB_COMPLETED)
+        logger.info(f"Index {job.kind} {job_id} for {job.company_id} completed with version {version}")
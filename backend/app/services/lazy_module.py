@@ -0,0 +1,34 @@
+import importlib
+from types import ModuleType
+from typing import Optional
+
+class LazyModule:
+    """
+    A module that is only imported when one of its attributes is first used.
+
+    The question answering and extraction scripts pull in faiss, numpy, openai,
+    PyPDF2 and tiktoken when imported, which takes most of the app's startup time.
+    Holding them as lazy modules keeps that cost off the theme, company and document
+    endpoints and off every worker restart; it is paid by the first request that
+    actually needs them. Attribute access works as on the module itself, so
+    annotations naming its types must be strings.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the module has been imported yet"""
+        return self._module is not None
+
+    def __getattr__(self, attribute: str):
+        module = self._module
+        if module is None:
+            # import_module holds the module's import lock, so concurrent first uses import it once
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}'{'' if self.loaded else ' (not loaded)'}>"
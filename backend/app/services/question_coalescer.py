@@ -0,0 +1,121 @@
+import re
+import json
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Key of an in-flight question: (company_id, normalized question, filters, corpus version)
+QuestionKey = Tuple[str, str, str, str]
+
+def question_key(company_id: str, question: str, filters: Optional[Dict[str, Any]], corpus_version: str) -> QuestionKey:
+    """Key under which identical questions are coalesced; case and whitespace differences are ignored"""
+    normalized = re.sub(r"\s+", " ", question).strip().casefold()
+    return (company_id.lower(), normalized, json.dumps(filters or {}, sort_keys=True), corpus_version)
+
+class _StreamBroadcast:
+    """Events of one in-flight answer stream, replayed to every subscriber from the start"""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, events: AsyncIterator[Dict[str, Any]]) -> None:
+        """Consume the underlying stream, waking subscribers after each event"""
+        try:
+            async for event in events:
+                async with self.changed:
+                    self.events.append(event)
+                    self.changed.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every event so far, then new ones as they arrive"""
+        position = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: position < len(self.events) or self.done)
+                events = self.events[position:]
+                finished = self.done
+            for event in events:
+                yield event
+            position += len(events)
+            if finished and position == len(self.events):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    async def answer(self) -> str:
+        """Wait for the stream to finish and return the answer from its final event"""
+        async for event in self.subscribe():
+            if event["event"] == "done":
+                return event["data"]["answer"]
+        raise RuntimeError("Answer stream ended without a final event")
+
+class QuestionCoalescer:
+    """
+    Single-flight coalescing of identical in-flight questions.
+
+    The first request for a key does the retrieval and generation; identical
+    requests that arrive while it is running await the same result instead of
+    starting their own. Streamed answers are broadcast: a later subscriber is
+    replayed the events so far and then follows the live stream, and a plain
+    question waits for an in-flight stream's final answer. Keys include the
+    corpus version, so a question asked after an index swap is answered afresh.
+    Entries are removed as soon as the work finishes; nothing is cached.
+
+    All methods must be called from the same event loop.
+    """
+
+    def __init__(self):
+        self._answers: Dict[QuestionKey, "asyncio.Future[str]"] = {}
+        self._streams: Dict[QuestionKey, _StreamBroadcast] = {}
+        self.leaders = 0  # Requests that did the work
+        self.coalesced = 0  # Requests that shared another request's work
+
+    async def answer(self, key: QuestionKey, compute: Callable[[], Awaitable[str]]) -> str:
+        """Return the answer for key, computing it only if no identical question is in flight"""
+        future = self._answers.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        broadcast = self._streams.get(key)
+        if broadcast is not None:
+            self.coalesced += 1
+            return await broadcast.answer()
+
+        self.leaders += 1
+        # Run the work as its own task so a cancelled leader does not fail its followers
+        future = self._answers[key] = asyncio.ensure_future(compute())
+        future.add_done_callback(lambda _: self._answers.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def stream(self, key: QuestionKey, events: Callable[[], AsyncIterator[Dict[str, Any]]]) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the answer events for key, starting the stream only if no identical one is in flight"""
+        broadcast = self._streams.get(key)
+        if broadcast is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            broadcast = self._streams[key] = _StreamBroadcast()
+            task = asyncio.ensure_future(broadcast.publish(events()))
+            task.add_done_callback(lambda _: self._streams.pop(key, None))
+
+        async for event in broadcast.subscribe():
+            yield event
+
+    def stats(self) -> Dict[str, int]:
+        """Coalescing counters and the number of distinct questions in flight"""
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._answers) + len(self._streams)
+        }
@@ -1,8 +1,11 @@
 import os
 import sys
 import json
+import asyncio
+import contextvars
+import functools
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 import re
 
 # Configure logging
@@ -20,19 +23,21 @@ scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.pa
 sys.path.append(scripts_dir)
 
 # Import models
-from app.models.question import QuestionRequest, QuestionResponse
+from app.models.question import QuestionRequest, QuestionResponse, BatchQuestionRequest, BatchQuestionResult, BatchQuestionResponse
 from app.services.company_service import CompanyService
-
-# Import the theme_qa module
-import theme_qa
+from app.services.engine_pool import EnginePool, get_engine_pool, theme_qa
+from app.services.question_coalescer import QuestionCoalescer, question_key
 
 class QuestionService:
     """Service for handling questions about themes"""
     
-    def __init__(self, api_key: str, company_id: Optional[str] = None, input_dir: Optional[str] = None, output_dir: Optional[str] = None, cache_dir: Optional[str] = None):
+    def __init__(self, api_key: str, company_id: Optional[str] = None, input_dir: Optional[str] = None, output_dir: Optional[str] = None, cache_dir: Optional[str] = None, retrieval_mode: Optional[str] = None, batch_concurrency: Optional[int] = None, mmr_lambda: Optional[float] = None, engine_pool: Optional[EnginePool] = None, coalescer: Optional[QuestionCoalescer] = None):
         self.api_key = api_key
         self.company_id = company_id
-        self.trackedcompanies_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "trackedcompanies")
+        self.retrieval_mode = retrieval_mode or theme_qa.RETRIEVAL_MODE_CHUNK
+        self.batch_concurrency = batch_concurrency or theme_qa.BATCH_CONCURRENCY
+        self.mmr_lambda = mmr_lambda
+        self.trackedcompanies_dir = engine_pool.trackedcompanies_dir if engine_pool else os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "trackedcompanies")
         self.output_dir = output_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "filingsdata", "output")
         self.company_service = CompanyService()
         
@@ -53,26 +58,164 @@ class QuestionService:
         logger.info(f"Input directory: {self.input_dir}")
         logger.info(f"Cache directory: {self.cache_dir}")
         
-        # Initialize ThemeQA
-        self.theme_qa = theme_qa.ThemeQA(
+        # Warm engines are shared across requests: the given pool, or the process-wide one for these settings
+        self.engine_pool = engine_pool or get_engine_pool(
             api_key=self.api_key,
-            input_dir=self.input_dir,
+            trackedcompanies_dir=self.trackedcompanies_dir,
             output_dir=self.output_dir,
-            cache_dir=self.cache_dir,
-            company_id=company_id or "netflix"
+            retrieval_mode=self.retrieval_mode,
+            mmr_lambda=self.mmr_lambda
         )
         
-        # Load documents
-        self.theme_qa.load_documents()
+        # Identical in-flight questions share one answer when a coalescer is given
+        self.coalescer = coalescer
+        
+        # Get the ThemeQA engine, loading its documents on first use
+        self.theme_qa = self.engine_pool.get(company_id or "netflix", self.input_dir, self.cache_dir)
     
     def answer_question(self, question_request: QuestionRequest, company_id: Optional[str] = None) -> QuestionResponse:
         """Answer a question about themes for a specific company"""
         # Use provided company_id or the one set in the constructor
         company_id = company_id or self.company_id
+        self._switch_company(company_id)
+        
+        # Add company context to the question
+        contextualized_question = self._contextualize_question(question_request.question, company_id)
+        
+        # Get answer from ThemeQA
+        answer = self.theme_qa.answer_question(contextualized_question, self._filters(question_request))
+        
+        # Extract sources from answer
+        sources = self._extract_sources(answer)
+        
+        # Create response
+        response = QuestionResponse(
+            question=question_request.question,
+            answer=answer,
+            sources=sources,
+            company_id=company_id
+        )
+        
+        return response
+    
+    async def aanswer_question(self, question_request: QuestionRequest, company_id: Optional[str] = None) -> QuestionResponse:
+        """Answer a question without blocking the event loop: OpenAI calls are awaited and CPU work runs on the engine pool's executor"""
+        company_id = company_id or self.company_id
+        contextualized_question = await self._prepare(question_request.question, company_id)
+        filters = self._filters(question_request)
+        theme_qa_engine = self.theme_qa
+        
+        def compute():
+            return theme_qa_engine.aanswer_question(contextualized_question, filters)
+        
+        if self.coalescer is None:
+            answer = await compute()
+        else:
+            answer = await self.coalescer.answer(self._question_key(question_request, company_id), compute)
+        
+        return QuestionResponse(
+            question=question_request.question,
+            answer=answer,
+            sources=self._extract_sources(answer),
+            company_id=company_id
+        )
+    
+    def answer_questions(self, batch_request: BatchQuestionRequest, company_id: Optional[str] = None) -> BatchQuestionResponse:
+        """Answer a batch of questions for a specific company, reporting failures per question"""
+        company_id = company_id or self.company_id
+        self._switch_company(company_id)
+        
+        contextualized_questions = [self._contextualize_question(question, company_id) for question in batch_request.questions]
+        filters = batch_request.filters.model_dump() if batch_request.filters else None
+        
+        results = self.theme_qa.answer_questions(contextualized_questions, filters, self.batch_concurrency)
+        
+        return BatchQuestionResponse(results=[
+            BatchQuestionResult(
+                question=question,
+                answer=result["answer"],
+                sources=self._extract_sources(result["answer"]) if result["answer"] else [],
+                company_id=company_id,
+                error=result["error"]
+            )
+            for question, result in zip(batch_request.questions, results)
+        ])
+    
+    def stream_answer(self, question_request: QuestionRequest, company_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Answer a question about themes for a specific company, yielding events as they are produced.
+        
+        Emits the retrieved sources first, then answer tokens, then a final "done" event
+        carrying the full answer, the sources cited in it and the timings.
+        """
+        company_id = company_id or self.company_id
+        self._switch_company(company_id)
+        
+        contextualized_question = self._contextualize_question(question_request.question, company_id)
+        
+        for event in self.theme_qa.answer_question_stream(contextualized_question, self._filters(question_request)):
+            if event["event"] == "done":
+                event = self._done_event(event, question_request, company_id)
+            yield event
+    
+    async def astream_answer(self, question_request: QuestionRequest, company_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_answer that does not block the event loop"""
+        company_id = company_id or self.company_id
+        contextualized_question = await self._prepare(question_request.question, company_id)
+        filters = self._filters(question_request)
+        theme_qa_engine = self.theme_qa
+        
+        def events():
+            return theme_qa_engine.aanswer_question_stream(contextualized_question, filters)
+        
+        if self.coalescer is not None:
+            events = functools.partial(self.coalescer.stream, self._question_key(question_request, company_id), events)
+        
+        async for event in events():
+            if event["event"] == "done":
+                event = self._done_event(event, question_request, company_id)
+            yield event
+    
+    async def aload_engine(self, company_id: Optional[str] = None) -> None:
+        """Switch to the company's engine, loading it on first use; raises IndexNotReadyError if its index is not built yet"""
+        await self._run_cpu(self._switch_company, company_id or self.company_id)
+    
+    async def _prepare(self, question: str, company_id: Optional[str]) -> str:
+        """Switch to the company's engine and contextualize the question on the CPU executor, since both may touch disk"""
+        def prepare() -> str:
+            self._switch_company(company_id)
+            return self._contextualize_question(question, company_id)
         
+        return await self._run_cpu(prepare)
+    
+    async def _run_cpu(self, func, *args):
+        """Run blocking work on the engine pool's CPU executor, in the caller's context"""
+        return await asyncio.get_running_loop().run_in_executor(self.engine_pool.cpu_executor, functools.partial(contextvars.copy_context().run, func, *args))
+    
+    def _question_key(self, question_request: QuestionRequest, company_id: Optional[str]):
+        """Coalescing key of a question: the company, the question, its filters and the version of the corpus it searches"""
+        filters = self._filters(question_request)
+        return question_key(company_id or "netflix", question_request.question, filters, self.theme_qa.corpus_version(filters))
+    
+    def _done_event(self, event: Dict[str, Any], question_request: QuestionRequest, company_id: Optional[str]) -> Dict[str, Any]:
+        """Rewrite ThemeQA's final stream event to carry the question, cited sources and company"""
+        answer = event["data"]["answer"]
+        return {
+            "event": "done",
+            "data": {
+                "question": question_request.question,
+                "answer": answer,
+                "sources": self._extract_sources(answer),
+                "company_id": company_id,
+                "timings": event["data"]["timings"]
+            }
+        }
+    
+    def _switch_company(self, company_id: Optional[str]) -> None:
+        """Point ThemeQA at the given company's documents if it differs from the current one"""
         # If company_id has changed, reinitialize ThemeQA with the new input directory
         if company_id and (not self.company_id or company_id.lower() != self.company_id.lower()):
-            logger.info(f"Company changed from {self.company_id} to {company_id}. Reinitializing ThemeQA.")
+            logger.info(f"Company changed from {self.company_id} to {company_id}. Switching ThemeQA engine.")
             self.company_id = company_id
             self.input_dir = os.path.join(self.trackedcompanies_dir, company_id.capitalize())
             self.cache_dir = os.path.join(self.output_dir, "cache", company_id.lower())
@@ -80,19 +223,11 @@ class QuestionService:
             # Ensure cache directory exists
             os.makedirs(self.cache_dir, exist_ok=True)
             
-            # Reinitialize ThemeQA with company-specific cache
-            self.theme_qa = theme_qa.ThemeQA(
-                api_key=self.api_key,
-                input_dir=self.input_dir,
-                output_dir=self.output_dir,
-                cache_dir=self.cache_dir,
-                company_id=company_id
-            )
-            
-            # Force reload documents to ensure we're using the correct company's documents
-            self.theme_qa.invalidate_cache()
-            self.theme_qa.load_documents()
-        
+            # Reuse the company's warm engine, loading it on first use
+            self.theme_qa = self.engine_pool.get(company_id, self.input_dir, self.cache_dir)
+    
+    def _contextualize_question(self, question: str, company_id: Optional[str]) -> str:
+        """Prefix a question with the name of the company it is about"""
         # Get company name for context
         company_name = company_id.capitalize() if company_id else "Netflix"
         if company_id:
@@ -102,24 +237,13 @@ class QuestionService:
         
         logger.info(f"Answering question for company: {company_name}")
         
-        # Add company context to the question
-        contextualized_question = f"Question about {company_name}: {question_request.question}"
-        
-        # Get answer from ThemeQA
-        answer = self.theme_qa.answer_question(contextualized_question)
-        
-        # Extract sources from answer
-        sources = self._extract_sources(answer)
-        
-        # Create response
-        response = QuestionResponse(
-            question=question_request.question,
-            answer=answer,
-            sources=sources,
-            company_id=company_id
-        )
-        
-        return response
+        return f"Question about {company_name}: {question}"
+    
+    def _filters(self, question_request: QuestionRequest) -> Optional[Dict[str, List[str]]]:
+        """Convert request filters into the metadata filters understood by ThemeQA"""
+        if question_request.filters is None:
+            return None
+        return question_request.filters.model_dump()
     
     def _extract_sources(self, answer: str) -> List[str]:
         """Extract sources from answer text"""
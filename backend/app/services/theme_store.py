@@ -0,0 +1,149 @@
+import os
+import sys
+import threading
+from typing import List, Dict, Optional, Callable
+
+# Add the scripts directory to sys.path
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "scripts")
+sys.path.append(scripts_dir)
+
+# Import models
+from app.models.theme import Theme
+from filings_db import get_filings_db, THEMES_FILE_SUFFIX, THEMES_VERSION
+from metrics_registry import CACHE_REQUESTS
+
+class CompanyThemes:
+    """One company's parsed themes with name and category indexes"""
+
+    def __init__(self, themes: List[Theme], version: int):
+        self.themes = themes
+        self.version = version  # Version of the company's themes in the filings database when they were read
+        self.by_name: Dict[str, Theme] = {}
+        self.by_category: Dict[str, List[Theme]] = {}
+        for theme in themes:
+            # Keep the first theme of a name, as the linear scans used to
+            self.by_name.setdefault(theme.name.lower(), theme)
+            self.by_category.setdefault(theme.category.lower(), []).append(theme)
+
+def _position(themes: List[Theme], name: str) -> Optional[int]:
+    """Index of the first theme with a name (case-insensitive), the one the database's name lookups pick"""
+    name = name.lower()
+    return next((i for i, theme in enumerate(themes) if theme.name.lower() == name), None)
+
+class ThemeStore:
+    """
+    Process-wide in-memory cache of the themes in the filings database.
+
+    Each company's themes are read and validated once and kept with name and
+    category indexes. Reads compare the company's version counter in the database
+    and re-read only when another writer (this or another process, e.g. a theme
+    extraction run) changed them, so they are served from memory with O(1) name
+    lookups. Writes go to the database row by row and then through to the cached
+    themes, which are only re-read if another writer changed them in between.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.db = get_filings_db(output_dir)
+        self._companies: Dict[str, CompanyThemes] = {}
+        self._company_ids: List[str] = []
+        self._company_ids_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get_themes_file(self, company_id: str) -> str:
+        """Get the path to the themes file a company's themes are imported from and exported to"""
+        return os.path.join(self.output_dir, f"{company_id}{THEMES_FILE_SUFFIX}")
+
+    def company_ids(self) -> List[str]:
+        """Companies with themes, re-listed only when any company's themes changed"""
+        with self._lock:
+            version = self.db.version(THEMES_VERSION)
+            if version != self._company_ids_version:
+                self._company_ids_version = version
+                self._company_ids = self.db.theme_company_ids()
+            return list(self._company_ids)
+
+    def version(self, company_id: Optional[str] = None) -> str:
+        """A token that changes whenever a company's themes (or any company's, without company_id) change"""
+        return str(self.db.themes_version(company_id) if company_id else self.db.version(THEMES_VERSION))
+
+    def get(self, company_id: str) -> CompanyThemes:
+        """Get a company's themes, re-reading them only if their version changed"""
+        version = self.db.themes_version(company_id)
+        with self._lock:
+            cached = self._companies.get(company_id.lower())
+            if cached is not None and cached.version == version:
+                CACHE_REQUESTS.inc("themes", "hit")
+                return cached
+            CACHE_REQUESTS.inc("themes", "miss")
+
+            themes = []
+            try:
+                # Themes written by the extractor before it recorded their company have no company_id
+                themes = [Theme.model_validate({"company_id": company_id.lower(), **theme}) for theme in self.db.get_themes(company_id)]
+            except Exception as e:
+                print(f"Error loading themes for company {company_id}: {str(e)}")
+            cached = self._companies[company_id.lower()] = CompanyThemes(themes, version)
+            return cached
+
+    def insert(self, company_id: str, theme: Theme, replace: bool = False) -> bool:
+        """Add a theme (replacing one of the same name in place if replace is set); returns False if it exists"""
+        def insert(themes: List[Theme]) -> None:
+            position = _position(themes, theme.name)
+            if position is None:
+                themes.append(theme)
+            else:
+                themes[position] = theme
+        return self._write_through(company_id, self.db.insert_theme(company_id, theme.model_dump(), replace), insert)
+
+    def update(self, company_id: str, name: str, theme: Theme) -> bool:
+        """Replace a theme in place; returns False if it does not exist"""
+        def update(themes: List[Theme]) -> None:
+            themes[_position(themes, name)] = theme
+        return self._write_through(company_id, self.db.update_theme(company_id, name, theme.model_dump()), update)
+
+    def delete(self, company_id: str, name: str) -> bool:
+        """Delete a theme; returns False if it does not exist"""
+        def delete(themes: List[Theme]) -> None:
+            del themes[_position(themes, name)]
+        return self._write_through(company_id, self.db.delete_theme(company_id, name), delete)
+
+    def _write_through(self, company_id: str, version: int, edit: Callable[[List[Theme]], None]) -> bool:
+        """
+        Apply a database write, which produced version (0 if nothing was written), to the cached themes.
+
+        The write is applied to a copy of the cached list, so readers holding the
+        previous entry are unaffected. If the cached entry is not the version just
+        before this write, another writer changed the themes in between and the entry
+        is dropped to be re-read instead.
+        """
+        if not version:
+            return False
+        with self._lock:
+            cached = self._companies.get(company_id.lower())
+            if cached is None or cached.version == version:
+                return True
+            if cached.version != version - 1:
+                del self._companies[company_id.lower()]
+                return True
+            themes = list(cached.themes)
+            try:
+                edit(themes)
+            except (TypeError, IndexError):
+                # The cached themes lack the row the database wrote; re-read them
+                del self._companies[company_id.lower()]
+                return True
+            self._companies[company_id.lower()] = CompanyThemes(themes, version)
+        return True
+
+# One store per output directory, shared by every ThemeService in the process
+_stores: Dict[str, ThemeStore] = {}
+_stores_lock = threading.Lock()
+
+def get_theme_store(output_dir: str) -> ThemeStore:
+    """Get the process-wide theme store for an output directory"""
+    output_dir = os.path.abspath(output_dir)
+    with _stores_lock:
+        if output_dir not in _stores:
+            _stores[output_dir] = ThemeStore(output_dir)
+        return _stores[output_dir]
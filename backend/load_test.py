@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Load test for the question answering API.
+
+Fires concurrent questions at a running backend while probing a cheap endpoint
+(the company listing) and reports how long each took. When questions are served
+without blocking the event loop, the wall time stays close to the slowest single
+answer instead of growing with the number of requests, and the probe stays fast.
+
+Each request asks a slightly different question by default, since identical
+questions in flight at the same time are coalesced into one answer; pass
+--identical to measure coalescing instead.
+
+Example:
+    python load_test.py --company netflix --concurrency 16
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List, Dict, Any
+
+import httpx
+
+async def _timed(client: httpx.AsyncClient, method: str, path: str, **kwargs) -> Dict[str, Any]:
+    """Send one request and return its status and latency in seconds"""
+    start_time = time.perf_counter()
+    try:
+        response = await client.request(method, path, **kwargs)
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"status": status, "seconds": time.perf_counter() - start_time}
+
+async def _probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> List[Dict[str, Any]]:
+    """Repeatedly time a cheap endpoint until stopped"""
+    probes = []
+    while not stop.is_set():
+        probes.append(await _timed(client, "GET", "/api/companies/"))
+        await asyncio.sleep(interval)
+    return probes
+
+async def run_load_test(client: httpx.AsyncClient, company_id: str, question: str, concurrency: int, probe_interval: float = 0.05, identical: bool = False) -> Dict[str, Any]:
+    """Ask concurrency questions at once while probing the company listing; returns the timings"""
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(_probe(client, stop, probe_interval))
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*(
+        _timed(client, "POST", f"/api/questions/company/{company_id}/ask", json={"question": question if identical else f"{question} (request {i + 1})"})
+        for i in range(concurrency)
+    ))
+    wall_seconds = time.perf_counter() - start_time
+
+    stop.set()
+    probes = await probe_task
+
+    latencies = sorted(result["seconds"] for result in results)
+    probe_latencies = sorted(probe["seconds"] for probe in probes) or [0.0]
+    return {
+        "requests": concurrency,
+        "statuses": sorted({str(result["status"]) for result in results}),
+        "wall_seconds": wall_seconds,
+        "mean_seconds": statistics.mean(latencies),
+        "p95_seconds": latencies[int(0.95 * (len(latencies) - 1))],
+        # Close to 1.0 when requests are served one after another, close to 1/requests when fully concurrent
+        "serialization": wall_seconds / sum(latencies),
+        "probe_max_seconds": probe_latencies[-1],
+        "probes": len(probes)
+    }
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Check that concurrent questions do not serialize on the event loop")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the running backend")
+    parser.add_argument("--company", default="netflix", help="Company to ask about")
+    parser.add_argument("--question", default="What are the main growth drivers?", help="Question to ask")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of questions sent at once")
+    parser.add_argument("--identical", action="store_true", help="Ask the same question every time, so requests are coalesced")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    async def run() -> Dict[str, Any]:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            # Warm the company's engine so the test measures answering, not the first load
+            await client.post(f"/api/questions/company/{args.company}/ask", json={"question": args.question})
+            return await run_load_test(client, args.company, args.question, args.concurrency, identical=args.identical)
+
+    report = asyncio.run(run())
+    print(f"{report['requests']} concurrent questions, statuses {', '.join(report['statuses'])}")
+    print(f"Wall time: {report['wall_seconds']:.2f}s, mean latency: {report['mean_seconds']:.2f}s, p95: {report['p95_seconds']:.2f}s")
+    print(f"Serialization: {report['serialization']:.2f} (1.00 = fully serialized, {1 / report['requests']:.2f} = fully concurrent)")
+    print(f"Company listing during load: {report['probes']} probes, slowest {report['probe_max_seconds'] * 1000:.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the API.
+
+Measures what every worker start and `--reload` restart pays: how long importing
+the app takes, and how long a freshly started server takes to answer its first
+request to a lightweight endpoint (the company listing). Each run uses a fresh
+interpreter and the median of the runs is reported.
+
+The question answering and extraction dependencies (faiss, numpy, openai, PyPDF2,
+tiktoken) are loaded on first use, not at startup. The benchmark fails (exit
+status 1) when importing the app loads any of them, or when a median is over its
+budget, so it can guard startup time in CI. The import budget applies to the app's
+own modules, measured with FastAPI already imported, since FastAPI's own import
+time depends on the installed version and is the same for every endpoint.
+
+Example:
+    python startup_benchmark.py --runs 5 --import-budget 0.3 --first-response-budget 1.5
+
+tests/test_startup.py checks for heavy modules on every run, and runs the whole
+benchmark with --json when STARTUP_BUDGETS=1 is set.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Dict, Any
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that importing the app must not load
+HEAVY_MODULES = ("theme_qa", "theme_extractor", "openai", "faiss", "numpy", "PyPDF2", "tiktoken")
+
+# Run in a fresh interpreter: times importing FastAPI, then the app, and lists the heavy modules loaded
+IMPORT_PROBE = f"""
+import json, sys, time
+start_time = time.perf_counter()
+import fastapi
+fastapi_seconds = time.perf_counter() - start_time
+import app.main
+total_seconds = time.perf_counter() - start_time
+print(json.dumps({{
+    "total_seconds": total_seconds,
+    "app_seconds": total_seconds - fastapi_seconds,
+    "heavy_modules": [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+}}))
+"""
+
+def measure_import() -> Dict[str, Any]:
+    """Import the app in a fresh interpreter and return the probe's timings"""
+    output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_first_response(path: str, timeout: float = 60.0) -> float:
+    """Start a server and return the seconds until it first answers path with a 2xx"""
+    port = _free_port()
+    start_time = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            while time.perf_counter() - start_time < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with status {server.returncode} before answering")
+                try:
+                    if client.get(path).is_success:
+                        return time.perf_counter() - start_time
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise TimeoutError(f"No successful response from {path} within {timeout:.0f}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+def run_benchmark(runs: int, path: str) -> Dict[str, Any]:
+    """Measure import and first response times over several runs; returns the medians"""
+    imports: List[Dict[str, Any]] = [measure_import() for _ in range(runs)]
+    first_responses = [measure_first_response(path) for _ in range(runs)]
+    return {
+        "runs": runs,
+        "import_seconds": statistics.median(result["total_seconds"] for result in imports),
+        "app_import_seconds": statistics.median(result["app_seconds"] for result in imports),
+        "first_response_seconds": statistics.median(first_responses),
+        "heavy_modules": sorted({name for result in imports for name in result["heavy_modules"]})
+    }
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Check that the API starts quickly, without loading the question answering dependencies")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs to take the median of")
+    parser.add_argument("--path", default="/api/companies/", help="Lightweight endpoint to time the first response of")
+    parser.add_argument("--import-budget", type=float, default=0.3, help="Budget in seconds for importing the app's own modules")
+    parser.add_argument("--first-response-budget", type=float, default=1.5, help="Budget in seconds from starting the server to its first response")
+    parser.add_argument("--json", action="store_true", help="Print the report and the failed checks as one JSON object")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.runs, args.path)
+    failures = []
+    if report["heavy_modules"]:
+        failures.append(f"importing the app loaded {', '.join(report['heavy_modules'])}")
+    if report["app_import_seconds"] > args.import_budget:
+        failures.append("the app's import time is over budget")
+    if report["first_response_seconds"] > args.first_response_budget:
+        failures.append("the first response time is over budget")
+
+    if args.json:
+        print(json.dumps(dict(report, import_budget=args.import_budget, first_response_budget=args.first_response_budget, failures=failures)))
+        sys.exit(1 if failures else 0)
+
+    print(f"Import: {report['import_seconds'] * 1000:.0f}ms, of which the app's own modules {report['app_import_seconds'] * 1000:.0f}ms (budget {args.import_budget * 1000:.0f}ms)")
+    print(f"First response from {args.path}: {report['first_response_seconds'] * 1000:.0f}ms (budget {args.first_response_budget * 1000:.0f}ms)")
+    print(f"Heavy modules loaded at import: {', '.join(report['heavy_modules']) or 'none'}")
+    if failures:
+        print(f"FAILED: {'; '.join(failures)}")
+        sys.exit(1)
+    print(f"OK: median of {report['runs']} runs within budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import hashlib
+import functools
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+
+# Tests import the app as `app` and the shared scripts by module name, as the server does
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.append(os.path.join(os.path.dirname(BACKEND_DIR), "scripts"))
+
+EMBEDDING_DIMENSIONS = 3072
+
+class FakeEncoding:
+    """Whitespace tokenizer standing in for tiktoken, so tests run without the encoding file"""
+
+    name = "cl100k_base"
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._words: List[str] = []
+
+    def encode_ordinary(self, text: str) -> List[int]:
+        tokens = []
+        for word in text.split():
+            if word not in self._ids:
+                self._ids[word] = len(self._words)
+                self._words.append(word)
+            tokens.append(self._ids[word])
+        return tokens
+
+    def encode_ordinary_batch(self, texts: List[str], num_threads: int = 8) -> List[List[int]]:
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens: List[int]) -> str:
+        return " ".join(self._words[token] for token in tokens)
+
+def fake_embedding(text: str) -> List[float]:
+    """A deterministic vector per text, so equal texts get equal embeddings"""
+    import numpy as np
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype("float32").tolist()
+
+def _embeddings_response(input) -> SimpleNamespace:
+    texts = input if isinstance(input, list) else [input]
+    return SimpleNamespace(
+        data=[SimpleNamespace(embedding=fake_embedding(text), index=i) for i, text in enumerate(texts)],
+        usage=SimpleNamespace(prompt_tokens=len(texts), total_tokens=len(texts))
+    )
+
+def _completion_chunk(text: str) -> SimpleNamespace:
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+class FakeOpenAI:
+    """Sync OpenAI client: embeddings, and chat completions answered with `answer_tokens`"""
+
+    def __init__(self, answer_tokens: List[str]):
+        self.answer_tokens = answer_tokens
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    def _create_embeddings(self, model: str, input, **kwargs):
+        return _embeddings_response(input)
+
+    def _create_completion(self, model: str, messages, stream: bool = False, **kwargs):
+        if stream:
+            return iter([_completion_chunk(text) for text in self.answer_tokens])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="".join(self.answer_tokens)))],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=len(self.answer_tokens), total_tokens=len(self.answer_tokens))
+        )
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    """Async OpenAI client whose streamed chat completion yields one chunk per answer token"""
+
+    async def _create_embeddings(self, model: str, input, **kwargs):
+        return _embeddings_response(input)
+
+    async def _create_completion(self, model: str, messages, stream: bool = False, **kwargs):
+        if not stream:
+            return FakeOpenAI._create_completion(self, model, messages)
+
+        async def chunks():
+            for text in self.answer_tokens:
+                yield _completion_chunk(text)
+        return chunks()
+
+@pytest.fixture
+def fake_tokenizer(monkeypatch):
+    """Install a process-wide tokenizer backed by FakeEncoding"""
+    import tokenizer_service
+    monkeypatch.setattr(tokenizer_service, "_tokenizer", tokenizer_service.TokenizerService(FakeEncoding()))
+
+@pytest.fixture
+def company_service(tmp_path, monkeypatch):
+    """Point every service's companies and filings database at tmp_path instead of the repository's filingsdata"""
+    from app.services import company_service, index_service, question_service, document_service
+    from app.api import companies, extraction
+    isolated = functools.partial(company_service.CompanyService, companies_file=str(tmp_path / "companies.json"), output_dir=str(tmp_path / "output"))
+    for module in (index_service, question_service, document_service, companies, extraction):
+        monkeypatch.setattr(module, "CompanyService", isolated)
+    return isolated()
@@ -0,0 +1,68 @@
+from typing import List
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+def _cached_app(data: dict):
+    """An app serving data["items"] from a payload cache, tagged with data["version"]; returns it and the list of loads"""
+    from app.api.caching import PayloadCache
+
+    cache = PayloadCache()
+    loads = []
+    app = FastAPI()
+
+    @app.get("/items")
+    def items(request: Request):
+        def load():
+            loads.append(data["version"])
+            return data["items"]
+        return cache.response(request, "items", data["version"], load, List[str])
+    return app, loads
+
+def test_matching_if_none_match_gets_a_304_without_loading():
+    data = {"version": "1", "items": ["netflix", "roku"]}
+    app, loads = _cached_app(data)
+    client = TestClient(app)
+
+    response = client.get("/items")
+    assert response.status_code == 200
+    assert response.json() == ["netflix", "roku"]
+    etag = response.headers["etag"]
+
+    not_modified = client.get("/items", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert loads == ["1"]
+
+    data.update(version="2", items=["netflix"])
+    changed = client.get("/items", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json() == ["netflix"]
+    assert changed.headers["etag"] != etag
+    assert loads == ["1", "2"]
+
+def test_large_bodies_are_compressed_for_clients_that_accept_gzip():
+    from app.api.caching import COMPRESSION_MIN_BYTES
+
+    data = {"version": "1", "items": [f"theme {i}" for i in range(COMPRESSION_MIN_BYTES // 4)]}
+    app, _ = _cached_app(data)
+    client = TestClient(app)
+
+    compressed = client.get("/items", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.json() == data["items"]
+
+    plain = client.get("/items", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.content == compressed.content  # The client decoded the gzip body
+    assert plain.headers["etag"] == compressed.headers["etag"]
+
+def test_small_bodies_are_sent_uncompressed():
+    app, _ = _cached_app({"version": "1", "items": ["netflix"]})
+
+    response = TestClient(app).get("/items", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == ["netflix"]
@@ -0,0 +1,187 @@
+import io
+import os
+import json
+import asyncio
+import threading
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+def write_filing(path, description: str) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"filings": {"recent": [{"form": "10-Q", "description": description}]}}), encoding="utf-8")
+    return str(path)
+
+@pytest.fixture
+def catalog(tmp_path):
+    """A catalog that always rescans, counting the files it hashes"""
+    from filings_db import FilingsDatabase
+    from app.services.document_catalog import DocumentCatalog
+
+    (tmp_path / "companies.json").write_text("[]", encoding="utf-8")
+    db = FilingsDatabase(str(tmp_path / "output" / "filings.db"), str(tmp_path / "output"))
+    catalog = DocumentCatalog(str(tmp_path / "output" / "document_catalog.json"), db, refresh_interval=0)
+    catalog.hashed = []
+    get_file_hash = catalog._get_file_hash
+
+    def counting_hash(path):
+        catalog.hashed.append(os.path.basename(path))
+        return get_file_hash(path)
+    catalog._get_file_hash = counting_hash
+    return catalog
+
+def test_catalog_rehashes_only_new_and_changed_files(catalog, tmp_path):
+    company_dir = tmp_path / "Netflix"
+    first = write_filing(company_dir / "netflix-Q1-24.json", "Revenue grew.")
+    write_filing(company_dir / "netflix-Q2-24.json", "Margins grew.")
+
+    assert sorted(document.filename for document in catalog.list_documents("netflix", str(company_dir))) == ["netflix-Q1-24.json", "netflix-Q2-24.json"]
+    assert sorted(catalog.hashed) == ["netflix-Q1-24.json", "netflix-Q2-24.json"]
+
+    # Unchanged files are only stat'ed
+    catalog.hashed.clear()
+    version = catalog.version([("netflix", str(company_dir))])
+    assert catalog.hashed == []
+
+    write_filing(company_dir / "netflix-Q1-24.json", "Revenue grew a lot faster than expected.")
+    write_filing(company_dir / "netflix-Q3-24.json", "Ads grew.")
+    os.remove(company_dir / "netflix-Q2-24.json")
+    documents = catalog.list_documents("netflix", str(company_dir))
+
+    assert sorted(catalog.hashed) == ["netflix-Q1-24.json", "netflix-Q3-24.json"]
+    assert sorted(document.filename for document in documents) == ["netflix-Q1-24.json", "netflix-Q3-24.json"]
+    assert catalog.version([("netflix", str(company_dir))]) > version
+    assert catalog.find_by_hash(catalog._entries[first]["hash"], "netflix").path == first
+
+def test_catalog_is_reloaded_without_rehashing(catalog, tmp_path):
+    from app.services.document_catalog import DocumentCatalog
+
+    company_dir = tmp_path / "Netflix"
+    write_filing(company_dir / "netflix-Q1-24.json", "Revenue grew.")
+    catalog.list_documents("netflix", str(company_dir))
+
+    reloaded = DocumentCatalog(catalog.catalog_file, catalog.filings_db, refresh_interval=0)
+    reloaded._get_file_hash = lambda path: pytest.fail(f"{path} was hashed again")
+
+    assert [document.filename for document in reloaded.list_documents("netflix", str(company_dir))] == ["netflix-Q1-24.json"]
+
+def test_file_changed_while_hashed_is_left_for_the_next_scan(catalog, tmp_path):
+    company_dir = tmp_path / "Netflix"
+    path = write_filing(company_dir / "netflix-Q1-24.json", "Revenue grew.")
+    get_file_hash = catalog._get_file_hash
+
+    def hash_while_written(file_path):
+        file_hash = get_file_hash(file_path)
+        with open(file_path, 'a', encoding='utf-8') as file:
+            file.write(" ")
+        return file_hash
+    catalog._get_file_hash = hash_while_written
+
+    assert catalog.list_documents("netflix", str(company_dir)) == []
+
+    catalog._get_file_hash = get_file_hash
+    assert [document.path for document in catalog.list_documents("netflix", str(company_dir))] == [path]
+
+@pytest.fixture
+def documents_client(tmp_path, company_service, monkeypatch):
+    """A test client whose document routes read tmp_path's tracked companies and catalog"""
+    from app.main import app
+    from app.api import documents
+    from app.services.document_service import DocumentService
+
+    # company_service starts with the default companies, Netflix and Roku
+    trackedcompanies_dir = tmp_path / "trackedcompanies"
+    (trackedcompanies_dir / "Netflix").mkdir(parents=True)
+    app.dependency_overrides[documents.get_document_service] = lambda: DocumentService(
+        str(trackedcompanies_dir), str(tmp_path / "output" / "processed_files.json"))
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+def test_listing_revalidates_the_catalog_off_the_event_loop(documents_client, tmp_path, monkeypatch):
+    from app.services.document_catalog import DocumentCatalog
+
+    write_filing(tmp_path / "trackedcompanies" / "Netflix" / "netflix-Q1-24.json", "Revenue grew.")
+    on_event_loop = []
+    revalidate = DocumentCatalog._revalidate
+
+    def recording_revalidate(self, company_id, company_dir):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return revalidate(self, company_id, company_dir)
+    monkeypatch.setattr(DocumentCatalog, "_revalidate", recording_revalidate)
+
+    response = documents_client.get("/api/documents/company/netflix")
+
+    assert response.status_code == 200
+    assert [document["filename"] for document in response.json()] == ["netflix-Q1-24.json"]
+    assert on_event_loop and not any(on_event_loop)
+
+class RecordingIndexService:
+    """Stands in for the index service, recording the ingestions it is asked to queue"""
+
+    def __init__(self):
+        self.ingested = []
+
+    def start_ingest(self, company_id: str, document: str):
+        from app.models.index import IndexJob
+        self.ingested.append(os.path.basename(document))
+        return IndexJob(job_id=f"job-{len(self.ingested)}", company_id=company_id, kind="ingest", document=document,
+                        status="queued", created_at=datetime.now())
+
+def test_duplicate_uploads_are_rejected_with_409(documents_client, tmp_path):
+    from app.main import app
+    from app.api import documents
+
+    index_service = RecordingIndexService()
+    app.dependency_overrides[documents.get_index_service] = lambda: index_service
+    company_dir = tmp_path / "trackedcompanies" / "Netflix"
+    filing = json.dumps({"filings": {"recent": [{"form": "10-Q", "description": "Revenue grew."}]}}).encode("utf-8")
+
+    def upload(filename: str, content: bytes, company_id: str = "netflix"):
+        return documents_client.post(f"/api/documents/company/{company_id}/upload", files={"file": (filename, content, "application/json")})
+
+    response = upload("netflix-Q1-24.json", filing)
+    assert response.status_code == 202
+    assert response.json()["document"]["filename"] == "netflix-Q1-24.json"
+    assert response.json()["job"]["job_id"] == "job-1"
+
+    # The same content under another name, and another document under a taken name
+    same_content = upload("netflix-copy.json", filing)
+    assert same_content.status_code == 409
+    assert "already exists" in same_content.json()["detail"]
+    assert upload("netflix-Q1-24.json", filing.replace(b"grew", b"fell")).status_code == 409
+    assert upload("netflix-Q2-24.txt", b"Revenue").status_code == 400
+    assert upload("disney-Q1-24.json", filing, company_id="disney").status_code == 404
+
+    assert index_service.ingested == ["netflix-Q1-24.json"]
+    assert sorted(os.listdir(company_dir)) == ["netflix-Q1-24.json"]
+    assert (company_dir / "netflix-Q1-24.json").read_bytes() == filing
+
+def test_concurrent_uploads_of_one_document_store_it_once(tmp_path, company_service):
+    from app.services.document_service import DocumentService, DuplicateDocumentError
+
+    trackedcompanies_dir = tmp_path / "trackedcompanies"
+    service = DocumentService(str(trackedcompanies_dir), str(tmp_path / "output" / "processed_files.json"))
+    filing = json.dumps({"filings": {"recent": [{"form": "10-Q", "description": "Revenue grew."}]}}).encode("utf-8")
+    start = threading.Barrier(6)
+    outcomes = []
+
+    def upload(i: int) -> None:
+        start.wait()
+        try:
+            service.store_upload("netflix", f"netflix-{i}.json", io.BytesIO(filing))
+            outcomes.append("stored")
+        except DuplicateDocumentError:
+            outcomes.append("duplicate")
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == ["duplicate"] * 5 + ["stored"]
+    assert len(os.listdir(trackedcompanies_dir / "Netflix")) == 1
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FakeOpenAI, fake_embedding
+
+DIMENSIONS = 4
+
+@pytest.fixture
+def store(tmp_path):
+    from embedding_store import EmbeddingStore
+    return EmbeddingStore(str(tmp_path / "embeddings"), "test-model", DIMENSIONS)
+
+def vector(seed: float):
+    return [seed, seed + 1, seed + 2, seed + 3]
+
+def test_put_then_get_round_trips_and_skips_known_texts(store, tmp_path):
+    from embedding_store import EmbeddingStore
+
+    assert store.put_many(["a", "b"], [vector(1), vector(2)]) == 2
+    assert store.put_many(["b", "c", "empty"], [vector(9), vector(3), []]) == 1
+
+    assert store.get_many(["c", "missing", "a", "b"]) == [vector(3), None, vector(1), vector(2)]
+    # Another store over the same directory, as in another process, reads the same rows
+    assert EmbeddingStore(str(tmp_path / "embeddings"), "test-model", DIMENSIONS).get_many(["a", "b", "c"]) == [vector(1), vector(2), vector(3)]
+
+def test_gc_removes_unreferenced_keys_and_reads_after_compaction(store, tmp_path):
+    from embedding_store import EmbeddingStore
+
+    texts = [f"chunk {i}" for i in range(6)]
+    store.put_many(texts, [vector(i) for i in range(6)])
+    other = EmbeddingStore(str(tmp_path / "embeddings"), "test-model", DIMENSIONS)
+    assert len(other) == 6
+
+    kept = texts[1::2]
+    assert store.collect_garbage({store.key(text) for text in kept}) == 3
+
+    assert len(store) == 3
+    assert store.get_many(texts) == [None, vector(1), None, vector(3), None, vector(5)]
+    # A store that read the old generation picks up the compacted one
+    assert other.get_many(kept) == [vector(1), vector(3), vector(5)]
+    # Appends after compaction go to the new generation
+    store.put_many(["new"], [vector(7)])
+    assert other.get_many(["new", "chunk 5"]) == [vector(7), vector(5)]
+
+class RejectingEmbeddings:
+    """Embeddings endpoint that rejects requests over a token limit, recording the batches it was sent"""
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.batches = []
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _create(self, model, input, **kwargs):
+        self.batches.append(list(input))
+        if sum(len(text.split()) for text in input) > self.max_tokens:
+            raise ValueError("Request too large")
+        return FakeOpenAI([])._create_embeddings(model, input)
+
+def test_generate_embeddings_splits_batches_by_token_budget(fake_tokenizer, monkeypatch):
+    import theme_qa
+
+    monkeypatch.setattr(theme_qa, "EMBEDDING_BATCH_TOKENS", 10)
+    client = RejectingEmbeddings(max_tokens=10)
+    texts = ["one two three four", "five six seven", "eight nine ten eleven", "twelve"]
+
+    embeddings = theme_qa.TextProcessor(client).generate_embeddings(texts)
+
+    assert embeddings == [fake_embedding(text) for text in texts]
+    assert client.batches == [texts[:2], texts[2:]]
+
+def test_rejected_batch_is_retried_in_halves(fake_tokenizer):
+    import theme_qa
+
+    # The endpoint rejects anything over 5 tokens, more than the batch budget allows
+    client = RejectingEmbeddings(max_tokens=5)
+    texts = ["one two three", "four five", "six seven eight nine ten eleven", "twelve"]
+
+    embeddings = theme_qa.TextProcessor(client).generate_embeddings(texts)
+
+    assert embeddings[:2] == [fake_embedding(text) for text in texts[:2]]
+    assert embeddings[2] == []
+    assert embeddings[3] == fake_embedding(texts[3])
+    assert len(client.batches) == 5
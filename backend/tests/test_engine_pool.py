@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import FakeOpenAI, fake_embedding
+
+@pytest.fixture
+def pool_factory(tmp_path, fake_tokenizer, company_service):
+    """Make engine pools with a given memory budget over stored one-chunk indexes for netflix, roku and disney"""
+    from app.services.engine_pool import EnginePool, theme_qa
+
+    pools = []
+
+    def make(budget_partitions: float) -> EnginePool:
+        pool = EnginePool(
+            api_key=None,
+            trackedcompanies_dir=str(tmp_path / "trackedcompanies"),
+            output_dir=str(tmp_path / "output"),
+            openai_client=FakeOpenAI([])
+        )
+        # Store the indexes through another handle, so the pool has none of them loaded
+        store = theme_qa.SharedVectorIndex(pool.vector_index.store_dir)
+        for company_id in ("netflix", "roku", "disney"):
+            partition = theme_qa.VectorDatabase()
+            partition.add_document({"content": f"{company_id} revenue grew", "source": f"{company_id}-Q1-24.pdf"}, fake_embedding(company_id))
+            store.put_partition(company_id, partition)
+        pool.memory_budget_bytes = int(budget_partitions * store.partition_bytes("netflix"))
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.cpu_executor.shutdown()
+
+def test_least_recently_used_engine_is_evicted_over_budget(pool_factory):
+    pool = pool_factory(budget_partitions=2.5)
+    netflix = pool.get("netflix")
+    pool.get("roku")
+
+    assert pool.get("Netflix") is netflix
+    pool.get("disney")
+
+    stats = pool.stats()
+    assert [company["company_id"] for company in stats["companies"]] == ["disney", "netflix"]
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+    assert stats["total_bytes"] <= stats["memory_budget_bytes"]
+    assert pool.vector_index.loaded == {"netflix", "disney"}
+
+    # An evicted company is loaded again from its stored index
+    pool.get("roku")
+    assert [company["company_id"] for company in pool.stats()["companies"]] == ["roku", "disney"]
+
+def test_partitions_without_an_engine_are_unloaded_first(pool_factory):
+    pool = pool_factory(budget_partitions=2.5)
+    pool.get("netflix")
+
+    # Partitions loaded for cross-company searches count against the budget too
+    assert pool.vector_index.ensure_loaded(["roku", "disney"]) == ["roku", "disney"]
+
+    stats = pool.stats()
+    assert [company["company_id"] for company in stats["companies"]] == ["netflix"]
+    assert stats["evictions"] == 1
+    assert stats["partition_bytes"] == pool.vector_index.partition_bytes("disney")
+    assert pool.vector_index.loaded == {"netflix", "disney"}
@@ -0,0 +1,105 @@
+import json
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+class ExtractionCancelled(Exception):
+    pass
+
+class FakePipeline:
+    """Stands in for ThemeExtractionPipeline: reports two chunks, waiting for `release` before the second"""
+
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def __init__(self, **kwargs):
+        self.company_id = kwargs["company_id"]
+
+    def run(self, should_cancel=None, progress=None, files=None):
+        counters = {"phase": "extracting", "files_total": 1, "files_done": 0, "chunks_total": 2, "chunks_done": 1, "themes_found": 3, "tokens_used": 100}
+        progress(dict(counters))
+        FakePipeline.started.release()
+        while not FakePipeline.release.wait(0.01):
+            if should_cancel():
+                raise ExtractionCancelled(f"Theme extraction for {self.company_id} was cancelled")
+        counters.update(files_done=1, chunks_done=2, themes_found=5)
+        progress(dict(counters))
+
+@pytest.fixture
+def extraction_client(tmp_path, company_service, monkeypatch):
+    """A test client whose extraction routes run FakePipeline for tmp_path's companies"""
+    from app.main import app
+    from app.api import extraction
+    from app.services import extraction_service
+    from app.services.extraction_service import ExtractionService
+
+    for company in ("Netflix", "Roku"):
+        (tmp_path / "trackedcompanies" / company).mkdir(parents=True)
+    FakePipeline.release = threading.Event()
+    FakePipeline.started = threading.Semaphore(0)
+    monkeypatch.setattr(extraction_service, "theme_extractor", SimpleNamespace(ThemeExtractionPipeline=FakePipeline, ExtractionCancelled=ExtractionCancelled))
+    monkeypatch.setattr(extraction_service, "PROGRESS_POLL_INTERVAL", 0.01)
+
+    service = ExtractionService(None, str(tmp_path / "trackedcompanies"), str(tmp_path / "output"), max_workers=2)
+    app.dependency_overrides[extraction.get_extraction_service] = lambda: service
+    yield TestClient(app)
+    FakePipeline.release.set()
+    service._executor.shutdown()
+    app.dependency_overrides.clear()
+
+def wait_for_status(client, job_id: str, status: str, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/extraction/jobs/{job_id}").json()
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not become {status}")
+
+def test_a_company_has_one_active_run(extraction_client):
+    first = extraction_client.post("/api/extraction/company/netflix/run")
+    assert first.status_code == 202
+    assert FakePipeline.started.acquire(timeout=10)
+
+    again = extraction_client.post("/api/extraction/company/Netflix/run")
+    other = extraction_client.post("/api/extraction/company/roku/run")
+    assert again.json()["job_id"] == first.json()["job_id"]
+    assert other.json()["job_id"] != first.json()["job_id"]
+    assert extraction_client.post("/api/extraction/company/disney/run").status_code == 404
+
+    running = extraction_client.get(f"/api/extraction/jobs/{first.json()['job_id']}").json()
+    assert (running["status"], running["phase"], running["chunks_done"], running["chunks_total"]) == ("running", "extracting", 1, 2)
+    assert [job["company_id"] for job in extraction_client.get("/api/extraction/jobs?company_id=netflix").json()["jobs"]] == ["netflix"]
+
+def test_cancelled_run_stops(extraction_client):
+    job_id = extraction_client.post("/api/extraction/company/netflix/run").json()["job_id"]
+    assert FakePipeline.started.acquire(timeout=10)
+
+    assert extraction_client.post(f"/api/extraction/jobs/{job_id}/cancel").status_code == 200
+    job = wait_for_status(extraction_client, job_id, "cancelled")
+
+    assert job["phase"] is None and job["finished_at"]
+    assert extraction_client.post("/api/extraction/jobs/missing/cancel").status_code == 404
+    # A new run can start once the cancelled one has finished
+    assert extraction_client.post("/api/extraction/company/netflix/run").json()["job_id"] != job_id
+
+def test_event_stream_ends_with_the_finished_job(extraction_client):
+    job_id = extraction_client.post("/api/extraction/company/netflix/run").json()["job_id"]
+    assert FakePipeline.started.acquire(timeout=10)
+    threading.Timer(0.1, FakePipeline.release.set).start()
+
+    response = extraction_client.get(f"/api/extraction/jobs/{job_id}/events")
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    assert [name for name, _ in events[:-1]] == ["progress"] * (len(events) - 1)
+    assert events[0][1]["chunks_done"] == 1
+    name, job = events[-1]
+    assert name == "done"
+    assert (job["status"], job["chunks_done"], job["themes_found"]) == ("completed", 2, 5)
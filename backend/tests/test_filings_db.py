@@ -0,0 +1,69 @@
+import os
+import threading
+
+import pytest
+
+@pytest.fixture
+def db_file(tmp_path):
+    (tmp_path / "companies.json").write_text("[]", encoding="utf-8")
+    return str(tmp_path / "output" / "filings.db")
+
+def open_db(db_file):
+    from filings_db import FilingsDatabase
+    return FilingsDatabase(db_file, os.path.dirname(db_file))
+
+def test_concurrent_writers_lose_no_rows(db_file):
+    # Two handles on one file stand in for two processes; each has its own connection per thread
+    handles = [open_db(db_file), open_db(db_file)]
+    errors = []
+
+    def write(writer: int) -> None:
+        db = handles[writer % 2]
+        try:
+            for i in range(25):
+                assert db.insert_theme("netflix", {"name": f"Theme {writer}-{i}", "category": "Growth"})
+            db.set_processed_files({f"netflix-{writer}.pdf": f"hash-{writer}"})
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    db = open_db(db_file)
+    themes = db.get_themes("netflix")
+    assert len(themes) == 200
+    # Each writer's rows keep their order
+    assert [theme["name"] for theme in themes if theme["name"].startswith("Theme 3-")] == [f"Theme 3-{i}" for i in range(25)]
+    assert db.themes_version("netflix") == 200
+    assert len(db.get_processed_files()) == 8
+
+def test_merge_keeps_manual_themes_and_edits_made_meanwhile(db_file):
+    db = open_db(db_file)
+    db.insert_theme("netflix", {"name": "Ad Tier", "category": "Growth", "description": "Written by hand"})
+    db.insert_theme("netflix", {"name": "Live Sports", "category": "Content", "description": "Old", "source": "netflix-Q1-24.pdf"})
+    db.insert_theme("netflix", {"name": "Password Sharing", "category": "Growth", "description": "Old", "source": "netflix-Q1-24.pdf"})
+    db.insert_theme("roku", {"name": "Devices", "category": "Growth"})
+    # Edited through the API while the extraction ran
+    db.delete_theme("netflix", "password sharing")
+    version = db.themes_version("netflix")
+
+    merged = db.merge_themes("netflix", [
+        {"name": "live sports", "category": "Content", "description": "New", "source": "netflix-Q2-24.pdf"},
+        {"name": "Ad Tier", "category": "Growth", "description": "Extracted", "source": "netflix-Q2-24.pdf"},
+        {"name": "Games", "category": "Content", "description": "First", "source": "netflix-Q2-24.pdf"},
+        {"name": "GAMES", "category": "Content", "description": "Second", "source": "netflix-Q2-24.pdf"}
+    ])
+
+    assert [(theme["name"], theme["description"]) for theme in merged] == [
+        ("Ad Tier", "Written by hand"),
+        ("live sports", "New"),
+        ("Games", "First")
+    ]
+    assert db.get_themes("netflix") == merged
+    assert db.get_themes("roku") == [{"name": "Devices", "category": "Growth"}]
+    assert db.themes_version("netflix") == version + 1
+    assert db.merge_themes("netflix", []) == merged
+    assert db.themes_version("netflix") == version + 1
@@ -0,0 +1,67 @@
+import os
+import time
+import threading
+
+import pytest
+
+@pytest.fixture
+def watch(tmp_path):
+    """Start a polling watcher on tmp_path/trackedcompanies; returns the root and the (company, file name) pairs reported"""
+    from app.services.filings_watcher import FilingsWatcher
+
+    root = tmp_path / "trackedcompanies"
+    (root / "Netflix").mkdir(parents=True)
+    (root / "Netflix" / "netflix-Q1-24.pdf").write_bytes(b"%PDF already there")
+    reported = []
+    watcher = FilingsWatcher(str(root), lambda company_id, path: reported.append((company_id, os.path.basename(path))),
+                             debounce=0.1, poll_interval=0.02, use_inotify=False)
+    watcher.start()
+    yield root, reported
+    watcher.stop()
+
+def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_new_and_changed_documents_are_reported_once_after_the_debounce(watch):
+    root, reported = watch
+    (root / "Roku").mkdir()
+    (root / "Roku" / "roku-Q1-24.json").write_text("{}", encoding="utf-8")
+    (root / "Roku" / ".upload-1.tmp").write_text("{}", encoding="utf-8")
+    (root / "Roku" / ".hidden.json").write_text("{}", encoding="utf-8")
+    (root / "Roku" / "notes.txt").write_text("notes", encoding="utf-8")
+    (root / "stray.json").write_text("{}", encoding="utf-8")
+
+    wait_until(lambda: reported)
+    time.sleep(0.3)
+    assert reported == [("roku", "roku-Q1-24.json")]
+
+    (root / "Netflix" / "netflix-Q1-24.pdf").write_bytes(b"%PDF changed, and longer")
+    wait_until(lambda: len(reported) == 2)
+    time.sleep(0.3)
+    assert reported[1:] == [("netflix", "netflix-Q1-24.pdf")]
+
+def test_document_still_being_written_is_reported_once_complete(watch):
+    root, reported = watch
+    path = root / "Netflix" / "netflix-Q2-24.pdf"
+    writing = threading.Event()
+
+    def write_slowly() -> None:
+        with open(path, "wb") as file:
+            for _ in range(15):
+                file.write(b"%PDF page\n" * 100)
+                file.flush()
+                writing.set()
+                time.sleep(0.04)
+    writer = threading.Thread(target=write_slowly)
+    writer.start()
+    writing.wait()
+    writer.join()
+    # Nothing is reported while the file keeps growing for longer than the debounce period
+    assert reported == []
+
+    wait_until(lambda: reported)
+    time.sleep(0.3)
+    assert reported == [("netflix", "netflix-Q2-24.pdf")]
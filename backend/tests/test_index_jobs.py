@@ -0,0 +1,116 @@
+import json
+import time
+import threading
+
+import pytest
+
+from conftest import FakeOpenAI
+
+def write_filing(company_dir, quarter: int) -> None:
+    filing = {"filings": {"recent": [{"form": "10-Q", "description": f"Netflix streaming revenue in quarter {quarter}. " * 20}]}}
+    (company_dir / f"netflix-Q{quarter}-24.json").write_text(json.dumps(filing), encoding="utf-8")
+
+def wait_for(service, job_id: str, timeout: float = 30):
+    """Wait for a job to finish and return it"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = service.get_job(job_id)
+        if job.status not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+@pytest.fixture
+def company_dir(tmp_path):
+    """A Netflix documents directory with two filings"""
+    company_dir = tmp_path / "trackedcompanies" / "Netflix"
+    company_dir.mkdir(parents=True)
+    for quarter in (1, 2):
+        write_filing(company_dir, quarter)
+    return company_dir
+
+@pytest.fixture
+def index_service(tmp_path, company_dir, fake_tokenizer, company_service):
+    """An index service over the Netflix documents, with no index built yet"""
+    from app.services.engine_pool import EnginePool
+    from app.services.index_service import IndexService
+
+    pool = EnginePool(
+        api_key=None,
+        trackedcompanies_dir=str(tmp_path / "trackedcompanies"),
+        output_dir=str(tmp_path / "output"),
+        openai_client=FakeOpenAI([])
+    )
+    service = IndexService(pool)
+    yield service
+    service._executor.shutdown()
+    pool.cpu_executor.shutdown()
+
+def block_workers(service) -> threading.Event:
+    """Keep the service's single worker busy until the returned event is set"""
+    release = threading.Event()
+    service._executor.submit(release.wait)
+    return release
+
+def test_missing_index_queues_one_build_whose_job_the_error_carries(index_service):
+    from app.services.engine_pool import IndexNotReadyError
+
+    release = block_workers(index_service)
+    with pytest.raises(IndexNotReadyError) as first:
+        index_service.engine_pool.get("netflix")
+    with pytest.raises(IndexNotReadyError) as second:
+        index_service.engine_pool.get("netflix")
+    release.set()
+
+    assert first.value.job_id and first.value.job_id == second.value.job_id
+    assert [job.job_id for job in index_service.list_jobs("netflix")] == [first.value.job_id]
+    job = wait_for(index_service, first.value.job_id)
+    assert job.status == "completed"
+    assert index_service.engine_pool.get("netflix").vector_db.ntotal > 0
+
+def test_completed_build_swaps_in_a_new_version(index_service, company_dir):
+    vector_index = index_service.engine_pool.vector_index
+    first = wait_for(index_service, index_service.start_build("netflix").job_id)
+    assert first.status == "completed"
+    assert vector_index.current_version("netflix") == first.version
+    rows = vector_index.db.partition("netflix").index.ntotal
+
+    write_filing(company_dir, 3)
+    second = wait_for(index_service, index_service.start_build("netflix").job_id)
+
+    assert second.status == "completed"
+    assert second.version != first.version
+    assert vector_index.current_version("netflix") == second.version
+    assert vector_index.db.partition("netflix").index.ntotal > rows
+    assert second.documents_done == second.documents_total == 3
+
+def test_cancelling_a_queued_build_never_runs_it(index_service):
+    release = block_workers(index_service)
+    job = index_service.start_build("netflix")
+    assert index_service.cancel_job(job.job_id).status == "cancelled"
+    release.set()
+
+    index_service._executor.submit(lambda: None).result()
+    job = index_service.get_job(job.job_id)
+    assert job.status == "cancelled" and job.started_at is None
+    assert index_service.engine_pool.vector_index.current_version("netflix") is None
+
+def test_cancelling_a_running_build_keeps_the_live_version(index_service, company_dir, monkeypatch):
+    from app.services.engine_pool import theme_qa
+
+    live = wait_for(index_service, index_service.start_build("netflix").job_id).version
+    write_filing(company_dir, 3)
+
+    index_document = theme_qa.ThemeQA._index_document
+    def cancel_while_indexing(engine, *args, **kwargs):
+        for job in index_service.list_jobs("netflix"):
+            if job.status == "running":
+                index_service.cancel_job(job.job_id)
+        return index_document(engine, *args, **kwargs)
+    monkeypatch.setattr(theme_qa.ThemeQA, "_index_document", cancel_while_indexing)
+
+    job = wait_for(index_service, index_service.start_build("netflix").job_id)
+
+    assert job.status == "cancelled"
+    assert job.version is None
+    assert index_service.engine_pool.vector_index.current_version("netflix") == live
@@ -0,0 +1,105 @@
+import json
+import threading
+
+import pytest
+
+def write_filing(path, description: str) -> str:
+    path.write_text(json.dumps({"filings": {"recent": [{"form": "10-Q", "description": description}]}}), encoding="utf-8")
+    return str(path)
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Count the files actually parsed"""
+    from ingestion import DocumentProcessor
+    parses = []
+    parse_json_file = DocumentProcessor.parse_json_file
+
+    def counting_parse(file_path, file=None):
+        parses.append(file_path)
+        return parse_json_file(file_path, file)
+    monkeypatch.setattr(DocumentProcessor, "parse_json_file", staticmethod(counting_parse))
+    return parses
+
+def test_document_is_parsed_once_per_content(tmp_path, fake_tokenizer, parses):
+    from ingestion import ArtifactStore
+
+    root = str(tmp_path / "artifacts")
+    original = write_filing(tmp_path / "netflix-Q1-24.json", "Streaming revenue grew.")
+    copy = write_filing(tmp_path / "copy-of-netflix-Q1-24.json", "Streaming revenue grew.")
+
+    document = ArtifactStore(root).document(original)
+    # A renamed copy, read by another consumer of the same directory, reuses the artifact
+    reused = ArtifactStore(root).document(copy)
+
+    assert parses == [original]
+    assert document.doc_type == "json"
+    assert "Description: Streaming revenue grew." in document.text
+    assert reused.content_hash == document.content_hash and reused.text == document.text
+
+def test_concurrent_requests_parse_once_and_drop_their_locks(tmp_path, fake_tokenizer, parses):
+    from ingestion import ArtifactStore
+
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    path = write_filing(tmp_path / "roku-Q2-24.json", "Platform revenue grew. " * 200)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.document(path))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(parses) == 1
+    assert len({result.content_hash for result in results}) == 1
+    assert store._locks == {}
+
+def test_document_is_hashed_in_blocks_and_parsed_from_the_same_file(tmp_path, fake_tokenizer, monkeypatch):
+    import hashlib
+    import ingestion
+
+    monkeypatch.setattr(ingestion, "HASH_BLOCK_SIZE", 64)
+    store = ingestion.ArtifactStore(str(tmp_path / "artifacts"))
+    path = write_filing(tmp_path / "netflix-Q2-24.json", "Membership grew. " * 50)
+    reads = []
+    real_open = open
+
+    class RecordingFile:
+        def __init__(self, file):
+            self._file = file
+
+        def read(self, size=-1):
+            reads.append(size)
+            return self._file.read(size)
+
+        def __getattr__(self, name):
+            return getattr(self._file, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            self._file.close()
+
+    monkeypatch.setattr(ingestion, "open", lambda file, mode='r', *args, **kwargs: RecordingFile(real_open(file, mode, *args, **kwargs))
+                        if file == path else real_open(file, mode, *args, **kwargs), raising=False)
+
+    document = store.document(path)
+
+    with real_open(path, 'rb') as file:
+        assert document.content_hash == hashlib.md5(file.read()).hexdigest()
+    # Hashing never reads more than a block at a time; only the JSON parser reads the rest
+    assert reads[-1] == -1
+    assert all(0 < size <= 64 for size in reads[:-1])
+
+def test_chunks_are_cached_per_configuration(tmp_path, fake_tokenizer):
+    from ingestion import ArtifactStore, ChunkerConfig
+
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    document = store.document(write_filing(tmp_path / "netflix-Q3-24.json", "Ad tier subscribers doubled. " * 40))
+    config = ChunkerConfig(50, 5)
+
+    chunks = store.chunks(document, config)
+    cached = ArtifactStore(str(tmp_path / "artifacts")).chunks(document, config)
+
+    assert len(chunks) > 1 and all(count <= 55 for count in chunks.token_counts())
+    assert cached.contents() == chunks.contents()
+    assert cached.bounds == chunks.bounds
@@ -0,0 +1,86 @@
+import threading
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+def test_render_uses_the_prometheus_text_format():
+    from metrics_registry import MetricsRegistry
+
+    registry = MetricsRegistry()
+    requests = registry.counter("requests", "Requests by route", ("route",))
+    in_flight = registry.gauge("in_flight", "Requests in flight")
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.inc('/a"b')
+    requests.inc('/a"b', amount=2)
+    in_flight.inc()
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    assert registry.render() == (
+        '# HELP requests Requests by route\n'
+        '# TYPE requests counter\n'
+        'requests_total{route="/a\\"b"} 3\n'
+        '# HELP in_flight Requests in flight\n'
+        '# TYPE in_flight gauge\n'
+        'in_flight 1\n'
+        '# HELP latency_seconds Latency\n'
+        '# TYPE latency_seconds histogram\n'
+        'latency_seconds_bucket{le="0.1"} 1\n'
+        'latency_seconds_bucket{le="1"} 2\n'
+        'latency_seconds_bucket{le="+Inf"} 2\n'
+        'latency_seconds_sum 0.55\n'
+        'latency_seconds_count 2\n'
+    )
+
+def test_finished_threads_are_folded_into_the_totals():
+    from metrics_registry import MetricsRegistry
+
+    registry = MetricsRegistry()
+    counter = registry.counter("work", "Work done")
+    histogram = registry.histogram("work_seconds", "Work time")
+
+    def work():
+        counter.inc()
+        histogram.observe(0.2)
+    threads = [threading.Thread(target=work) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc()
+
+    assert counter.collect() == [("work_total", {}, 51.0)]
+    assert histogram.collect()[-1] == ("work_seconds_count", {}, 50)
+    # Only the live main thread keeps a shard
+    assert len(counter._shards._all) == 1
+    assert histogram._shards._all == {}
+
+def test_requests_are_labeled_with_the_route_template():
+    from app.api.metrics import MetricsMiddleware, HTTP_REQUESTS
+
+    router = APIRouter()
+
+    @router.get("/{company_id}/themes/{theme_id}")
+    def get_theme(company_id: str, theme_id: str):
+        return {}
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router, prefix="/api/metrics-test")
+    client = TestClient(app)
+
+    client.get("/api/metrics-test/netflix/themes/netflix")
+    client.get("/api/metrics-test/roku/themes/7")
+    client.get("/api/metrics-test/missing")
+
+    counts = {(labels["route"], labels["status"]): value for _, labels, value in HTTP_REQUESTS.collect()}
+    assert counts[("/api/metrics-test/{company_id}/themes/{theme_id}", "200")] == 2
+    assert counts[("unmatched", "404")] >= 1
+
+def test_metrics_endpoint():
+    from app.main import app
+
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert "# TYPE http_requests counter" in response.text
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+def response(total_tokens: int):
+    return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=total_tokens, total_tokens=total_tokens))
+
+def rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.RateLimitError("Rate limited", response=httpx.Response(429, headers={"retry-after": retry_after}, request=request), body=None)
+
+class ScriptedClient:
+    """OpenAI client whose calls raise or return the scripted outcomes in order"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    import openai_gateway
+    sleeps = []
+    monkeypatch.setattr(openai_gateway.time, "sleep", sleeps.append)
+    return sleeps
+
+def make_gateway(client, **limits):
+    from openai_gateway import OpenAIGateway
+    return OpenAIGateway(limits=limits, openai_client=client, async_openai_client=client)
+
+def balance(bucket) -> float:
+    return bucket._tokens
+
+def test_each_operation_and_model_has_its_own_buckets(sleeps):
+    client = ScriptedClient(response(50), response(50), response(5000))
+    gateway = make_gateway(client, chat=(60, 600), embeddings=(60, 60000), **{"gpt-4o-mini": (60, 6000)})
+
+    gateway.client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "x"}], max_tokens=50)
+    gateway.client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "x"}], max_tokens=50)
+    gateway.client.embeddings.create(model="text-embedding-3-large", input="y" * 20000)
+
+    assert gateway.stats()["limits"] == {
+        "chat/gpt-4o": {"requests_per_minute": 60, "tokens_per_minute": 600},
+        "chat/gpt-4o-mini": {"requests_per_minute": 60, "tokens_per_minute": 6000},
+        "embeddings/text-embedding-3-large": {"requests_per_minute": 60, "tokens_per_minute": 60000}
+    }
+    # The embeddings request used its own budget, leaving chat's untouched
+    assert balance(gateway.buckets("chat", "gpt-4o")[1]) == pytest.approx(550, abs=1)
+    assert balance(gateway.buckets("embeddings", "text-embedding-3-large")[1]) == pytest.approx(55000, abs=1)
+    assert not any(sleeps)
+
+def test_settles_against_the_tokens_reserved(sleeps):
+    # The estimate (2000 completion tokens) is above the bucket's capacity of 600
+    gateway = make_gateway(ScriptedClient(response(700)), chat=(60, 600))
+
+    gateway.client.chat.completions.create(model="gpt-4o", messages=[], max_tokens=2000)
+
+    # The whole bucket was reserved, and the actual 700 tokens are charged in full
+    assert balance(gateway.buckets("chat", "gpt-4o")[1]) == pytest.approx(-100, abs=1)
+
+def test_retry_honours_retry_after_and_reserves_tokens_once(sleeps):
+    client = ScriptedClient(rate_limit_error("3"), response(100))
+    gateway = make_gateway(client, chat=(60, 6000))
+
+    gateway.client.chat.completions.create(model="gpt-4o", messages=[], max_tokens=100)
+
+    assert client.calls == 2
+    assert [seconds for seconds in sleeps if seconds] == [pytest.approx(3)]
+    assert gateway.stats()["retries"] == 1
+    assert balance(gateway.buckets("chat", "gpt-4o")[1]) == pytest.approx(5900, abs=1)
+
+def test_failed_request_returns_its_reservation(sleeps):
+    gateway = make_gateway(ScriptedClient(ValueError("bad request")), chat=(60, 6000))
+
+    with pytest.raises(ValueError):
+        gateway.client.chat.completions.create(model="gpt-4o", messages=[], max_tokens=1000)
+
+    assert balance(gateway.buckets("chat", "gpt-4o")[1]) == pytest.approx(6000, abs=1)
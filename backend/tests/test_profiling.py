@@ -0,0 +1,66 @@
+import time
+import threading
+
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+
+def _busy_search(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+def _unrelated_work(stop: threading.Event) -> None:
+    while not stop.is_set():
+        pass
+
+def _profiled_app() -> FastAPI:
+    from app.api.profiling import router, ProfilingMiddleware
+
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, interval=0.001)
+    app.include_router(router, prefix="/api/profiles")
+
+    @app.get("/search")
+    async def search():
+        await run_in_threadpool(_busy_search, 0.2)
+        return {"ok": True}
+    return app
+
+def test_profiled_request_stores_its_collapsed_stacks():
+    client = TestClient(_profiled_app())
+
+    response = client.get("/search", headers={"X-Profile": "1", "X-Request-ID": "req-1"})
+    assert response.status_code == 200
+    assert response.headers["x-profile-id"] == "req-1"
+
+    profiles = client.get("/api/profiles").json()["profiles"]
+    assert [(profile["request_id"], profile["path"], profile["status"]) for profile in profiles][0] == ("req-1", "/search", 200)
+    collapsed = client.get("/api/profiles/req-1").text
+    lines = collapsed.splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert "test_profiling.py:_busy_search" in collapsed
+
+    assert client.get("/api/profiles/missing").status_code == 404
+
+def test_unprofiled_requests_pass_through():
+    client = TestClient(_profiled_app())
+
+    response = client.get("/search")
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+def test_profile_leaves_out_threads_not_working_for_the_request():
+    client = TestClient(_profiled_app())
+    stop = threading.Event()
+    other = threading.Thread(target=_unrelated_work, args=(stop,), name="unrelated")
+    other.start()
+    try:
+        response = client.get("/search?profile=1")
+    finally:
+        stop.set()
+        other.join()
+
+    collapsed = client.get(f"/api/profiles/{response.headers['x-profile-id']}").text
+    assert "_busy_search" in collapsed
+    assert "_unrelated_work" not in collapsed
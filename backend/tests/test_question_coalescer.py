@@ -0,0 +1,91 @@
+import asyncio
+
+def test_identical_questions_in_flight_share_one_compute():
+    from app.services.question_coalescer import QuestionCoalescer, question_key
+
+    async def scenario():
+        coalescer = QuestionCoalescer()
+        release = asyncio.Event()
+        computed = []
+
+        async def compute():
+            computed.append(True)
+            await release.wait()
+            return "Revenue grew."
+
+        questions = ["How did revenue change?", "how did  revenue CHANGE? ", "How did revenue change?"]
+        tasks = [asyncio.create_task(coalescer.answer(question_key("Netflix", question, None, "v1"), compute)) for question in questions]
+        # Another corpus version is a different question
+        other = asyncio.create_task(coalescer.answer(question_key("netflix", questions[0], None, "v2"), compute))
+        await asyncio.sleep(0)
+        assert coalescer.stats() == {"leaders": 2, "coalesced": 2, "in_flight": 2}
+
+        release.set()
+        answers = await asyncio.gather(*tasks, other)
+        assert answers == ["Revenue grew."] * 4
+        assert len(computed) == 2
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+def test_cancelled_leader_does_not_fail_its_followers():
+    from app.services.question_coalescer import QuestionCoalescer
+
+    async def scenario():
+        coalescer = QuestionCoalescer()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return "Revenue grew."
+
+        leader = asyncio.create_task(coalescer.answer(("netflix", "q", "{}", "v1"), compute))
+        follower = asyncio.create_task(coalescer.answer(("netflix", "q", "{}", "v1"), compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+
+        assert await follower == "Revenue grew."
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+
+def test_stream_followers_are_replayed_the_events_so_far():
+    from app.services.question_coalescer import QuestionCoalescer
+
+    async def scenario():
+        coalescer = QuestionCoalescer()
+        key = ("netflix", "how did revenue change?", "{}", "v1")
+        release = asyncio.Event()
+        started = []
+
+        async def events():
+            started.append(True)
+            yield {"event": "sources", "data": {"sources": []}}
+            yield {"event": "token", "data": {"text": "Revenue "}}
+            await release.wait()
+            yield {"event": "token", "data": {"text": "grew."}}
+            yield {"event": "done", "data": {"answer": "Revenue grew."}}
+
+        leader_events = []
+        leader_stream = coalescer.stream(key, events)
+        # The leader has seen two events before the follower arrives
+        for _ in range(2):
+            leader_events.append(await leader_stream.__anext__())
+
+        async def follow():
+            return [event async for event in coalescer.stream(key, events)]
+        follower = asyncio.create_task(follow())
+        plain = asyncio.create_task(coalescer.answer(key, None))
+        await asyncio.sleep(0)
+        release.set()
+        leader_events.extend([event async for event in leader_stream])
+
+        assert await follower == leader_events
+        assert [event["event"] for event in leader_events] == ["sources", "token", "token", "done"]
+        assert await plain == "Revenue grew."
+        assert len(started) == 1
+        await asyncio.sleep(0)  # Let the finished stream's entry be removed
+        assert coalescer.stats() == {"leaders": 1, "coalesced": 2, "in_flight": 0}
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import json
+from typing import List, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import FakeOpenAI, FakeAsyncOpenAI
+
+ANSWER_TOKENS = ["Streaming ", "revenue ", "grew. ", "Source: netflix-Q1-24.json"]
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, fake_tokenizer, company_service):
+    """A test client whose question endpoints answer from a fake OpenAI client over a built Netflix index"""
+    from app.main import app
+    from app.api import questions, index
+    from app.services.engine_pool import EnginePool
+    from app.services.index_service import IndexService
+
+    company_dir = tmp_path / "trackedcompanies" / "Netflix"
+    company_dir.mkdir(parents=True)
+    for quarter in range(1, 4):
+        filing = {"filings": {"recent": [{"form": "10-Q", "description": f"Netflix streaming revenue in quarter {quarter}. " * 20}]}}
+        (company_dir / f"netflix-Q{quarter}-24.json").write_text(json.dumps(filing), encoding="utf-8")
+
+    pool = EnginePool(
+        api_key=None,
+        trackedcompanies_dir=str(tmp_path / "trackedcompanies"),
+        output_dir=str(tmp_path / "output"),
+        openai_client=FakeOpenAI(ANSWER_TOKENS),
+        async_openai_client=FakeAsyncOpenAI(ANSWER_TOKENS)
+    )
+    pool.create_engine("netflix").load_documents()
+    monkeypatch.setattr(questions, "_engine_pool", pool)
+    monkeypatch.setattr(index, "_index_service", IndexService(pool))
+    # Keep the question service's caches out of the repository's filingsdata; company_service does the same for companies
+    monkeypatch.setattr(questions, "DEFAULT_OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.setattr(questions, "DEFAULT_CACHE_DIR", str(tmp_path / "output" / "cache"))
+    yield TestClient(app)
+    pool.cpu_executor.shutdown()
+
+def read_events(response) -> List[Tuple[str, dict]]:
+    """Parse a Server-Sent Events body into (event, data) pairs"""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_stream_emits_sources_then_tokens_then_done(client):
+    """The stream starts with the retrieved sources, then each answer token, and ends with the full answer"""
+    with client.stream("POST", "/api/questions/ask/stream?company_id=netflix", json={"question": "How did revenue change?"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        response.read()
+        events = read_events(response)
+
+    names = [name for name, _ in events]
+    assert names == ["sources"] + ["token"] * len(ANSWER_TOKENS) + ["done"]
+
+    sources = events[0][1]["sources"]
+    assert sources and all(source["source"].startswith("netflix-Q") for source in sources)
+    assert [data["text"] for name, data in events if name == "token"] == ANSWER_TOKENS
+
+    done = events[-1][1]
+    assert done["answer"] == "".join(ANSWER_TOKENS)
+    assert done["sources"] == ["netflix-Q1-24.json"]
+    assert done["company_id"] == "netflix"
+
+def test_stream_without_index_is_503_before_streaming(client):
+    """A company named in the body whose index is not built yet gets the 503 and Retry-After of the non-streaming route"""
+    response = client.post("/api/questions/ask/stream", json={"question": "How did revenue change?", "company_id": "roku"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "30"
+    assert response.json()["job_id"]
@@ -0,0 +1,31 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall-clock budgets depend on the machine, so they are only checked when asked for
+STARTUP_BUDGETS = os.environ.get("STARTUP_BUDGETS", "").lower() in ("1", "true", "yes")
+
+def test_importing_the_app_loads_no_heavy_modules():
+    """Importing the app leaves the question answering and extraction dependencies unloaded"""
+    import startup_benchmark
+
+    assert startup_benchmark.measure_import()["heavy_modules"] == []
+
+@pytest.mark.skipif(not STARTUP_BUDGETS, reason="set STARTUP_BUDGETS=1 to check the startup time budgets")
+def test_startup_is_within_budget():
+    """The startup benchmark passes with its default budgets"""
+    # The root endpoint reads no company data, so the servers started leave filingsdata untouched
+    result = subprocess.run(
+        [sys.executable, "startup_benchmark.py", "--runs", "3", "--path", "/", "--json"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=300
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert report["app_import_seconds"] <= report["import_budget"]
+    assert report["first_response_seconds"] <= report["first_response_budget"]
+    assert result.returncode == 0, report["failures"]
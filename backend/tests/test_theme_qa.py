@@ -0,0 +1,85 @@
+import re
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FakeOpenAI
+
+@pytest.fixture
+def engine_pool(tmp_path, fake_tokenizer, company_service):
+    """An engine pool over a Netflix documents directory with three filings, answering from a fake OpenAI client"""
+    from app.services.engine_pool import EnginePool
+
+    company_dir = tmp_path / "trackedcompanies" / "Netflix"
+    company_dir.mkdir(parents=True)
+    for quarter in range(1, 4):
+        filing = {"filings": {"recent": [{"form": "10-Q", "description": f"Netflix streaming revenue in quarter {quarter}. " * 20}]}}
+        (company_dir / f"netflix-Q{quarter}-24.json").write_text(json.dumps(filing), encoding="utf-8")
+
+    pool = EnginePool(
+        api_key=None,
+        trackedcompanies_dir=str(tmp_path / "trackedcompanies"),
+        output_dir=str(tmp_path / "output"),
+        openai_client=FakeOpenAI(["An answer."])
+    )
+    yield pool
+    pool.cpu_executor.shutdown()
+
+def _passage_snapshot():
+    """One source with two parent chunks of three 10-token passages: rows 0-2 (pages 1, 1, 2) and rows 3-5 (page 2)"""
+    from theme_qa import IndexSnapshot, VectorDatabase
+
+    database = VectorDatabase(2)
+    for row, (parent_id, page) in enumerate([(0, 1), (0, 1), (0, 2), (1, 2), (1, 2), (1, 2)]):
+        database.add_document({"content": f"p{row}", "source": "netflix-Q1-24.pdf", "type": "pdf", "chunk_id": row,
+                               "parent_id": parent_id, "page": page, "tokens": 10}, [float(row), 0.0])
+    return IndexSnapshot(2).with_partition("netflix", database)
+
+def test_passages_expand_within_their_parent_and_merge_on_a_page(engine_pool):
+    engine = engine_pool.create_engine("netflix")
+    snapshot = _passage_snapshot()
+    store = snapshot.partitions["netflix"].chunks
+
+    excerpts = engine._expand_passages([store.view(1, 0.1)], snapshot, token_budget=100)
+
+    # Row 3 is within the window but belongs to the next parent chunk
+    assert [(excerpt["content"], excerpt["page"], excerpt["tokens"], excerpt["score"]) for excerpt in excerpts] == [
+        ("p0 p1", 1, 20, 0.1),
+        ("p2", 2, 10, 0.1)
+    ]
+
+def test_passage_expansion_stays_within_the_token_budget(engine_pool):
+    engine = engine_pool.create_engine("netflix")
+    snapshot = _passage_snapshot()
+    store = snapshot.partitions["netflix"].chunks
+
+    # Both hits fit, then the better hit's neighbours take the rest of the budget
+    excerpts = engine._expand_passages([store.view(1, 0.1), store.view(4, 0.2)], snapshot, token_budget=40)
+
+    assert [(excerpt["content"], excerpt["score"]) for excerpt in excerpts] == [("p0 p1", 0.1), ("p2", 0.1), ("p4", 0.2)]
+
+class SlowFirstOpenAI(FakeOpenAI):
+    """Answers "Revenue question N?" with "answer N", the earlier questions taking longer; question 2 fails"""
+
+    def _create_completion(self, model: str, messages, stream: bool = False, **kwargs):
+        number = int(re.search(r"Revenue question (\d)", messages[-1]["content"]).group(1))
+        if number == 2:
+            raise RuntimeError("rate limited")
+        time.sleep(0.05 * (4 - number))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"answer {number}"))])
+
+def test_batch_answers_come_back_in_question_order(engine_pool):
+    engine = engine_pool.create_engine("netflix")
+    engine.load_documents()
+    engine.openai_client = SlowFirstOpenAI([])
+    questions = [f"Revenue question {number}?" for number in range(4)]
+
+    results = engine.answer_questions(questions, max_concurrency=4)
+
+    assert [result["question"] for result in results] == questions
+    assert [result["answer"] for result in results] == ["answer 0", "answer 1", None, "answer 3"]
+    assert [bool(result["error"]) for result in results] == [False, False, True, False]
+    assert "rate limited" in results[2]["error"]
+    assert engine.answer_questions([]) == []
@@ -0,0 +1,69 @@
+import pytest
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A theme store over a fresh database, counting how often it reads a company's themes"""
+    from app.services.theme_store import ThemeStore
+
+    (tmp_path / "companies.json").write_text("[]", encoding="utf-8")
+    store = ThemeStore(str(tmp_path / "output"))
+    store.reads = 0
+    get_themes = store.db.get_themes
+
+    def counting_get_themes(company_id):
+        store.reads += 1
+        return get_themes(company_id)
+    monkeypatch.setattr(store.db, "get_themes", counting_get_themes)
+    return store
+
+@pytest.fixture
+def service(store, monkeypatch):
+    from app.services import theme_service
+    monkeypatch.setattr(theme_service, "get_theme_store", lambda output_dir: store)
+    return theme_service.ThemeService(store.output_dir)
+
+def theme(name: str, category: str = "Growth", description: str = "Described"):
+    from app.models.theme import ThemeCreate
+    return ThemeCreate(name=name, description=description, category=category, company_id="netflix")
+
+def test_writes_go_through_to_the_cached_themes(service, store):
+    assert service.get_themes_by_company("netflix") == []
+    assert store.reads == 1
+
+    service.create_theme(theme("Ad Tier"))
+    service.create_theme(theme("Live Sports", "Content"))
+    service.update_theme("ad tier", theme("Ad Tier", description="Cheaper plan with ads"))
+    service.delete_theme("Live Sports", "netflix")
+    service.create_theme(theme("Games", "Content"))
+
+    assert [(t.name, t.description) for t in service.get_themes_by_company("netflix")] == [("Ad Tier", "Cheaper plan with ads"), ("Games", "Described")]
+    assert [t.name for t in service.get_themes_by_company("netflix", "content")] == ["Games"]
+    assert service.get_theme_by_name("AD TIER", "netflix").description == "Cheaper plan with ads"
+    assert service.get_theme_by_name("Live Sports", "netflix") is None
+    # Every write was applied to the cached themes: they were read from the database only once
+    assert store.reads == 1
+    assert [t["name"] for t in store.db.get_themes("netflix")] == ["Ad Tier", "Games"]
+
+def test_rejected_writes_leave_the_cache_alone(service, store):
+    service.create_theme(theme("Ad Tier"))
+    service.get_themes_by_company("netflix")
+
+    with pytest.raises(ValueError):
+        service.create_theme(theme("ad tier"))
+    assert service.update_theme("Missing", theme("Missing")) is None
+    assert service.delete_theme("Missing", "netflix") is False
+
+    assert [t.name for t in service.get_themes_by_company("netflix")] == ["Ad Tier"]
+    assert store.reads == 1
+
+def test_writes_by_another_writer_are_reread(service, store):
+    service.create_theme(theme("Ad Tier"))
+    assert len(service.get_themes_by_company("netflix")) == 1
+    reads = store.reads
+
+    # Another process (e.g. an extraction run) writes directly to the database
+    store.db.insert_theme("netflix", {"name": "Password Sharing", "description": "Paid sharing", "category": "Growth", "source": "netflix-Q1-24.json"})
+    service.create_theme(theme("Games", "Content"))
+
+    assert [t.name for t in service.get_themes_by_company("netflix")] == ["Ad Tier", "Password Sharing", "Games"]
+    assert store.reads == reads + 1
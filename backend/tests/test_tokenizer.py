@@ -0,0 +1,59 @@
+import os
+
+from conftest import FakeEncoding
+
+class CountingEncoding(FakeEncoding):
+    """FakeEncoding that records the texts it encodes"""
+
+    def __init__(self):
+        super().__init__()
+        self.encoded = []
+
+    def encode_ordinary(self, text):
+        self.encoded.append(text)
+        return super().encode_ordinary(text)
+
+def test_counts_are_served_from_the_lru():
+    from tokenizer_service import TokenizerService
+
+    encoding = CountingEncoding()
+    tokenizer = TokenizerService(encoding, threads=1)
+
+    assert tokenizer.count("one two three") == 3
+    assert tokenizer.count("one two three") == 3
+    assert tokenizer.count_batch(["one two three", "four five", "four five"]) == [3, 2, 2]
+    assert encoding.encoded == ["one two three", "four five"]
+
+    assert tokenizer.count("six", cache=False) == 1
+    assert "six" not in tokenizer._counts
+
+def test_lru_evicts_the_least_recently_used_beyond_its_characters():
+    from tokenizer_service import TokenizerService
+
+    tokenizer = TokenizerService(CountingEncoding(), threads=1, count_cache_chars=10)
+    tokenizer.count("aaaa")
+    tokenizer.count("bbbb")
+    tokenizer.count("aaaa")  # Now the most recently used
+    tokenizer.count("cccc")
+
+    assert list(tokenizer._counts) == ["aaaa", "cccc"]
+    assert tokenizer._cached_chars == 8
+    # A string longer than the whole LRU is counted but not kept
+    tokenizer.count("x" * 11)
+    assert list(tokenizer._counts) == ["aaaa", "cccc"]
+
+def test_load_encoding_leaves_the_environment_as_it_was(tmp_path, monkeypatch):
+    import tokenizer_service
+
+    seen = []
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+    monkeypatch.setattr(tokenizer_service.tiktoken, "get_encoding", lambda name: seen.append(os.environ.get("TIKTOKEN_CACHE_DIR")) or FakeEncoding())
+
+    tokenizer_service.load_encoding(str(tmp_path))
+    assert seen == [str(tmp_path)]
+    assert "TIKTOKEN_CACHE_DIR" not in os.environ
+
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", "/elsewhere")
+    tokenizer_service.load_encoding(str(tmp_path))
+    assert seen[-1] == "/elsewhere"
+    assert os.environ["TIKTOKEN_CACHE_DIR"] == "/elsewhere"
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+
+def _database(rows, dimension=4):
+    """A VectorDatabase holding (document, vector) rows"""
+    from theme_qa import VectorDatabase
+
+    database = VectorDatabase(dimension)
+    for document, vector in rows:
+        database.add_document(document, vector)
+    return database
+
+def _mmr_snapshot():
+    from theme_qa import IndexSnapshot
+
+    database = _database([
+        ({"content": "streaming revenue grew", "source": "a.pdf", "tokens": 10}, [1.0, 0.10, 0.0, 0.0]),
+        ({"content": "streaming revenue grew again", "source": "a-copy.pdf", "tokens": 10}, [1.0, 0.11, 0.0, 0.0]),
+        ({"content": "advertising tier launched", "source": "b.pdf", "tokens": 10}, [0.7, 0.7, 0.0, 0.0]),
+    ])
+    return IndexSnapshot(4).with_partition("netflix", database)
+
+def test_mmr_leaves_out_near_copies_of_selected_hits():
+    snapshot = _mmr_snapshot()
+    query = np.array([2.0, 0.0, 0.0, 0.0], dtype=np.float32)
+    hits = snapshot.search(query.tolist(), top_k=3)
+
+    selected, redundant_tokens = snapshot.mmr_select(query, hits, top_k=3, token_budget=100, mmr_lambda=0.7)
+
+    assert [hit["source"] for hit in selected] == ["a.pdf", "b.pdf"]
+    assert redundant_tokens == 10
+    # The caller's query is left as it was
+    assert query.tolist() == [2.0, 0.0, 0.0, 0.0]
+
+def test_mmr_with_lambda_one_ranks_by_relevance_and_keeps_near_copies():
+    snapshot = _mmr_snapshot()
+    query = [1.0, 0.0, 0.0, 0.0]
+    hits = snapshot.search(query, top_k=3)
+
+    selected, redundant_tokens = snapshot.mmr_select(query, hits, top_k=3, token_budget=100, mmr_lambda=1.0)
+
+    assert [hit["source"] for hit in selected] == ["a.pdf", "a-copy.pdf", "b.pdf"]
+    assert redundant_tokens == 0
+
+def test_mmr_respects_the_token_budget():
+    snapshot = _mmr_snapshot()
+    query = [1.0, 0.0, 0.0, 0.0]
+    hits = snapshot.search(query, top_k=3)
+
+    selected, _ = snapshot.mmr_select(query, hits, top_k=3, token_budget=15, mmr_lambda=1.0)
+
+    assert [hit["source"] for hit in selected] == ["a.pdf"]
+
+def test_chunk_store_rows_read_back_through_views():
+    import pickle
+    from theme_qa import ChunkStore
+
+    store = ChunkStore()
+    store.append({"content": "Ad tier grew", "source": "netflix-Q1-24.pdf", "type": "pdf", "chunk_id": 0, "total_chunks": 2, "page": 3, "tokens": 3})
+    store.append({"content": "Prix élevés", "source": "netflix-Q1-24.pdf", "type": "pdf", "chunk_id": 1, "total_chunks": 2, "parent_id": 0})
+    store.append({"content": "Roku devices", "source": "roku-Q2-24.json", "type": "json", "company": "roku"})
+
+    assert len(store) == 3
+    assert store.sources == ["netflix-Q1-24.pdf", "roku-Q2-24.json"]
+    first, second, third = (store.view(row) for row in range(3))
+    assert dict(first) == {"content": "Ad tier grew", "source": "netflix-Q1-24.pdf", "chunk_id": 0, "total_chunks": 2, "type": "pdf",
+                           "period": "2024Q1", "company": "", "parent_id": 0, "page": 3, "tokens": 3}
+    assert second["content"] == "Prix élevés" and second["parent_id"] == 0
+    assert third["company"] == "roku" and third["period"] == "2024Q2"
+
+    # Selecting, extending and pickling keep every column row-aligned
+    selected = store.select(np.array([False, True, True]))
+    assert [view["content"] for view in map(selected.view, range(2))] == ["Prix élevés", "Roku devices"]
+    selected.extend(store, company="netflix")
+    assert [selected.view(row)["company"] for row in range(5)] == ["", "roku", "netflix", "netflix", "netflix"]
+    restored = pickle.loads(pickle.dumps(selected))
+    assert [dict(restored.view(row)) for row in range(5)] == [dict(selected.view(row)) for row in range(5)]
+
+def _filings_database():
+    """Rows alternating between two quarters' filings, the Q1 rows nearest to the origin"""
+    rows = []
+    for i in range(8):
+        quarter, kind = ("Q1", "pdf") if i % 2 == 0 else ("Q2", "json")
+        rows.append(({"content": f"row {i}", "source": f"netflix-{quarter}-24.{kind}", "type": kind}, [float(i), 0.0, 0.0, 0.0]))
+    return _database(rows)
+
+def test_filtered_search_only_returns_matching_rows():
+    database = _filings_database()
+    query = [0.0, 0.0, 0.0, 0.0]
+
+    # The Q2 rows are further away than every Q1 row, yet the filter finds them first
+    hits = database.search(query, top_k=3, filters={"periods": ["2024Q2"]})
+    assert [hit["content"] for hit in hits] == ["row 1", "row 3", "row 5"]
+    assert [hit["content"] for hit in database.search(query, top_k=10, filters={"types": ["PDF"], "sources": ["netflix-Q1-24.pdf"]})] == \
+        ["row 0", "row 2", "row 4", "row 6"]
+    # Filters that every row matches search as if there were none
+    assert [hit["content"] for hit in database.search(query, top_k=2, filters={"types": ["pdf", "json"]})] == ["row 0", "row 1"]
+
+def test_filtered_search_without_matches_is_empty():
+    database = _filings_database()
+
+    assert database.search([0.0, 0.0, 0.0, 0.0], filters={"sources": ["roku-Q1-24.pdf"]}) == []
+    with pytest.raises(ValueError):
+        database.search([0.0, 0.0, 0.0, 0.0], filters={"authors": ["someone"]})
+
+def test_batch_search_filters_every_query():
+    database = _filings_database()
+
+    results = database.search_batch([[0.0, 0.0, 0.0, 0.0], [], [7.0, 0.0, 0.0, 0.0]], top_k=2, filters={"periods": ["Q1-24"]})
+
+    assert [[hit["content"] for hit in hits] for hits in results] == [["row 0", "row 2"], [], ["row 6", "row 4"]]
+
+def _company_database(company: str, offsets):
+    return _database([({"content": f"{company} {offset}", "source": f"{company}-Q1-24.pdf"}, [offset, 0.0, 0.0, 0.0]) for offset in offsets])
+
+def test_partitions_are_searched_by_company_and_merged_by_distance(tmp_path):
+    from theme_qa import SharedVectorIndex, ALL_COMPANIES
+
+    shared = SharedVectorIndex(str(tmp_path / "index"), dimension=4)
+    shared.put_partition("Netflix", _company_database("netflix", [0.0, 2.0, 4.0]))
+    shared.put_partition("roku", _company_database("roku", [1.0, 3.0]))
+    query = [0.0, 0.0, 0.0, 0.0]
+
+    assert [hit["content"] for hit in shared.db.search(query, top_k=3)] == ["netflix 0.0", "roku 1.0", "netflix 2.0"]
+    assert [hit["content"] for hit in shared.db.search(query, top_k=3, filters={"companies": ["roku"]})] == ["roku 1.0", "roku 3.0"]
+    assert [hit["company"] for hit in shared.db.search(query, top_k=5, filters={"companies": [ALL_COMPANIES]})] == \
+        ["netflix", "roku", "netflix", "roku", "netflix"]
+    assert shared.db.search(query, filters={"companies": ["disney"]}) == []
+
+def test_replacing_a_partition_leaves_the_others_and_survives_a_reload(tmp_path):
+    from theme_qa import SharedVectorIndex
+
+    store_dir = str(tmp_path / "index")
+    shared = SharedVectorIndex(store_dir, dimension=4)
+    shared.put_partition("netflix", _company_database("netflix", [0.0]))
+    roku_version = shared.put_partition("roku", _company_database("roku", [1.0]))
+    roku_partition = shared.db.partition("roku")
+    before = shared.db
+
+    netflix_version = shared.put_partition("netflix", _company_database("netflix", [5.0, 6.0]))
+
+    assert shared.db.partition("roku") is roku_partition
+    assert before.partition("netflix").index.ntotal == 1  # Searches on the earlier snapshot are unaffected
+    assert shared.current_version("roku") == roku_version and shared.current_version("netflix") == netflix_version
+
+    reloaded = SharedVectorIndex(store_dir, dimension=4)
+    assert reloaded.available_partitions() == ["netflix", "roku"]
+    assert reloaded.loaded == set()
+    assert reloaded.ensure_loaded(["netflix", "disney"]) == ["netflix"]
+    assert [hit["content"] for hit in reloaded.db.search([0.0, 0.0, 0.0, 0.0])] == ["netflix 5.0", "netflix 6.0"]
+
+    reloaded.drop_partition("netflix")
+    assert reloaded.available_partitions() == ["roku"]
+    assert not reloaded.has_partition("netflix")
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Embedding Store
+
+A persistent, content-addressed store of embeddings, shared by every company and
+every index build in an output directory. Each vector is keyed by a hash of the
+embedding model, its dimensions and the embedded text, so the same chunk is
+embedded once however many companies track its filing, and rebuilding an index
+(after invalidating caches, or in another retrieval mode) reads its vectors from
+the store instead of calling the embeddings API again.
+
+The vectors of one model and dimension live in <root>/<model>-<dimensions>/, in
+two append-only files of one generation:
+
+- vectors-<generation>.f32: the vectors, as raw float32 rows
+- keys-<generation>.bin: the 16-byte key of each row, in the same order
+
+The keys file is the index: it is read into a dict of key -> row (16 bytes per
+vector), and vectors are read from the vectors file by offset. A CURRENT file
+names the live generation. Appends are serialized between processes with a lock
+file, and keys are written after their vectors, so a crash leaves at most rows
+without keys, which the next append overwrites. Garbage collection copies the
+referenced rows into a new generation and then replaces CURRENT, so readers never
+see a half-compacted store. Engines record the cache directory their index lives in
+(a custom one included) in a cache_dirs file, so garbage collection finds every
+index that references the store.
+
+Show the size of the store, or remove the embeddings no stored index uses, with:
+    python embedding_store.py stats
+    python embedding_store.py gc
+"""
+
+import os
+import hashlib
+import argparse
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Sequence, Set
+
+import numpy as np
+
+try:
+    import fcntl  # Serializes appends between processes; on Windows only threads are serialized
+except ImportError:
+    fcntl = None
+
+from metrics_registry import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "filingsdata", "output")
+EMBEDDINGS_DIR = os.path.join("cache", "embeddings")  # Under the output directory
+KEY_BYTES = 16
+CURRENT_GENERATION_FILE = "CURRENT"  # Names the live generation
+LOCK_FILE = "lock"
+CACHE_DIRS_FILE = "cache_dirs"  # Cache directories holding indexes built from the store, one per line
+VECTORS_FILE = "vectors-{generation}.f32"
+KEYS_FILE = "keys-{generation}.bin"
+
+def embedding_key(model: str, dimensions: int, text: str) -> bytes:
+    """The key of an embedding: a hash of the model, its dimensions and the embedded text"""
+    digest = hashlib.blake2b(digest_size=KEY_BYTES)
+    digest.update(f"{model}\n{dimensions}\n".encode("utf-8"))
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+class EmbeddingStore:
+    """
+    The embeddings of one model and dimension.
+
+    Safe to share between threads and between processes using the same directory.
+    Appends made by other processes are picked up on the next lookup.
+    """
+
+    def __init__(self, root: str, model: str, dimensions: int):
+        self.model = model
+        self.dimensions = dimensions
+        self.directory = os.path.join(root, f"{model}-{dimensions}")
+        self.row_bytes = 4 * dimensions
+        self._rows: Dict[bytes, int] = {}  # Key -> row in the vectors file
+        self._generation: Optional[int] = None  # Generation _rows was read from
+        self._keys_read = 0  # Bytes of the keys file read into _rows
+        self._cache_dirs: Set[str] = set()  # Cache directories known to be recorded in the cache_dirs file
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, text: str) -> bytes:
+        """The key of a text's embedding in this store"""
+        return embedding_key(self.model, self.dimensions, text)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+    def size_bytes(self) -> int:
+        """Disk space used by the live generation"""
+        with self._lock:
+            self._refresh()
+            if self._generation is None:
+                return 0
+            return sum(os.path.getsize(path) for path in self._paths(self._generation) if os.path.exists(path))
+
+    def add_cache_dir(self, cache_dir: str) -> None:
+        """Record a cache directory holding indexes built from this store, so garbage collection reads their references"""
+        cache_dir = os.path.abspath(cache_dir)
+        with self._lock:
+            if cache_dir in self._cache_dirs:
+                return
+            with self._file_lock():
+                recorded = set(self._read_cache_dirs())
+                if cache_dir not in recorded:
+                    with open(os.path.join(self.directory, CACHE_DIRS_FILE), 'a', encoding='utf-8') as file:
+                        file.write(cache_dir + "\n")
+            self._cache_dirs = recorded | {cache_dir}
+
+    def cache_dirs(self) -> List[str]:
+        """The cache directories recorded as holding indexes built from this store"""
+        with self._lock:
+            return self._read_cache_dirs()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """The stored embedding of each text, or None for the ones not in the store"""
+        keys = [self.key(text) for text in texts]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            self._refresh()
+            rows = [(i, self._rows[key]) for i, key in enumerate(keys) if key in self._rows]
+            if rows:
+                vectors_path, _ = self._paths(self._generation)
+                try:
+                    with open(vectors_path, 'rb') as file:
+                        for i, row in sorted(rows, key=lambda item: item[1]):
+                            file.seek(row * self.row_bytes)
+                            embeddings[i] = np.frombuffer(file.read(self.row_bytes), dtype=np.float32).tolist()
+                except OSError as e:
+                    # Another process compacted the store meanwhile; re-read it on the next lookup
+                    logger.warning(f"Error reading embeddings from {vectors_path}: {str(e)}")
+                    self._generation = None
+                    embeddings = [None] * len(texts)
+        hits = sum(embedding is not None for embedding in embeddings)
+        CACHE_REQUESTS.inc("embeddings", "hit", amount=hits)
+        CACHE_REQUESTS.inc("embeddings", "miss", amount=len(texts) - hits)
+        return embeddings
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> int:
+        """Store the embeddings of texts not in the store yet; returns how many were added"""
+        new: Dict[bytes, Sequence[float]] = {}
+        for text, embedding in zip(texts, embeddings):
+            if len(embedding) != self.dimensions:
+                if embedding:
+                    logger.warning(f"Not storing an embedding with {len(embedding)} dimensions in the {self.dimensions}-dimension store")
+                continue
+            new.setdefault(self.key(text), embedding)
+        if not new:
+            return 0
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            for key in [key for key in new if key in self._rows]:
+                del new[key]
+            if not new:
+                return 0
+            if self._generation is None:
+                self._switch_generation(1)
+
+            vectors_path, keys_path = self._paths(self._generation)
+            row = self._keys_read // KEY_BYTES
+            # Vectors first, over any left without keys by a crash; then the keys that make them visible
+            with open(vectors_path, 'r+b') as file:
+                file.seek(row * self.row_bytes)
+                file.write(np.asarray(list(new.values()), dtype=np.float32).tobytes())
+            with open(keys_path, 'r+b') as file:
+                file.seek(self._keys_read)
+                file.write(b"".join(new))
+                file.truncate()
+
+            for i, key in enumerate(new):
+                self._rows[key] = row + i
+            self._keys_read += len(new) * KEY_BYTES
+        return len(new)
+
+    def collect_garbage(self, referenced: Set[bytes]) -> int:
+        """Remove the embeddings whose keys are not referenced; returns how many were removed"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._generation is None:
+                return 0
+            keep = sorted((row, key) for key, row in self._rows.items() if key in referenced)
+            removed = len(self._rows) - len(keep)
+            if not removed:
+                return 0
+
+            # Copy the referenced rows into a new generation, then make it live
+            old_paths = self._paths(self._generation)
+            generation = self._generation + 1
+            vectors_path, keys_path = self._paths(generation)
+            with open(old_paths[0], 'rb') as source, open(vectors_path, 'wb') as vectors_file, open(keys_path, 'wb') as keys_file:
+                for row, key in keep:
+                    source.seek(row * self.row_bytes)
+                    vectors_file.write(source.read(self.row_bytes))
+                    keys_file.write(key)
+            self._switch_generation(generation)
+            for path in old_paths:
+                os.remove(path)
+            self._refresh()
+
+        logger.info(f"Removed {removed} unreferenced embeddings from {self.directory}, kept {len(keep)}")
+        return removed
+
+    def _paths(self, generation: int):
+        """The vectors and keys files of a generation"""
+        return (os.path.join(self.directory, VECTORS_FILE.format(generation=generation)),
+                os.path.join(self.directory, KEYS_FILE.format(generation=generation)))
+
+    def _read_cache_dirs(self) -> List[str]:
+        try:
+            with open(os.path.join(self.directory, CACHE_DIRS_FILE), 'r', encoding='utf-8') as file:
+                return [line for line in file.read().splitlines() if line]
+        except FileNotFoundError:
+            return []
+
+    def _current_generation(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.directory, CURRENT_GENERATION_FILE), 'r', encoding='utf-8') as file:
+                return int(file.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _refresh(self) -> None:
+        """Read the keys appended since the last read, starting over if the generation changed"""
+        generation = self._current_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._rows = {}
+            self._keys_read = 0
+        if generation is None:
+            return
+
+        _, keys_path = self._paths(generation)
+        try:
+            size = os.path.getsize(keys_path)
+        except FileNotFoundError:
+            return
+        size -= size % KEY_BYTES  # A key cut short by a crash is overwritten by the next append
+        if size <= self._keys_read:
+            return
+        with open(keys_path, 'rb') as file:
+            file.seek(self._keys_read)
+            data = file.read(size - self._keys_read)
+        first_row = self._keys_read // KEY_BYTES
+        for offset in range(0, len(data), KEY_BYTES):
+            self._rows.setdefault(data[offset:offset + KEY_BYTES], first_row + offset // KEY_BYTES)
+        self._keys_read += len(data)
+
+    def _switch_generation(self, generation: int) -> None:
+        """Create a generation's files if needed and make it live with a single rename"""
+        for path in self._paths(generation):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        current_file = os.path.join(self.directory, CURRENT_GENERATION_FILE)
+        with open(current_file + ".tmp", 'w', encoding='utf-8') as file:
+            file.write(str(generation))
+        os.replace(current_file + ".tmp", current_file)
+        self._generation = generation
+        self._rows = {}
+        self._keys_read = 0
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold the store's lock file, so one process at a time appends or compacts"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+# One store per directory, shared by every engine in the process
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+def get_embedding_store(output_dir: str, model: str, dimensions: int) -> EmbeddingStore:
+    """Get the process-wide embedding store of an output directory for a model and dimension"""
+    root = os.path.join(os.path.abspath(output_dir), EMBEDDINGS_DIR)
+    with _stores_lock:
+        key = os.path.join(root, f"{model}-{dimensions}")
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(root, model, dimensions)
+        return _stores[key]
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Manage the embedding store shared by the question answering indexes")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Output directory holding the store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show how many embeddings are stored and their size")
+    subparsers.add_parser("gc", help="Remove the embeddings that no stored index partition uses")
+    args = parser.parse_args()
+
+    # The index layout belongs to the question answering engine
+    from theme_qa import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, collect_embedding_garbage
+    store = get_embedding_store(args.output_dir, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    if args.command == "gc":
+        removed = collect_embedding_garbage(args.output_dir)
+        print(f"Removed {removed} unreferenced embeddings")
+    print(f"{len(store)} embeddings of {EMBEDDING_MODEL} ({EMBEDDING_DIMENSIONS} dimensions), "
+          f"{store.size_bytes() / (1024 * 1024):.1f} MB in {store.directory}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Filings Database
+
+Transactional storage for companies, themes and processed file state, shared by
+the backend services and the scripts. It replaces read-modify-write of whole JSON
+files (companies.json, <company>_themes.json, processed_files.json) with row-level
+writes to a SQLite database in WAL mode, so concurrent API workers and extraction
+runs no longer lose each other's updates.
+
+The JSON files remain the interchange format: they are imported the first time the
+database is opened, and can be imported again or exported with this script.
+
+Examples:
+    python filings_db.py export
+    python filings_db.py import --force
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "filingsdata", "output")
+DB_FILE = "filings.db"  # Stored in the output directory
+COMPANIES_JSON_FILE = "companies.json"  # Stored in the parent of the output directory
+THEMES_FILE_SUFFIX = "_themes.json"
+PROCESSED_FILES_JSON = "processed_files.json"
+BUSY_TIMEOUT_MS = 30000  # How long a write waits for another process's transaction
+
+# Version keys, bumped in the same transaction as the rows they cover
+COMPANIES_VERSION = "companies"
+THEMES_VERSION = "themes"  # Any theme of any company
+PROCESSED_FILES_VERSION = "processed_files"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companies (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS themes (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_id TEXT NOT NULL COLLATE NOCASE,
+    name TEXT NOT NULL COLLATE NOCASE,
+    category TEXT NOT NULL COLLATE NOCASE,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS themes_by_name ON themes (company_id, name);
+CREATE INDEX IF NOT EXISTS themes_by_category ON themes (company_id, category);
+CREATE TABLE IF NOT EXISTS processed_files (
+    path TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imports (
+    kind TEXT PRIMARY KEY
+);
+"""
+
+def themes_version_key(company_id: str) -> str:
+    """Version key of one company's themes"""
+    return f"{THEMES_VERSION}:{company_id.lower()}"
+
+class FilingsDatabase:
+    """
+    SQLite store of companies, themes and processed files.
+
+    Rows keep the JSON object they were written with, so themes round-trip exactly
+    (manual themes are told apart by having no "source" key). Lookups by company,
+    theme name and category use indexes, and each write touches only its own rows
+    in a short IMMEDIATE transaction. Every write also bumps a version counter, so
+    readers in any process can cheaply tell whether their cached copy is stale.
+
+    Connections are per thread; the database file is safe to share between processes.
+    """
+
+    def __init__(self, db_file: str, output_dir: str, companies_file: Optional[str] = None):
+        self.db_file = db_file
+        self.output_dir = output_dir
+        self.companies_file = companies_file or os.path.join(os.path.dirname(output_dir), COMPANIES_JSON_FILE)
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+        self.import_json()
+
+    # Connections and transactions
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction, taking the write lock up front so it cannot deadlock on upgrade"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, *keys: str) -> int:
+        """Bump version counters inside a write transaction; returns the last key's new version"""
+        for key in keys:
+            conn.execute("INSERT INTO versions (key, version) VALUES (?, 1) "
+                         "ON CONFLICT (key) DO UPDATE SET version = version + 1", (key,))
+        return conn.execute("SELECT version FROM versions WHERE key = ?", (keys[-1],)).fetchone()[0]
+
+    def version(self, key: str) -> int:
+        """Current version of a key (0 if never written)"""
+        row = self._connection().execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    # Companies
+
+    def list_companies(self) -> List[Dict[str, Any]]:
+        """All companies in insertion order"""
+        return [json.loads(data) for data, in self._connection().execute("SELECT data FROM companies ORDER BY position")]
+
+    def get_company(self, company_id: str) -> Optional[Dict[str, Any]]:
+        """A company by ID (case-insensitive)"""
+        row = self._connection().execute("SELECT data FROM companies WHERE id = ?", (company_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def insert_company(self, company: Dict[str, Any]) -> bool:
+        """Add a company; returns False if one with the same ID exists"""
+        with self._write() as conn:
+            try:
+                conn.execute("INSERT INTO companies (id, data) VALUES (?, ?)", (company["id"], json.dumps(company)))
+            except sqlite3.IntegrityError:
+                return False
+            self._bump(conn, COMPANIES_VERSION)
+        return True
+
+    def update_company(self, company_id: str, company: Dict[str, Any]) -> bool:
+        """Replace a company in place; returns False if it does not exist"""
+        with self._write() as conn:
+            cursor = conn.execute("UPDATE companies SET id = ?, data = ? WHERE id = ?", (company["id"], json.dumps(company), company_id))
+            if cursor.rowcount == 0:
+                return False
+            self._bump(conn, COMPANIES_VERSION)
+        return True
+
+    def delete_company(self, company_id: str) -> bool:
+        """Delete a company; returns False if it does not exist"""
+        with self._write() as conn:
+            if conn.execute("DELETE FROM companies WHERE id = ?", (company_id,)).rowcount == 0:
+                return False
+            self._bump(conn, COMPANIES_VERSION)
+        return True
+
+    # Themes
+
+    def theme_company_ids(self) -> List[str]:
+        """Companies that have at least one theme, sorted"""
+        return [company_id for company_id, in self._connection().execute("SELECT DISTINCT company_id FROM themes ORDER BY company_id")]
+
+    def get_themes(self, company_id: str) -> List[Dict[str, Any]]:
+        """A company's themes in insertion order"""
+        return [json.loads(data) for data, in self._connection().execute(
+            "SELECT data FROM themes WHERE company_id = ? ORDER BY position", (company_id,))]
+
+    def get_theme(self, company_id: str, name: str) -> Optional[Dict[str, Any]]:
+        """A company's theme by name (case-insensitive)"""
+        row = self._connection().execute("SELECT data FROM themes WHERE company_id = ? AND name = ? ORDER BY position LIMIT 1",
+                                         (company_id, name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def insert_theme(self, company_id: str, theme: Dict[str, Any], replace: bool = False) -> int:
+        """
+        Add a theme to a company; returns the company's new themes version.
+
+        If a theme with the same name exists, it is replaced in place when replace is
+        set; otherwise nothing is written and 0 is returned.
+        """
+        with self._write() as conn:
+            row = conn.execute("SELECT position FROM themes WHERE company_id = ? AND name = ? ORDER BY position LIMIT 1",
+                               (company_id, theme["name"])).fetchone()
+            if row is not None:
+                if not replace:
+                    return 0
+                self._update_theme_row(conn, row[0], theme)
+            else:
+                conn.execute("INSERT INTO themes (company_id, name, category, data) VALUES (?, ?, ?, ?)",
+                             (company_id, theme["name"], theme.get("category", "General"), json.dumps(theme)))
+            return self._bump(conn, THEMES_VERSION, themes_version_key(company_id))
+
+    def update_theme(self, company_id: str, name: str, theme: Dict[str, Any]) -> int:
+        """Replace a company's theme in place; returns the company's new themes version, or 0 if it does not exist"""
+        with self._write() as conn:
+            row = conn.execute("SELECT position FROM themes WHERE company_id = ? AND name = ? ORDER BY position LIMIT 1",
+                               (company_id, name)).fetchone()
+            if row is None:
+                return 0
+            self._update_theme_row(conn, row[0], theme)
+            return self._bump(conn, THEMES_VERSION, themes_version_key(company_id))
+
+    @staticmethod
+    def _update_theme_row(conn: sqlite3.Connection, position: int, theme: Dict[str, Any]) -> None:
+        conn.execute("UPDATE themes SET name = ?, category = ?, data = ? WHERE position = ?",
+                     (theme["name"], theme.get("category", "General"), json.dumps(theme), position))
+
+    def delete_theme(self, company_id: str, name: str) -> int:
+        """Delete a company's theme; returns the company's new themes version, or 0 if it does not exist"""
+        with self._write() as conn:
+            cursor = conn.execute("DELETE FROM themes WHERE position = (SELECT position FROM themes WHERE company_id = ? AND name = ? "
+                                  "ORDER BY position LIMIT 1)", (company_id, name))
+            if cursor.rowcount == 0:
+                return 0
+            return self._bump(conn, THEMES_VERSION, themes_version_key(company_id))
+
+    def merge_themes(self, company_id: str, new_themes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Merge extracted themes into a company's themes in one transaction (e.g. after an extraction run).
+
+        Only the rows of the new themes are written, against the themes as they are now,
+        so themes added, edited or deleted meanwhile (e.g. through the API) are kept. A
+        new theme replaces an extracted theme of the same name in place, is skipped if a
+        manual theme (one without a "source") has its name, and is added otherwise; of
+        several new themes with the same name, the first is used. Returns the company's
+        themes after the merge.
+        """
+        with self._write() as conn:
+            merged = set()
+            for theme in new_themes:
+                name = theme["name"].lower()
+                if name in merged:
+                    continue
+                merged.add(name)
+                row = conn.execute("SELECT position, data FROM themes WHERE company_id = ? AND name = ? ORDER BY position LIMIT 1",
+                                   (company_id, theme["name"])).fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO themes (company_id, name, category, data) VALUES (?, ?, ?, ?)",
+                                 (company_id, theme["name"], theme.get("category", "General"), json.dumps(theme)))
+                elif "source" in json.loads(row[1]):
+                    self._update_theme_row(conn, row[0], theme)
+            if merged:
+                self._bump(conn, THEMES_VERSION, themes_version_key(company_id))
+            return [json.loads(data) for data, in conn.execute(
+                "SELECT data FROM themes WHERE company_id = ? ORDER BY position", (company_id,))]
+
+    def _replace_themes(self, conn: sqlite3.Connection, company_id: str, themes: List[Dict[str, Any]]) -> None:
+        conn.execute("DELETE FROM themes WHERE company_id = ?", (company_id,))
+        conn.executemany("INSERT INTO themes (company_id, name, category, data) VALUES (?, ?, ?, ?)",
+                         [(company_id, theme["name"], theme.get("category", "General"), json.dumps(theme)) for theme in themes])
+        self._bump(conn, THEMES_VERSION, themes_version_key(company_id))
+
+    def themes_version(self, company_id: str) -> int:
+        """Version of a company's themes"""
+        return self.version(themes_version_key(company_id))
+
+    # Processed files
+
+    def get_processed_files(self) -> Dict[str, Any]:
+        """Processed file info by path (a content hash, or a dict with "hash" and "timestamp")"""
+        return {path: json.loads(data) for path, data in self._connection().execute("SELECT path, data FROM processed_files")}
+
+    def set_processed_files(self, processed_files: Dict[str, Any]) -> None:
+        """Insert or update processed file info for the given paths only"""
+        if not processed_files:
+            return
+        with self._write() as conn:
+            conn.executemany("INSERT INTO processed_files (path, data) VALUES (?, ?) ON CONFLICT (path) DO UPDATE SET data = excluded.data",
+                             [(path, json.dumps(info)) for path, info in processed_files.items()])
+            self._bump(conn, PROCESSED_FILES_VERSION)
+
+    # JSON import and export
+
+    def import_json(self, force: bool = False) -> None:
+        """
+        Import the JSON files into the database.
+
+        Each kind of data is imported once, the first time the database is opened; with
+        force, the tables are replaced by the current contents of the JSON files.
+        """
+        with self._write() as conn:
+            imported = {kind for kind, in conn.execute("SELECT kind FROM imports")}
+
+            if force or COMPANIES_VERSION not in imported:
+                companies = self._read_json(self.companies_file, [])
+                conn.execute("DELETE FROM companies")
+                conn.executemany("INSERT OR REPLACE INTO companies (id, data) VALUES (?, ?)",
+                                 [(company["id"], json.dumps(company)) for company in companies])
+                self._bump(conn, COMPANIES_VERSION)
+                if companies:
+                    logger.info(f"Imported {len(companies)} companies from {self.companies_file}")
+
+            if force or THEMES_VERSION not in imported:
+                for company_id, in conn.execute("SELECT DISTINCT company_id FROM themes").fetchall():
+                    self._replace_themes(conn, company_id, [])
+                theme_files = sorted(file for file in os.listdir(self.output_dir) if file.endswith(THEMES_FILE_SUFFIX)) if os.path.isdir(self.output_dir) else []
+                for file in theme_files:
+                    company_id = file[:-len(THEMES_FILE_SUFFIX)]
+                    themes = self._read_json(os.path.join(self.output_dir, file), [])
+                    self._replace_themes(conn, company_id, themes)
+                    logger.info(f"Imported {len(themes)} themes for company {company_id}")
+
+            if force or PROCESSED_FILES_VERSION not in imported:
+                processed_files = self._read_json(os.path.join(self.output_dir, PROCESSED_FILES_JSON), {})
+                conn.execute("DELETE FROM processed_files")
+                conn.executemany("INSERT INTO processed_files (path, data) VALUES (?, ?)",
+                                 [(path, json.dumps(info)) for path, info in processed_files.items()])
+                self._bump(conn, PROCESSED_FILES_VERSION)
+
+            conn.executemany("INSERT OR IGNORE INTO imports (kind) VALUES (?)",
+                             [(COMPANIES_VERSION,), (THEMES_VERSION,), (PROCESSED_FILES_VERSION,)])
+
+    def export_json(self) -> List[str]:
+        """Write the database back out to the JSON files; returns the files written"""
+        written = [self._write_json(self.companies_file, self.list_companies())]
+        for company_id in self.theme_company_ids():
+            written.append(self._write_json(os.path.join(self.output_dir, f"{company_id}{THEMES_FILE_SUFFIX}"), self.get_themes(company_id)))
+        written.append(self._write_json(os.path.join(self.output_dir, PROCESSED_FILES_JSON), self.get_processed_files()))
+        return written
+
+    @staticmethod
+    def _read_json(path: str, default: Any) -> Any:
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except Exception as e:
+            logger.error(f"Error importing {path}: {str(e)}")
+            return default
+
+    @staticmethod
+    def _write_json(path: str, data: Any) -> str:
+        # Write to a temporary file first so readers never see a partial file
+        with open(path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+# One database per database file, shared within the process
+_databases: Dict[str, FilingsDatabase] = {}
+_databases_lock = threading.Lock()
+
+def get_filings_db(output_dir: str = DEFAULT_OUTPUT_DIR, companies_file: Optional[str] = None) -> FilingsDatabase:
+    """
+    Get the process-wide database stored in output_dir.
+
+    companies_file only says where companies are imported from and exported to; a
+    caller that names one makes it the database's companies file.
+    """
+    output_dir = os.path.abspath(output_dir)
+    db_file = os.path.join(output_dir, DB_FILE)
+    with _databases_lock:
+        if db_file not in _databases:
+            _databases[db_file] = FilingsDatabase(db_file, output_dir, companies_file)
+        elif companies_file:
+            _databases[db_file].companies_file = os.path.abspath(companies_file)
+        return _databases[db_file]
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Import or export the filings database as JSON files")
+    parser.add_argument("action", choices=["import", "export"], help="import the JSON files into the database, or export the database to them")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Output directory containing the database and themes files")
+    parser.add_argument("--companies-file", help="Companies JSON file (defaults to companies.json next to the output directory)")
+    parser.add_argument("--force", action="store_true", help="With import, replace data that was already imported")
+
+    args = parser.parse_args()
+
+    db = get_filings_db(args.output_dir, args.companies_file)
+    if args.action == "import":
+        db.import_json(force=args.force)
+        print(f"Database: {db.db_file}")
+    else:
+        for path in db.export_json():
+            print(f"Exported {path}")
+
+if __name__ == "__main__":
+    main()
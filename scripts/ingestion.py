@@ -0,0 +1,430 @@
+"""
+Ingestion
+
+The document ingestion layer shared by the theme extractor and the question
+answering engine. Each filing is read, parsed, cleaned and chunked once, and the
+results are kept as artifacts in a versioned on-disk cache keyed by the MD5 hash
+of the file's content:
+
+- the document: its extracted text (pages separated by a form feed) and the
+  offset of each page in it
+- its chunks, once per chunker configuration: the page each chunk came from,
+  its character boundaries in the cleaned text it was split from, and its
+  token IDs (from which its text and token count are recovered)
+
+Consumers keep only their own record of which content hashes they have processed
+(the extractor's processed files, the QA engine's file hashes), so a filing is
+parsed and chunked once however many consumers read it, and a copied or renamed
+filing is not parsed again at all. Bump ARTIFACT_VERSION when text extraction or
+chunking changes, so artifacts made the old way are not reused.
+"""
+
+import os
+import re
+import json
+import pickle
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from array import array
+from typing import List, Dict, Tuple, Optional, BinaryIO
+
+import PyPDF2
+
+from metrics_registry import CACHE_REQUESTS
+from tokenizer_service import get_tokenizer, ENCODING_NAME
+
+logger = logging.getLogger(__name__)
+
+ARTIFACTS_DIR = os.path.join("cache", "artifacts")  # Under the output directory
+ARTIFACT_VERSION = 1
+DOCUMENT_FILE = "document.json"
+CHUNKS_FILE = "chunks-{key}.pkl"
+PAGE_BREAK = "\f"  # Separator between pages in extracted PDF text
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def _hash_file(file: BinaryIO) -> str:
+    """The MD5 hash of an open file's content from its current position, read in blocks"""
+    digest = hashlib.md5()
+    for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+class DocumentProcessor:
+    """Handles the processing of different document types."""
+
+    @staticmethod
+    def extract_text_from_pdf(file_path: str, file: Optional[BinaryIO] = None) -> str:
+        """Extract text from a PDF file, or from the file already open at its start."""
+        logger.info(f"Extracting text from PDF: {file_path}")
+        text = ""
+        try:
+            with (nullcontext(file) if file is not None else open(file_path, 'rb')) as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                for page_num in range(len(pdf_reader.pages)):
+                    page = pdf_reader.pages[page_num]
+                    # Pages are separated by a form feed so chunks can be mapped back to them
+                    text += page.extract_text() + PAGE_BREAK
+            return text
+        except Exception as e:
+            logger.error(f"Error extracting text from PDF {file_path}: {str(e)}")
+            return ""
+
+    @staticmethod
+    def parse_json_file(file_path: str, file: Optional[BinaryIO] = None) -> Dict:
+        """Parse a JSON file, or the file already open at its start."""
+        logger.info(f"Parsing JSON file: {file_path}")
+        try:
+            if file is not None:
+                return json.load(file)
+            with open(file_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except Exception as e:
+            logger.error(f"Error parsing JSON file {file_path}: {str(e)}")
+            return {}
+
+    @staticmethod
+    def extract_text_from_sec_json(json_data: Dict) -> str:
+        """Extract relevant text from SEC JSON data."""
+        # This is a placeholder. The actual implementation would depend on the
+        # structure of the SEC JSON files, which we couldn't examine directly.
+        text = ""
+        try:
+            # Example extraction logic - adjust based on actual JSON structure
+            if "filings" in json_data:
+                for filing in json_data.get("filings", {}).get("recent", []):
+                    text += f"Filing Type: {filing.get('form', '')}\n"
+                    text += f"Filing Date: {filing.get('filingDate', '')}\n"
+                    text += f"Description: {filing.get('description', '')}\n\n"
+
+            # Add more extraction logic based on the actual structure
+            return text
+        except Exception as e:
+            logger.error(f"Error extracting text from SEC JSON: {str(e)}")
+            return ""
+
+class TextChunker:
+    """Cleans text and splits it into chunks of at most a number of tokens, with overlap."""
+
+    def __init__(self):
+        self.tokenizer = get_tokenizer()  # Shared by every chunker in the process
+
+    def clean_text(self, text: str) -> str:
+        """Clean and normalize text."""
+        # Remove special characters that don't add meaning
+        text = re.sub(r'[^\w\s.,;:!?()[\]{}"\'-]', '', text)
+        # Remove excessive whitespace, including any left where special characters were removed
+        text = re.sub(r'\s+', ' ', text)
+        return text.strip()
+
+    def chunk_text(self, text: str, max_tokens: int, overlap: int) -> List[str]:
+        """Split text into chunks of specified token size with overlap."""
+        return [content for content, _, _ in self.split(self.clean_text(text), max_tokens, overlap)]
+
+    def split(self, text: str, max_tokens: int, overlap: int) -> List[Tuple[str, int, int]]:
+        """
+        Split cleaned text into chunks, on sentence boundaries where possible.
+
+        Returns (content, start, end) per chunk: start and end bound the chunk in the
+        text, and the content is that span prefixed with up to overlap tokens from the
+        end of the previous chunk.
+        """
+        # If text is short enough, return it as a single chunk
+        if self.tokenizer.count(text, cache=False) <= max_tokens:
+            return [(text, 0, len(text))]
+
+        chunks = []
+
+        # Split text into sentences to avoid breaking in the middle of a sentence
+        sentences = re.split(r'(?<=[.!?])\s+', text)
+        current_chunk = ""
+
+        for sentence in sentences:
+            # Check if adding this sentence would exceed the max tokens
+            potential_chunk = current_chunk + " " + sentence if current_chunk else sentence
+            if self.tokenizer.count(potential_chunk, cache=False) <= max_tokens:
+                current_chunk = potential_chunk
+            else:
+                # Save the current chunk and start a new one
+                if current_chunk:
+                    chunks.append(current_chunk)
+
+                # If the sentence itself is too long, we need to split it
+                if self.tokenizer.count(sentence, cache=False) > max_tokens:
+                    # Split by words
+                    words = sentence.split()
+                    current_chunk = ""
+                    for word in words:
+                        potential_chunk = current_chunk + " " + word if current_chunk else word
+                        if self.tokenizer.count(potential_chunk, cache=False) <= max_tokens:
+                            current_chunk = potential_chunk
+                        else:
+                            chunks.append(current_chunk)
+                            current_chunk = word
+                else:
+                    current_chunk = sentence
+
+        # Add the last chunk if it's not empty
+        if current_chunk:
+            chunks.append(current_chunk)
+
+        # Chunks are consecutive spans of the cleaned text, joined by the single spaces between them
+        spans = []
+        position = 0
+        for chunk in chunks:
+            start = text.find(chunk, position)
+            position = start + len(chunk)
+            spans.append((chunk, start, position))
+
+        # Create overlapping chunks
+        overlapping_chunks = []
+        for i, (chunk, start, end) in enumerate(spans):
+            if i > 0 and overlap > 0:
+                # Get the end of the previous chunk for overlap
+                prev_tokens = self.tokenizer.encode(spans[i-1][0])
+                overlap_tokens = prev_tokens[-overlap:] if len(prev_tokens) > overlap else prev_tokens
+                overlap_text = self.tokenizer.decode(overlap_tokens)
+
+                # Add the overlap to the beginning of the current chunk
+                overlapping_chunks.append((overlap_text + " " + chunk, start, end))
+            else:
+                overlapping_chunks.append((chunk, start, end))
+
+        return overlapping_chunks
+
+class ChunkerConfig:
+    """How a document is chunked: chunk size and overlap in tokens, and whether chunks stay within a page."""
+
+    def __init__(self, max_tokens: int, overlap: int, per_page: bool = False):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.per_page = per_page
+
+    @property
+    def key(self) -> str:
+        """Identifies the configuration in the artifact cache"""
+        return f"{ENCODING_NAME}-{self.max_tokens}-{self.overlap}{'-pages' if self.per_page else ''}"
+
+class DocumentArtifact:
+    """A document's extracted text, pages separated by PAGE_BREAK, and where each page starts in it."""
+
+    def __init__(self, content_hash: str, doc_type: str, text: str, page_offsets: List[int]):
+        self.content_hash = content_hash
+        self.doc_type = doc_type
+        self.text = text
+        self.page_offsets = page_offsets
+
+    def pages(self) -> List[str]:
+        """The text of each page (a document without page breaks is one page)"""
+        return self.text.split(PAGE_BREAK)
+
+class DocumentChunks:
+    """
+    A document's chunks under one chunker configuration.
+
+    Per chunk: its page (1-based, or 0 if the document has no pages or the chunks
+    may span pages), its start and end offsets in the cleaned text of the page or
+    document it was split from, and its token IDs.
+    """
+
+    def __init__(self, config_key: str, pages: List[int], bounds: List[Tuple[int, int]], tokens: List[array]):
+        self.config_key = config_key
+        self.pages = pages
+        self.bounds = bounds
+        self.tokens = tokens
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def contents(self) -> List[str]:
+        """The text of each chunk"""
+        tokenizer = get_tokenizer()
+        return [tokenizer.decode(tokens) for tokens in self.tokens]
+
+    def token_counts(self) -> List[int]:
+        """The number of tokens in each chunk"""
+        return [len(tokens) for tokens in self.tokens]
+
+class ArtifactStore:
+    """
+    The artifact cache of one output directory.
+
+    Safe to share between threads: concurrent requests for the same document or
+    chunks wait for the first one to produce them instead of parsing it again.
+    Artifacts are written atomically, so processes sharing the directory only ever
+    see complete ones.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.doc_processor = DocumentProcessor()
+        self.chunker = TextChunker()
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}  # path -> (size, mtime_ns, content hash)
+        self._locks: Dict[str, List] = {}  # Key -> [lock, holders and waiters], dropped when no one uses it
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def file_hash(self, file_path: str) -> str:
+        """The MD5 hash of a file's content, rehashed only when its size or modification time changes"""
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Error calculating file hash: {str(e)}")
+            return ""
+        with self._lock:
+            cached = self._hashes.get(file_path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+
+        try:
+            with open(file_path, 'rb') as file:
+                content_hash = _hash_file(file)
+        except OSError as e:
+            logger.error(f"Error calculating file hash: {str(e)}")
+            return ""
+        return self._remember_hash(file_path, stat, content_hash)
+
+    def _remember_hash(self, file_path: str, stat: os.stat_result, content_hash: str) -> str:
+        with self._lock:
+            self._hashes[file_path] = (stat.st_size, stat.st_mtime_ns, content_hash)
+        return content_hash
+
+    def document(self, file_path: str) -> Optional[DocumentArtifact]:
+        """A PDF or SEC JSON file's document artifact, parsing the file if it has none yet; None if it has no text"""
+        content_hash = self.file_hash(file_path)
+        if not content_hash:
+            return None
+        with self._key_lock(content_hash):
+            artifact = self._load_document(content_hash)
+            if artifact is not None:
+                CACHE_REQUESTS.inc("artifact_documents", "hit")
+                return artifact
+
+        # Hash and parse the same open file, so a file replaced meanwhile is parsed as hashed
+        try:
+            file = open(file_path, 'rb')
+        except OSError as e:
+            logger.error(f"Error reading {file_path}: {str(e)}")
+            return None
+        with file:
+            try:
+                stat = os.fstat(file.fileno())
+                content_hash = self._remember_hash(file_path, stat, _hash_file(file))
+                file.seek(0)
+            except OSError as e:
+                logger.error(f"Error reading {file_path}: {str(e)}")
+                return None
+            return self._parse_document(file_path, file, content_hash)
+
+    def _parse_document(self, file_path: str, file: BinaryIO, content_hash: str) -> Optional[DocumentArtifact]:
+        """Parse an open file into its document artifact, unless another thread or process already did"""
+        with self._key_lock(content_hash):
+            artifact = self._load_document(content_hash)
+            if artifact is not None:
+                CACHE_REQUESTS.inc("artifact_documents", "hit")
+                return artifact
+            CACHE_REQUESTS.inc("artifact_documents", "miss")
+
+            doc_type = file_path.split('.')[-1].lower()
+            if doc_type == "pdf":
+                text = self.doc_processor.extract_text_from_pdf(file_path, file)
+            else:
+                json_data = self.doc_processor.parse_json_file(file_path, file)
+                if not json_data:
+                    logger.warning(f"No data parsed from JSON: {file_path}")
+                    return None
+                text = self.doc_processor.extract_text_from_sec_json(json_data)
+            if not text:
+                logger.warning(f"No text extracted from {doc_type.upper()}: {file_path}")
+                return None
+
+            page_offsets = [0] + [match.end() for match in re.finditer(PAGE_BREAK, text) if match.end() < len(text)]
+            artifact = DocumentArtifact(content_hash, doc_type, text, page_offsets)
+            self._write(os.path.join(self.root, content_hash, DOCUMENT_FILE), json.dumps({
+                "content_hash": content_hash,
+                "doc_type": doc_type,
+                "text": text,
+                "page_offsets": page_offsets
+            }).encode("utf-8"))
+            return artifact
+
+    def chunks(self, document: DocumentArtifact, config: ChunkerConfig) -> DocumentChunks:
+        """A document's chunks under a chunker configuration, chunking it if they are not cached yet"""
+        path = os.path.join(self.root, document.content_hash, CHUNKS_FILE.format(key=config.key))
+        with self._key_lock(path):
+            if os.path.exists(path):
+                try:
+                    with open(path, 'rb') as file:
+                        state = pickle.load(file)
+                    CACHE_REQUESTS.inc("artifact_chunks", "hit")
+                    return DocumentChunks(**state)
+                except Exception as e:
+                    logger.error(f"Error loading chunks {path}: {str(e)}")
+            CACHE_REQUESTS.inc("artifact_chunks", "miss")
+
+            if config.per_page:
+                pages = document.pages()
+                units = [(page_num if len(pages) > 1 else 0, page_text) for page_num, page_text in enumerate(pages, start=1)]
+            else:
+                units = [(0, document.text)]
+
+            pages, bounds, contents = [], [], []
+            for page, unit_text in units:
+                for content, start, end in self.chunker.split(self.chunker.clean_text(unit_text), config.max_tokens, config.overlap):
+                    if content:
+                        pages.append(page)
+                        bounds.append((start, end))
+                        contents.append(content)
+            tokens = [array('I', chunk_tokens) for chunk_tokens in self.chunker.tokenizer.encode_batch(contents)]
+
+            chunks = DocumentChunks(config.key, pages, bounds, tokens)
+            self._write(path, pickle.dumps(vars(chunks)))
+            return chunks
+
+    def _load_document(self, content_hash: str) -> Optional[DocumentArtifact]:
+        path = os.path.join(self.root, content_hash, DOCUMENT_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return DocumentArtifact(**json.load(file))
+        except Exception as e:
+            logger.error(f"Error loading document artifact {path}: {str(e)}")
+            return None
+
+    @contextmanager
+    def _key_lock(self, key: str):
+        """Hold the lock of one key, so a document is produced once; the lock is dropped when released by the last user"""
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        """Write a file atomically"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+# One store per output directory, shared by every consumer in the process
+_stores: Dict[str, ArtifactStore] = {}
+_stores_lock = threading.Lock()
+
+def get_artifact_store(output_dir: str) -> ArtifactStore:
+    """Get the process-wide artifact store for an output directory"""
+    root = os.path.join(os.path.abspath(output_dir), ARTIFACTS_DIR, f"v{ARTIFACT_VERSION}")
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ArtifactStore(root)
+        return _stores[root]
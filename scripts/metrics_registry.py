@@ -0,0 +1,254 @@
+"""
+Metrics Registry
+
+Process-wide counters, gauges and histograms, rendered in the Prometheus text
+exposition format by the backend's /metrics endpoint. Used by the scripts (OpenAI
+gateway, ThemeQA) and the backend alike, without a client library dependency.
+
+Recording is lock-free: every thread updates its own shard of a metric's values,
+and shards are only summed when metrics are collected. When a thread exits, its
+shard is folded into the metric's base values, so short-lived threads do not add
+up. Values that are cheaper to
+read than to track (index sizes, cache counters kept elsewhere) are exported by
+collector callbacks that run at collection time.
+"""
+
+import math
+import bisect
+import threading
+import weakref
+from typing import Dict, List, Tuple, Callable, Iterable, Optional, Sequence
+
+# Latency buckets in seconds, from 5 ms to 2 minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# A collected sample: (metric name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+class _Shards:
+    """Per-thread dicts of values, summed on collection; a finished thread's values are folded into a base dict"""
+
+    def __init__(self, merge: Callable[[dict, dict], None]):
+        self._merge = merge  # Adds one dict of values into another
+        self._local = threading.local()
+        self._all: Dict[int, dict] = {}  # Live threads' shards, by shard ID
+        self._base: dict = {}  # Values of threads that have finished
+        self._lock = threading.Lock()
+
+    def mine(self) -> dict:
+        """The calling thread's shard; only the first use on a thread takes the lock"""
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = self._local.values = {}
+            # The sentinel dies with the thread's locals, folding its shard into the base
+            self._local.sentinel = sentinel = _ThreadSentinel()
+            with self._lock:
+                self._all[id(shard)] = shard
+            weakref.finalize(sentinel, self._retire, id(shard))
+        return shard
+
+    def _retire(self, shard_id: int) -> None:
+        with self._lock:
+            shard = self._all.pop(shard_id, None)
+            if shard is not None:
+                self._merge(self._base, shard)
+
+    def snapshots(self) -> List[dict]:
+        """A copy of the base and of every live thread's shard, so totals never go down"""
+        with self._lock:
+            base = {key: list(value) if isinstance(value, list) else value for key, value in self._base.items()}
+            shards = list(self._all.values())
+        return [base] + [shard.copy() for shard in shards]
+
+class _ThreadSentinel:
+    """Kept in a thread's locals only to be garbage collected when the thread exits"""
+
+class _Metric:
+    """Base for metrics with a fixed set of label names"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _Shards(self._merge)
+
+    def _key(self, labels: Tuple) -> Tuple:
+        """The label values as given; pass the same type for a label every time (they are rendered with str)"""
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return labels
+
+    def _labels(self, key: Tuple) -> Dict[str, str]:
+        return {name: str(value) for name, value in zip(self.labelnames, key)}
+
+    @staticmethod
+    def _merge(into: dict, shard: dict) -> None:
+        """Add a shard's values into another dict of values"""
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """A monotonically increasing total"""
+
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        """Add amount to the counter for the given label values"""
+        shard = self._shards.mine()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    @staticmethod
+    def _merge(into: dict, shard: dict) -> None:
+        for key, value in shard.items():
+            into[key] = into.get(key, 0.0) + value
+
+    def collect(self) -> List[Sample]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._shards.snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0.0) + value
+        return [(f"{self.name}_total", self._labels(key), value) for key, value in sorted(totals.items(), key=lambda item: str(item[0]))]
+
+class Gauge(Counter):
+    """A value that goes up and down, such as requests in flight"""
+
+    type = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        """Subtract amount from the gauge for the given label values"""
+        self.inc(*labels, amount=-amount)
+
+    def collect(self) -> List[Sample]:
+        return [(self.name, labels, value) for _, labels, value in super().collect()]
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        """Record an observation for the given label values"""
+        shard = self._shards.mine()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket counts (the last one is +Inf), then sum and count
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @staticmethod
+    def _merge(into: dict, shard: dict) -> None:
+        for key, state in shard.items():
+            total = into.setdefault(key, [0] * len(state))
+            for i, value in enumerate(state):
+                total[i] += value
+
+    def collect(self) -> List[Sample]:
+        totals: Dict[Tuple, list] = {}
+        for shard in self._shards.snapshots():
+            for key, state in shard.items():
+                total = totals.setdefault(key, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    total[i] += value
+
+        samples = []
+        for key, state in sorted(totals.items(), key=lambda item: str(item[0])):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, state[-2]))
+            samples.append((f"{self.name}_count", labels, state[-1]))
+        return samples
+
+class MetricsRegistry:
+    """Named metrics and collector callbacks, rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Get or create a counter (name without the _total suffix)"""
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Get or create a gauge"""
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram"""
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(self, name: str, metric_type: str, documentation: str, collect: Callable[[], Iterable[Sample]]) -> None:
+        """Register a callback producing the samples of one metric family when metrics are collected"""
+        with self._lock:
+            self._collectors.append((name, metric_type, documentation, collect))
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            families = [(metric.name, metric.type, metric.documentation, metric.collect) for metric in self._metrics.values()]
+            families += list(self._collectors)
+
+        lines = []
+        for name, metric_type, documentation, collect in families:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                lines.append(f"# Error collecting {name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for name, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    return repr(float(value))
+
+# The process-wide registry
+registry = MetricsRegistry()
+
+# Lookups in any in-process cache, by cache name and result ("hit" or "miss")
+CACHE_REQUESTS = registry.counter("cache_requests", "Cache lookups by cache and result (hit or miss)", ("cache", "result"))
+
+def _cache_hit_ratios() -> List[Sample]:
+    """Share of each cache's lookups that were hits"""
+    counts: Dict[str, Dict[str, float]] = {}
+    for _, labels, value in CACHE_REQUESTS.collect():
+        counts.setdefault(labels["cache"], {})[labels["result"]] = value
+    return [("cache_hit_ratio", {"cache": cache}, results.get("hit", 0.0) / sum(results.values()))
+            for cache, results in sorted(counts.items()) if sum(results.values())]
+
+registry.add_collector("cache_hit_ratio", "gauge", "Share of cache lookups that were hits, since the process started", _cache_hit_ratios)
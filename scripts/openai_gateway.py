@@ -0,0 +1,316 @@
+"""
+OpenAI Gateway
+
+One shared entry point for OpenAI API calls, used by the scripts and the backend.
+It holds a single pooled keep-alive client per API key instead of one client per
+engine or request, admits requests through token buckets sized to the account's
+requests-per-minute and tokens-per-minute limits, and retries rate-limit (429),
+server (5xx) and connection errors with jittered exponential backoff that honours
+the Retry-After header. Queueing and throttling are counted for monitoring.
+
+OpenAI limits each model separately, so every operation and model gets its own pair
+of buckets: an index build's embeddings never queue behind chat completions. Limits
+are looked up by model, then by operation ("chat" or "embeddings").
+
+Callers use gateway.client / gateway.async_client, which have the same
+chat.completions.create and embeddings.create methods as the OpenAI clients.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Dict, Any, Optional, Tuple, Callable
+
+import httpx
+import openai
+
+from metrics_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Account limits as (requests per minute, tokens per minute), by operation or model, overridable per deployment
+DEFAULT_LIMITS: Dict[str, Tuple[int, int]] = {
+    "chat": (int(os.environ.get("OPENAI_RPM_LIMIT", "500")), int(os.environ.get("OPENAI_TPM_LIMIT", "30000"))),
+    "embeddings": (int(os.environ.get("OPENAI_EMBEDDINGS_RPM_LIMIT", "3000")), int(os.environ.get("OPENAI_EMBEDDINGS_TPM_LIMIT", "1000000")))
+}
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "32"))  # Pooled keep-alive connections per client
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+CHARS_PER_TOKEN = 4  # Prompt tokens are estimated from characters, without tokenizing
+DEFAULT_COMPLETION_TOKENS = 1000  # Completion estimate when a request sets no max_tokens
+
+# Errors worth retrying: rate limits, server errors and dropped connections
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+# Metrics, per attempt: outcome is "success", "retry" (failed, will be retried) or "error"
+OPENAI_REQUESTS = registry.counter("openai_requests", "OpenAI API requests by operation, model and outcome", ("operation", "model", "outcome"))
+OPENAI_LATENCY = registry.histogram("openai_request_duration_seconds", "OpenAI API request latency (time to the response headers for streams)", ("operation", "model"))
+OPENAI_TOKENS = registry.counter("openai_tokens", "OpenAI tokens used by model and type (prompt or completion)", ("model", "type"))
+OPENAI_QUEUED = registry.counter("openai_admission_wait_seconds", "Time OpenAI requests waited for rate limit admission", ("operation",))
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills continuously at rate per second.
+
+    reserve() debits the bucket immediately, letting the balance go negative, and
+    returns how long the caller must wait before its share has refilled. Waiters
+    therefore queue in arrival order, and the same bucket serves threads and
+    coroutines (which sleep with time.sleep or asyncio.sleep respectively).
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> Tuple[float, float]:
+        """Take amount from the bucket; returns the seconds to wait before using it and the amount taken"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # A request larger than the bucket could never be admitted, so it waits for a full bucket
+            taken = min(amount, self.capacity)
+            self._tokens -= taken
+            return (-self._tokens / self.rate if self._tokens < 0 else 0.0), taken
+
+    def adjust(self, amount: float) -> None:
+        """Return (positive) or take (negative) tokens once the actual usage is known"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+class OpenAIGateway:
+    """Rate-limited, retrying access to the OpenAI API through shared clients"""
+
+    def __init__(self, api_key: Optional[str] = None, limits: Optional[Dict[str, Tuple[int, int]]] = None,
+                 max_retries: int = MAX_RETRIES, openai_client=None, async_openai_client=None):
+        # The SDK's own retries are disabled so that every attempt goes through admission
+        self.openai_client = openai_client or openai.OpenAI(
+            api_key=api_key, max_retries=0,
+            http_client=httpx.Client(limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)))
+        # The async client is created on first use: sync-only callers (the scripts) never need one
+        self.api_key = api_key
+        self._async_openai_client = async_openai_client
+        self._async_client_lock = threading.Lock()
+        has_async_client = async_openai_client is not None or openai_client is None
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.max_retries = max_retries
+        self._buckets: Dict[Tuple[str, str], Tuple[TokenBucket, TokenBucket]] = {}  # (operation, model) -> (request, token) buckets
+        self._buckets_lock = threading.Lock()
+
+        # Client-shaped facades, so callers keep using chat.completions.create and embeddings.create
+        self.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=self.chat_completion)),
+            embeddings=SimpleNamespace(create=self.create_embedding))
+        self.async_client = None if not has_async_client else SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=self.achat_completion)),
+            embeddings=SimpleNamespace(create=self.acreate_embedding))
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled = 0  # Requests that had to wait for admission
+        self.queued_seconds = 0.0
+        self.max_queued_seconds = 0.0
+
+    @property
+    def async_openai_client(self):
+        """The async SDK client, created on first use"""
+        with self._async_client_lock:
+            if self._async_openai_client is None:
+                self._async_openai_client = openai.AsyncOpenAI(
+                    api_key=self.api_key, max_retries=0,
+                    http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)))
+            return self._async_openai_client
+
+    # Sync calls
+
+    def chat_completion(self, **kwargs):
+        """chat.completions.create through admission and retries"""
+        return self._call("chat", kwargs.get("model"), lambda: self.openai_client.chat.completions.create(**kwargs), self._estimate_chat(kwargs))
+
+    def create_embedding(self, **kwargs):
+        """embeddings.create through admission and retries"""
+        return self._call("embeddings", kwargs.get("model"), lambda: self.openai_client.embeddings.create(**kwargs), self._estimate_input(kwargs.get("input")))
+
+    def _call(self, operation: str, model: Optional[str], request: Callable[[], Any], estimated_tokens: int):
+        for attempt in range(self.max_retries + 1):
+            wait, reserved_tokens = self._admit(operation, model, estimated_tokens)
+            time.sleep(wait)
+            start_time = time.perf_counter()
+            try:
+                response = request()
+            except RETRYABLE_ERRORS as e:
+                self._refund(operation, model, reserved_tokens)
+                delay = self._retry_delay(e, attempt)
+                self._record(operation, model, start_time, "error" if delay is None else "retry")
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except Exception:
+                self._refund(operation, model, reserved_tokens)
+                self._record(operation, model, start_time, "error")
+                raise
+            self._record(operation, model, start_time, "success")
+            self._settle(response, operation, model, reserved_tokens)
+            return response
+
+    # Async calls
+
+    async def achat_completion(self, **kwargs):
+        """Async chat.completions.create through admission and retries"""
+        return await self._acall("chat", kwargs.get("model"), lambda: self.async_openai_client.chat.completions.create(**kwargs), self._estimate_chat(kwargs))
+
+    async def acreate_embedding(self, **kwargs):
+        """Async embeddings.create through admission and retries"""
+        return await self._acall("embeddings", kwargs.get("model"), lambda: self.async_openai_client.embeddings.create(**kwargs), self._estimate_input(kwargs.get("input")))
+
+    async def _acall(self, operation: str, model: Optional[str], request: Callable[[], Any], estimated_tokens: int):
+        for attempt in range(self.max_retries + 1):
+            wait, reserved_tokens = self._admit(operation, model, estimated_tokens)
+            await asyncio.sleep(wait)
+            start_time = time.perf_counter()
+            try:
+                response = await request()
+            except RETRYABLE_ERRORS as e:
+                self._refund(operation, model, reserved_tokens)
+                delay = self._retry_delay(e, attempt)
+                self._record(operation, model, start_time, "error" if delay is None else "retry")
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self._refund(operation, model, reserved_tokens)
+                self._record(operation, model, start_time, "error")
+                raise
+            self._record(operation, model, start_time, "success")
+            self._settle(response, operation, model, reserved_tokens)
+            return response
+
+    # Admission, retries and accounting
+
+    def buckets(self, operation: str, model: Optional[str]) -> Tuple[TokenBucket, TokenBucket]:
+        """The request and token buckets of an operation on a model, created with its limits on first use"""
+        key = (operation, model or "")
+        with self._buckets_lock:
+            if key not in self._buckets:
+                requests_per_minute, tokens_per_minute = self.limits.get(model) or self.limits.get(operation) or self.limits["chat"]
+                self._buckets[key] = (TokenBucket(requests_per_minute), TokenBucket(tokens_per_minute))
+            return self._buckets[key]
+
+    def _admit(self, operation: str, model: Optional[str], estimated_tokens: int) -> Tuple[float, float]:
+        """Reserve a request and its estimated tokens; returns how long to wait before sending and the tokens reserved"""
+        request_bucket, token_bucket = self.buckets(operation, model)
+        request_wait, _ = request_bucket.reserve(1)
+        token_wait, reserved_tokens = token_bucket.reserve(estimated_tokens)
+        wait = max(request_wait, token_wait)
+        if wait > 0:
+            OPENAI_QUEUED.inc(operation, amount=wait)
+        with self._stats_lock:
+            self.requests += 1
+            if wait > 0:
+                self.throttled += 1
+                self.queued_seconds += wait
+                self.max_queued_seconds = max(self.max_queued_seconds, wait)
+        return wait, reserved_tokens
+
+    def _refund(self, operation: str, model: Optional[str], reserved_tokens: float) -> None:
+        """Return a failed attempt's reserved tokens, so a retry reserves its tokens only once"""
+        self.buckets(operation, model)[1].adjust(reserved_tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying after error, or None if retries are exhausted"""
+        with self._stats_lock:
+            if attempt >= self.max_retries:
+                self.errors += 1
+                return None
+            self.retries += 1
+        # Full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, BACKOFF_MAX_SECONDS))
+        logger.warning(f"OpenAI request failed ({type(error).__name__}), retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+        return delay
+
+    @staticmethod
+    def _record(operation: str, model: Optional[str], start_time: float, outcome: str) -> None:
+        """Count an attempt and its latency"""
+        OPENAI_REQUESTS.inc(operation, model or "", outcome)
+        OPENAI_LATENCY.observe(time.perf_counter() - start_time, operation, model or "")
+
+    def _settle(self, response, operation: str, model: Optional[str], reserved_tokens: float) -> None:
+        """Correct the token bucket by the difference between reserved and actual usage, and count the tokens"""
+        usage = getattr(response, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        if isinstance(total_tokens, int):
+            self.buckets(operation, model)[1].adjust(reserved_tokens - total_tokens)
+            prompt_tokens = getattr(usage, "prompt_tokens", None)
+            prompt_tokens = prompt_tokens if isinstance(prompt_tokens, int) else total_tokens
+            OPENAI_TOKENS.inc(model or "", "prompt", amount=prompt_tokens)
+            OPENAI_TOKENS.inc(model or "", "completion", amount=total_tokens - prompt_tokens)
+
+    @staticmethod
+    def _estimate_chat(kwargs: Dict[str, Any]) -> int:
+        """Estimated prompt plus completion tokens of a chat request"""
+        prompt_chars = sum(len(message.get("content") or "") for message in kwargs.get("messages", []) if isinstance(message.get("content"), str))
+        return prompt_chars // CHARS_PER_TOKEN + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+    @staticmethod
+    def _estimate_input(text_input) -> int:
+        """Estimated tokens of an embeddings input (a string or a list of strings)"""
+        texts = [text_input] if isinstance(text_input, str) else (text_input or [])
+        return sum(len(text) for text in texts if isinstance(text, str)) // CHARS_PER_TOKEN + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Request, retry and throttling counters, and the limits of each operation and model used so far"""
+        with self._buckets_lock:
+            buckets = sorted(self._buckets.items())
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "queued_seconds": self.queued_seconds,
+                "max_queued_seconds": self.max_queued_seconds,
+                "limits": {
+                    f"{operation}/{model}": {"requests_per_minute": int(request_bucket.capacity), "tokens_per_minute": int(token_bucket.capacity)}
+                    for (operation, model), (request_bucket, token_bucket) in buckets
+                }
+            }
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """The delay requested by a response's retry-after-ms or retry-after header, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+# One gateway per API key, shared by every engine, extractor and request in the process
+_gateways: Dict[Optional[str], OpenAIGateway] = {}
+_gateways_lock = threading.Lock()
+
+def get_openai_gateway(api_key: Optional[str] = None) -> OpenAIGateway:
+    """Get the process-wide gateway for an API key"""
+    with _gateways_lock:
+        if api_key not in _gateways:
+            _gateways[api_key] = OpenAIGateway(api_key)
+        return _gateways[api_key]
@@ -12,19 +12,32 @@ import os
 import json
 import argparse
 import logging
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Iterator, AsyncIterator, Optional, Callable
+from collections.abc import Mapping
+from array import array
 import re
 import numpy as np
 from datetime import datetime
 import pickle  # For serializing/deserializing the vector database
-import hashlib  # For generating file hashes
+import shutil
+import time
+import glob
+import threading
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Executor, as_completed
 
 # Third-party imports (will need to be installed)
 import openai
-import PyPDF2
-import tiktoken
 import faiss  # For vector search
 
+from filings_db import get_filings_db
+from openai_gateway import get_openai_gateway
+from ingestion import TextChunker, ChunkerConfig, DocumentArtifact, get_artifact_store, PAGE_BREAK
+from embedding_store import get_embedding_store
+from metrics_registry import registry, CACHE_REQUESTS
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,150 +48,88 @@ logger = logging.getLogger(__name__)
 # Constants
 DEFAULT_INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "filingsdata", "trackedcompanies", "Netflix")
 DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "filingsdata", "output")
-THEMES_JSON_FILE = "themes.json"
 OPENAI_MODEL = "gpt-4o"
 EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 3072  # Dimensions of EMBEDDING_MODEL's vectors
 MAX_TOKENS = 8192  # Maximum tokens for GPT-4o context
 CHUNK_OVERLAP = 200  # Token overlap between chunks
 TOP_K_RESULTS = 5  # Number of top document chunks to retrieve
 MAX_PROMPT_TOKENS = 20000  # Limit total prompt tokens to stay under the 30k TPM limit
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in the source documents to answer your question."
+
+# Retrieval constants
+RETRIEVAL_MODE_CHUNK = "chunk"  # Index the full-size chunks used for extraction
+RETRIEVAL_MODE_PASSAGE = "passage"  # Index small passages and expand around the hits
+RETRIEVAL_MODES = (RETRIEVAL_MODE_CHUNK, RETRIEVAL_MODE_PASSAGE)
+PASSAGE_TOKENS = 300  # Maximum tokens per passage in passage mode
+PASSAGE_TOP_K = 10  # Number of passages to retrieve in passage mode
+PASSAGE_EXPANSION_WINDOW = 2  # Neighbouring passages to consider on each side of a hit
+PASSAGE_CONTEXT_TOKENS = 4000  # Token budget for passage excerpts in the prompt
+EMBEDDING_BATCH_SIZE = 2048  # Maximum inputs per embeddings request
+EMBEDDING_BATCH_TOKENS = 250000  # Maximum tokens per embeddings request, below the endpoint's ~300k limit
+BATCH_CONCURRENCY = 8  # Maximum concurrent completions when answering a batch of questions
+MMR_LAMBDA = 0.7  # Default relevance/diversity weight for MMR (1.0 = relevance only, near-copies kept)
+MMR_FETCH_FACTOR = 4  # MMR re-selects from this many times the usual number of hits
+MMR_DUPLICATE_SIMILARITY = 0.95  # Cosine similarity above which a candidate counts as a near-copy
+FILTER_KEYS = ("sources", "types", "periods", "companies")  # Metadata a search can be restricted to
+ALL_COMPANIES = "*"  # "companies" filter value that searches every company partition
+CHUNK_CONFIG = ChunkerConfig(MAX_TOKENS, CHUNK_OVERLAP)  # Chunk mode units: the same chunks the extractor reads
+PASSAGE_CONFIG = ChunkerConfig(PASSAGE_TOKENS, 0, per_page=True)  # Passage mode units, grouped into parent chunks
+
+def parse_fiscal_period(text: str) -> str:
+    """
+    Parse a fiscal period such as "Q3-24", "3Q24", "q4 2023" or "FY24" out of a
+    filename or filter value.
+    
+    Returns a normalized period ("2024Q3", "FY2024"), or "" if none is found.
+    """
+    quarter = (re.search(r'(?<![a-z0-9])q([1-4])[-_ ]?(?:fy)?[-_ ]?(\d{4}|\d{2})(?![0-9])', text, re.IGNORECASE)
+               or re.search(r'(?<![a-z0-9])([1-4])q[-_ ]?(\d{4}|\d{2})(?![0-9])', text, re.IGNORECASE))
+    if quarter:
+        year = quarter.group(2)
+        return f"{'20' + year if len(year) == 2 else year}Q{quarter.group(1)}"
+    
+    fiscal_year = re.search(r'(?<![a-z0-9])fy[-_ ]?(\d{4}|\d{2})(?![0-9])', text, re.IGNORECASE)
+    if fiscal_year:
+        year = fiscal_year.group(1)
+        return f"FY{'20' + year if len(year) == 2 else year}"
+    return ""
 
 # Cache constants
 CACHE_DIR = "cache"  # Directory to store cache files
-TEXT_CACHE_FILE = "document_text_cache.json"  # Cache for extracted text
 VECTOR_DB_CACHE_FILE = "vector_db_cache.pkl"  # Cache for vector database
 FILE_HASH_CACHE_FILE = "file_hashes.json"  # Cache for file hashes
+VECTOR_INDEX_DIR = "vector_index"  # Directory for the shared, company-partitioned vector index
+PARTITION_FILE = "partition.pkl"  # Vector index partition inside a version directory
+CURRENT_VERSION_FILE = "CURRENT"  # Names the live version directory of a partition
+PARTITION_VERSIONS_KEPT = 2  # Version directories kept per partition, including the live one
+LEGACY_SEGMENT_SUFFIX = ".pkl"  # Unversioned <company>.pkl partition files, migrated on first load
 
-class DocumentProcessor:
-    """Handles the processing of different document types."""
-    
-    @staticmethod
-    def extract_text_from_pdf(file_path: str) -> str:
-        """Extract text from a PDF file."""
-        logger.info(f"Extracting text from PDF: {file_path}")
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from PDF {file_path}: {str(e)}")
-            return ""
-    
-    @staticmethod
-    def parse_json_file(file_path: str) -> Dict:
-        """Parse a JSON file."""
-        logger.info(f"Parsing JSON file: {file_path}")
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        except Exception as e:
-            logger.error(f"Error parsing JSON file {file_path}: {str(e)}")
-            return {}
-    
-    @staticmethod
-    def extract_text_from_sec_json(json_data: Dict) -> str:
-        """Extract relevant text from SEC JSON data."""
-        # This is a placeholder. The actual implementation would depend on the
-        # structure of the SEC JSON files, which we couldn't examine directly.
-        text = ""
-        try:
-            # Example extraction logic - adjust based on actual JSON structure
-            if "filings" in json_data:
-                for filing in json_data.get("filings", {}).get("recent", []):
-                    text += f"Filing Type: {filing.get('form', '')}\n"
-                    text += f"Filing Date: {filing.get('filingDate', '')}\n"
-                    text += f"Description: {filing.get('description', '')}\n\n"
-            
-            # Add more extraction logic based on the actual structure
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from SEC JSON: {str(e)}")
-            return ""
+# Metrics
+INDEX_LOAD_SECONDS = registry.histogram("qa_index_load_duration_seconds", "Time to load a company's vector index partition from disk", ("company",))
+MMR_TOKENS_SAVED = registry.counter("qa_mmr_tokens_saved", "Prompt tokens of near-duplicate chunks that MMR kept out of prompts", ("company",))
+
+class IndexBuildCancelled(Exception):
+    """Raised when an index build is cancelled before it finishes."""
 
-class TextProcessor:
-    """Handles text processing, chunking, and embedding generation."""
+class TextProcessor(TextChunker):
+    """Handles token counting and embedding generation; cleaning and chunking are shared with the extractor."""
     
     def __init__(self, openai_client):
+        super().__init__()
         self.openai_client = openai_client
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")  # For token counting
-    
-    def clean_text(self, text: str) -> str:
-        """Clean and normalize text."""
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        # Remove special characters that don't add meaning
-        text = re.sub(r'[^\w\s.,;:!?()[\]{}"\'-]', '', text)
-        return text.strip()
     
     def count_tokens(self, text: str) -> int:
         """Count the number of tokens in a text."""
-        return len(self.tokenizer.encode(text))
+        return self.tokenizer.count(text)
+    
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count the number of tokens in each of many texts."""
+        return self.tokenizer.count_batch(texts)
     
     def chunk_text(self, text: str, max_tokens: int = MAX_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[str]:
         """Split text into chunks of specified token size with overlap."""
-        chunks = []
-        
-        # Clean the text first
-        text = self.clean_text(text)
-        
-        # If text is short enough, return it as a single chunk
-        if self.count_tokens(text) <= max_tokens:
-            return [text]
-        
-        # Split text into sentences to avoid breaking in the middle of a sentence
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        current_chunk = ""
-        
-        for sentence in sentences:
-            # Check if adding this sentence would exceed the max tokens
-            potential_chunk = current_chunk + " " + sentence if current_chunk else sentence
-            if self.count_tokens(potential_chunk) <= max_tokens:
-                current_chunk = potential_chunk
-            else:
-                # Save the current chunk and start a new one
-                if current_chunk:
-                    chunks.append(current_chunk)
-                
-                # If the sentence itself is too long, we need to split it
-                if self.count_tokens(sentence) > max_tokens:
-                    # Split by words
-                    words = sentence.split()
-                    current_chunk = ""
-                    for word in words:
-                        potential_chunk = current_chunk + " " + word if current_chunk else word
-                        if self.count_tokens(potential_chunk) <= max_tokens:
-                            current_chunk = potential_chunk
-                        else:
-                            chunks.append(current_chunk)
-                            current_chunk = word
-                else:
-                    current_chunk = sentence
-        
-        # Add the last chunk if it's not empty
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        # Create overlapping chunks
-        overlapping_chunks = []
-        for i in range(len(chunks)):
-            if i > 0:
-                # Get the end of the previous chunk for overlap
-                prev_chunk = chunks[i-1]
-                prev_tokens = self.tokenizer.encode(prev_chunk)
-                overlap_tokens = prev_tokens[-overlap:] if len(prev_tokens) > overlap else prev_tokens
-                overlap_text = self.tokenizer.decode(overlap_tokens)
-                
-                # Add the overlap to the beginning of the current chunk
-                current_chunk = chunks[i]
-                overlapping_chunks.append(overlap_text + " " + current_chunk)
-            else:
-                overlapping_chunks.append(chunks[i])
-        
-        return overlapping_chunks
+        return super().chunk_text(text, max_tokens, overlap)
     
     def generate_embedding(self, text: str) -> List[float]:
         """Generate an embedding for the given text using OpenAI's API."""
@@ -191,6 +142,293 @@ class TextProcessor:
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
             return []
+    
+    def generate_embeddings(self, texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[float]]:
+        """
+        Generate embeddings for several texts.
+        
+        Texts are sent in batches of at most EMBEDDING_BATCH_SIZE inputs and
+        EMBEDDING_BATCH_TOKENS tokens; token counts are computed when not given.
+        A text that cannot be embedded gets an empty embedding.
+        """
+        if token_counts is None:
+            token_counts = self.count_tokens_batch(texts)
+        
+        embeddings = []
+        start = 0
+        while start < len(texts):
+            end, batch_tokens = start, 0
+            while (end < len(texts) and end - start < EMBEDDING_BATCH_SIZE
+                   and (end == start or batch_tokens + token_counts[end] <= EMBEDDING_BATCH_TOKENS)):
+                batch_tokens += token_counts[end]
+                end += 1
+            embeddings.extend(self._embed_batch(texts[start:end]))
+            start = end
+        return embeddings
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one batch in a single request; a rejected batch is retried in halves down to single texts."""
+        try:
+            response = self.openai_client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=batch
+            )
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Error generating embedding: {str(e)}")
+                return [[]]
+            logger.warning(f"Embeddings request for {len(batch)} texts failed, retrying in halves: {str(e)}")
+            middle = len(batch) // 2
+            return self._embed_batch(batch[:middle]) + self._embed_batch(batch[middle:])
+
+class ChunkStore:
+    """
+    Columnar storage for chunk metadata.
+    
+    Instead of one dict per chunk, metadata is kept in parallel arrays: source
+    filenames, types, periods and companies are interned into small lookup tables
+    and referenced by ID, counters live in int arrays, and chunk text is stored out
+    of line in a single UTF-8 buffer addressed by offsets. Row numbers match FAISS
+    index positions.
+    """
+    
+    # Interned columns: (table, ID column, lookup) attribute names
+    _INTERNED = (
+        ("sources", "source_ids", "_source_lookup"),
+        ("types", "type_ids", "_type_lookup"),
+        ("periods", "period_ids", "_period_lookup"),
+        ("companies", "company_ids", "_company_lookup")
+    )
+    _COUNTERS = ("chunk_ids", "total_chunks", "parent_ids", "pages", "token_counts")
+    
+    def __init__(self):
+        self.sources: List[str] = []  # Interned source filenames, indexed by source ID
+        self.types: List[str] = []  # Interned document types, indexed by type ID
+        self.periods: List[str] = []  # Interned fiscal periods, indexed by period ID ("" when unknown)
+        self.companies: List[str] = []  # Interned company partition keys, indexed by company ID
+        self.source_ids = array('i')
+        self.type_ids = array('i')
+        self.period_ids = array('i')
+        self.company_ids = array('i')
+        self.chunk_ids = array('i')
+        self.total_chunks = array('i')
+        self.parent_ids = array('i')  # Parent chunk within the source document
+        self.pages = array('i')  # 1-based page number, 0 when unknown
+        self.token_counts = array('i')  # Token count of the content, 0 when unknown
+        self.content_offsets = array('q', [0])  # Row i's text is content[offsets[i]:offsets[i+1]]
+        self.content = bytearray()
+        self._source_lookup: Dict[str, int] = {}
+        self._type_lookup: Dict[str, int] = {}
+        self._period_lookup: Dict[str, int] = {}
+        self._company_lookup: Dict[str, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+    
+    @staticmethod
+    def _intern(value: str, table: List[str], lookup: Dict[str, int]) -> int:
+        """Return the ID of a value in an intern table, adding it if needed."""
+        value_id = lookup.get(value)
+        if value_id is None:
+            value_id = len(table)
+            table.append(value)
+            lookup[value] = value_id
+        return value_id
+    
+    def append(self, document: Dict[str, Any]) -> int:
+        """Append a chunk's metadata and return its row number."""
+        row = len(self)
+        self.source_ids.append(self._intern(document.get("source", ""), self.sources, self._source_lookup))
+        self.type_ids.append(self._intern(document.get("type", ""), self.types, self._type_lookup))
+        period = document.get("period") or parse_fiscal_period(document.get("source", ""))
+        self.period_ids.append(self._intern(period, self.periods, self._period_lookup))
+        self.company_ids.append(self._intern(document.get("company", ""), self.companies, self._company_lookup))
+        self.chunk_ids.append(document.get("chunk_id", 0))
+        self.total_chunks.append(document.get("total_chunks", 1))
+        self.parent_ids.append(document.get("parent_id", document.get("chunk_id", 0)))
+        self.pages.append(document.get("page", 0))
+        self.token_counts.append(document.get("tokens", 0))
+        self.content.extend(document.get("content", "").encode('utf-8'))
+        self.content_offsets.append(len(self.content))
+        return row
+    
+    def content_at(self, row: int) -> str:
+        """Decode the text of the chunk at the given row."""
+        return self.content[self.content_offsets[row]:self.content_offsets[row + 1]].decode('utf-8')
+    
+    def view(self, row: int, score: float = None) -> "ChunkView":
+        """Return a lightweight read-only view of a row."""
+        return ChunkView(self, row, score)
+    
+    def company_mask(self, company: str) -> np.ndarray:
+        """Boolean mask of the rows in a company's partition."""
+        company_id = self._company_lookup.get(company)
+        if company_id is None:
+            return np.zeros(len(self), dtype=bool)
+        return np.frombuffer(self.company_ids, dtype=np.int32) == company_id
+    
+    def source_mask(self, source: str) -> np.ndarray:
+        """Boolean mask of the rows of a source document."""
+        source_id = self._source_lookup.get(source)
+        if source_id is None:
+            return np.zeros(len(self), dtype=bool)
+        return np.frombuffer(self.source_ids, dtype=np.int32) == source_id
+    
+    def select(self, keep: np.ndarray) -> "ChunkStore":
+        """Return a new store holding only the rows where keep is True, in order."""
+        selected = ChunkStore()
+        for table, ids, lookup in self._INTERNED:
+            setattr(selected, table, list(getattr(self, table)))
+            setattr(selected, lookup, dict(getattr(self, lookup)))
+            setattr(selected, ids, array('i', np.frombuffer(getattr(self, ids), dtype=np.int32)[keep].tobytes()))
+        for column in self._COUNTERS:
+            setattr(selected, column, array('i', np.frombuffer(getattr(self, column), dtype=np.int32)[keep].tobytes()))
+        
+        offsets = np.frombuffer(self.content_offsets, dtype=np.int64)
+        content = memoryview(self.content)
+        for row in np.flatnonzero(keep):
+            selected.content.extend(content[offsets[row]:offsets[row + 1]])
+            selected.content_offsets.append(len(selected.content))
+        return selected
+    
+    def extend(self, other: "ChunkStore", company: str = None) -> None:
+        """Append all rows of another store, optionally assigning them to a company partition."""
+        for table, ids, lookup in self._INTERNED:
+            if table == "companies" and company is not None:
+                getattr(self, ids).extend(array('i', [self._intern(company, self.companies, self._company_lookup)]) * len(other))
+                continue
+            # Re-intern the other store's values into this store's tables
+            mapping = np.array([self._intern(value, getattr(self, table), getattr(self, lookup)) for value in getattr(other, table)] or [0],
+                               dtype=np.int32)
+            getattr(self, ids).extend(array('i', mapping[np.frombuffer(getattr(other, ids), dtype=np.int32)].tobytes()))
+        for column in self._COUNTERS:
+            getattr(self, column).extend(getattr(other, column))
+        
+        base = len(self.content)
+        self.content.extend(other.content)
+        self.content_offsets.extend(array('q', (np.frombuffer(other.content_offsets, dtype=np.int64)[1:] + base).tobytes()))
+    
+    def label_company(self, company: str) -> None:
+        """Assign every row to a company partition."""
+        if self.companies == [company]:
+            return
+        self.companies = [company]
+        self._company_lookup = {company: 0}
+        self.company_ids = array('i', bytes(4 * len(self)))
+    
+    def filter_mask(self, filters: Dict[str, List[str]]) -> np.ndarray:
+        """
+        Build a boolean row mask for metadata filters.
+        
+        Filters map "sources" (filenames), "types" ("pdf", "json"), "periods"
+        ("Q3-24", "2024Q3", ...) and "companies" to lists of accepted values; values
+        within a key are OR-ed and keys are AND-ed. Matching is done on the interned
+        IDs, so each key costs one vectorized pass over an int column. A "companies"
+        list containing ALL_COMPANIES does not restrict the search.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        columns = {
+            "sources": (self.sources, self.source_ids, lambda value: value.lower()),
+            "types": (self.types, self.type_ids, lambda value: value.lower()),
+            "periods": (self.periods, self.period_ids, lambda value: parse_fiscal_period(value) or value.upper()),
+            "companies": (self.companies, self.company_ids, lambda value: value.lower())
+        }
+        for key, values in filters.items():
+            if key not in columns:
+                raise ValueError(f"Unknown filter '{key}', expected one of {FILTER_KEYS}")
+            if not values or (key == "companies" and ALL_COMPANIES in values):
+                continue
+            table, ids, normalize = columns[key]
+            wanted = {normalize(value) for value in values}
+            wanted_ids = [i for i, value in enumerate(table) if value and normalize(value) in wanted]
+            mask &= np.isin(np.frombuffer(ids, dtype=np.int32), wanted_ids)
+        return mask
+    
+    def __getstate__(self):
+        """Custom state for pickling; the lookup dicts are rebuilt on load."""
+        state = self.__dict__.copy()
+        del state['_source_lookup']
+        del state['_type_lookup']
+        del state['_period_lookup']
+        del state['_company_lookup']
+        return state
+    
+    def __setstate__(self, state):
+        """Custom state loading for unpickling."""
+        # Stores pickled before passages were indexed have no parent, page or token columns
+        if 'parent_ids' not in state:
+            state['parent_ids'] = array('i', state['chunk_ids'])
+            state['pages'] = array('i', bytes(4 * len(state['chunk_ids'])))
+            state['token_counts'] = array('i', bytes(4 * len(state['chunk_ids'])))
+        # Stores pickled before period filtering derive periods from their source filenames
+        if 'period_ids' not in state:
+            state['periods'] = []
+            lookup = {}
+            source_periods = [self._intern(parse_fiscal_period(source), state['periods'], lookup) for source in state['sources']]
+            state['period_ids'] = array('i', (source_periods[source_id] for source_id in state['source_ids']))
+        # Stores pickled before the shared index have no company partition column
+        if 'company_ids' not in state:
+            state['companies'] = [""]
+            state['company_ids'] = array('i', bytes(4 * len(state['chunk_ids'])))
+        self.__dict__.update(state)
+        self._source_lookup = {value: i for i, value in enumerate(self.sources)}
+        self._type_lookup = {value: i for i, value in enumerate(self.types)}
+        self._period_lookup = {value: i for i, value in enumerate(self.periods)}
+        self._company_lookup = {value: i for i, value in enumerate(self.companies)}
+
+class ChunkView(Mapping):
+    """
+    Read-only, dict-like view of one row of a ChunkStore.
+    
+    Supports the keys of the old per-chunk dicts ("content", "source", "chunk_id",
+    "total_chunks", "type"), the fiscal "period", the "company" partition, the passage
+    hierarchy ("parent_id", "page", "tokens") and "score" for search hits. Content is
+    decoded on access.
+    """
+    
+    __slots__ = ("_store", "row", "score")
+    _KEYS = ("content", "source", "chunk_id", "total_chunks", "type", "period", "company", "parent_id", "page", "tokens", "score")
+    
+    def __init__(self, store: ChunkStore, row: int, score: float = None):
+        self._store = store
+        self.row = row
+        self.score = score
+    
+    def __getitem__(self, key: str) -> Any:
+        store, row = self._store, self.row
+        if key == "content":
+            return store.content_at(row)
+        if key == "source":
+            return store.sources[store.source_ids[row]]
+        if key == "chunk_id":
+            return store.chunk_ids[row]
+        if key == "total_chunks":
+            return store.total_chunks[row]
+        if key == "type":
+            return store.types[store.type_ids[row]]
+        if key == "period":
+            return store.periods[store.period_ids[row]]
+        if key == "company":
+            return store.companies[store.company_ids[row]]
+        if key == "parent_id":
+            return store.parent_ids[row]
+        if key == "page":
+            return store.pages[row]
+        if key == "tokens":
+            return store.token_counts[row]
+        if key == "score" and self.score is not None:
+            return self.score
+        raise KeyError(key)
+    
+    def __iter__(self):
+        return (key for key in self._KEYS if key != "score" or self.score is not None)
+    
+    def __len__(self) -> int:
+        return len(self._KEYS) if self.score is not None else len(self._KEYS) - 1
+    
+    def __repr__(self) -> str:
+        return f"ChunkView(row={self.row}, source={self['source']!r}, chunk_id={self['chunk_id']}, score={self.score})"
 
 class VectorDatabase:
     """Manages the vector database for document chunks."""
@@ -198,7 +436,7 @@ class VectorDatabase:
     def __init__(self, dimension: int = 3072):  # text-embedding-3-large has 3072 dimensions
         self.dimension = dimension
         self.index = faiss.IndexFlatL2(dimension)  # L2 distance (Euclidean)
-        self.documents = []  # List to store document chunks and metadata
+        self.chunks = ChunkStore()  # Chunk metadata, row-aligned with the index
         self.last_updated = datetime.now().isoformat()  # Track when the database was last updated
     
     def add_document(self, document: Dict[str, Any], embedding: List[float]) -> None:
@@ -213,33 +451,77 @@ class VectorDatabase:
         # Add to FAISS index
         self.index.add(embedding_np)
         
-        # Store document with metadata
-        self.documents.append(document)
+        # Store document metadata
+        self.chunks.append(document)
         
         # Update last_updated timestamp
         self.last_updated = datetime.now().isoformat()
     
-    def search(self, query_embedding: List[float], top_k: int = TOP_K_RESULTS) -> List[Dict[str, Any]]:
-        """Search for the most similar documents to the query embedding."""
-        if not query_embedding or self.index.ntotal == 0:
-            return []
+    def search(self, query_embedding: List[float], top_k: int = TOP_K_RESULTS, filters: Dict[str, List[str]] = None) -> List[ChunkView]:
+        """
+        Search for the most similar documents to the query embedding.
+        
+        Optional metadata filters (see ChunkStore.filter_mask) are applied inside the
+        FAISS search through an ID selector, so only matching vectors are scanned.
+        """
+        return self.search_batch([query_embedding], top_k, filters)[0]
+    
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = TOP_K_RESULTS, filters: Dict[str, List[str]] = None) -> List[List[ChunkView]]:
+        """
+        Search for several query embeddings with a single FAISS call.
         
-        # Convert query embedding to numpy array
-        query_np = np.array([query_embedding], dtype=np.float32)
+        Returns one result list per query, in order; empty embeddings get no results.
+        """
+        results = [[] for _ in query_embeddings]
+        valid = [i for i, embedding in enumerate(query_embeddings) if embedding]
+        if not valid or self.index.ntotal == 0:
+            return results
         
-        # Search the index
-        distances, indices = self.index.search(query_np, min(top_k, self.index.ntotal))
+        # Convert query embeddings to a numpy matrix
+        query_np = np.array([query_embeddings[i] for i in valid], dtype=np.float32)
         
-        # Return the top results
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx != -1:  # FAISS returns -1 for not found
-                doc = self.documents[idx].copy()
-                doc["score"] = float(distances[0][i])
-                results.append(doc)
+        mask = self.chunks.filter_mask(filters) if filters and any(filters.values()) else None
+        if mask is not None and mask.all():
+            mask = None  # Every vector matches, so a plain search is equivalent and cheaper
+        
+        if mask is not None:
+            matching = int(mask.sum())
+            if matching == 0:
+                return results
+            
+            # FAISS reads the bitmap through a raw pointer, so it must stay referenced during the search
+            bitmap = np.packbits(mask, bitorder='little')
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap)))
+            distances, indices = self.index.search(query_np, min(top_k, matching), params=params)
+        else:
+            # Search the index
+            distances, indices = self.index.search(query_np, min(top_k, self.index.ntotal))
+        
+        # Return the top results for each query
+        for row, query_index in enumerate(valid):
+            for i, idx in enumerate(indices[row]):
+                if idx != -1:  # FAISS returns -1 for not found
+                    results[query_index].append(self.chunks.view(int(idx), float(distances[row][i])))
         
         return results
     
+    def select(self, keep: np.ndarray) -> "VectorDatabase":
+        """Return a new database holding only the rows where keep is True, copying their stored vectors."""
+        selected = VectorDatabase(self.dimension)
+        if self.index.ntotal:
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)[keep]
+            if len(vectors):
+                selected.index.add(vectors)
+        selected.chunks = self.chunks.select(keep)
+        return selected
+    
+    def append(self, other: "VectorDatabase", company: str = None) -> None:
+        """Append all rows of another database, optionally assigning them to a company partition."""
+        if other.index.ntotal:
+            self.index.add(other.index.reconstruct_n(0, other.index.ntotal))
+            self.chunks.extend(other.chunks, company)
+            self.last_updated = datetime.now().isoformat()
+    
     def __getstate__(self):
         """Custom state for pickling."""
         # Convert FAISS index to bytes for serialization
@@ -254,79 +536,495 @@ class VectorDatabase:
         """Custom state loading for unpickling."""
         # Restore the index from bytes
         index_bytes = state.pop('index')
+        
+        # Convert caches written before chunk metadata moved into a ChunkStore
+        documents = state.pop('documents', None)
+        if documents is not None:
+            state['chunks'] = ChunkStore()
+            for document in documents:
+                state['chunks'].append(document)
+        
         self.__dict__.update(state)
         self.index = faiss.deserialize_index(index_bytes)
 
+class IndexSnapshot:
+    """
+    An immutable snapshot of the shared vector index: one VectorDatabase per loaded company partition.
+    
+    Each partition keeps its own FAISS index and chunk store, so loading, replacing or
+    dropping a company makes a new snapshot that shares every other partition as it
+    is; the cost is that of the one partition, not of the whole corpus. Searches run
+    on each partition in scope and merge the hits by distance. Partitions must not be
+    modified once they are in a snapshot.
+    """
+    
+    def __init__(self, dimension: int = 3072, partitions: Dict[str, VectorDatabase] = None):
+        self.dimension = dimension
+        self.partitions: Dict[str, VectorDatabase] = dict(partitions or {})
+    
+    @property
+    def ntotal(self) -> int:
+        """Number of vectors in all partitions."""
+        return sum(partition.index.ntotal for partition in self.partitions.values())
+    
+    def partition(self, company: str) -> Optional[VectorDatabase]:
+        """A company's partition, or None if it is not loaded."""
+        return self.partitions.get(company.lower())
+    
+    def with_partition(self, company: str, partition: VectorDatabase = None) -> "IndexSnapshot":
+        """
+        Return a snapshot with a company's partition replaced, or dropped if partition is None.
+        
+        The partition's rows are labelled with the company key (partitions stored before
+        the shared index have none). The original snapshot is left untouched.
+        """
+        partitions = dict(self.partitions)
+        if partition is None:
+            partitions.pop(company, None)
+        else:
+            partition.chunks.label_company(company)
+            partitions[company] = partition
+        return IndexSnapshot(self.dimension, partitions)
+    
+    def search(self, query_embedding: List[float], top_k: int = TOP_K_RESULTS, filters: Dict[str, List[str]] = None) -> List[ChunkView]:
+        """Search the partitions in scope for the documents most similar to the query embedding."""
+        return self.search_batch([query_embedding], top_k, filters)[0]
+    
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = TOP_K_RESULTS, filters: Dict[str, List[str]] = None) -> List[List[ChunkView]]:
+        """
+        Search for several query embeddings, one FAISS call per partition in scope.
+        
+        The "companies" filter selects the partitions searched (all of them when absent
+        or ALL_COMPANIES); the other filters apply within each partition. Returns one
+        result list per query, best first; empty embeddings get no results.
+        """
+        filters = dict(filters or {})
+        companies = [company.lower() for company in filters.pop("companies", None) or []]
+        if not companies or ALL_COMPANIES in companies:
+            scope = list(self.partitions)
+        else:
+            scope = [company for company in dict.fromkeys(companies) if company in self.partitions]
+        
+        results = [[] for _ in query_embeddings]
+        for company in scope:
+            for merged, hits in zip(results, self.partitions[company].search_batch(query_embeddings, top_k, filters)):
+                merged.extend(hits)
+        if len(scope) > 1:
+            for merged in results:
+                merged.sort(key=lambda hit: hit.score)
+                del merged[top_k:]
+        return results
+    
+    def hit_vectors(self, hits: List[ChunkView]) -> np.ndarray:
+        """The stored vectors of search hits, read from the partitions they came from."""
+        vectors = np.empty((len(hits), self.dimension), dtype=np.float32)
+        positions: Dict[str, List[int]] = {}
+        for i, hit in enumerate(hits):
+            positions.setdefault(hit["company"], []).append(i)
+        for company, indices in positions.items():
+            rows = np.array([hits[i].row for i in indices], dtype=np.int64)
+            vectors[indices] = self.partitions[company].index.reconstruct_batch(rows)
+        return vectors
+    
+    def mmr_select(self, query_embedding: List[float], hits: List[ChunkView], top_k: int, token_budget: int,
+                   mmr_lambda: float = MMR_LAMBDA, token_counter=None) -> Tuple[List[ChunkView], int]:
+        """
+        Re-select a diverse subset of search hits with maximal marginal relevance.
+        
+        Candidate vectors are read back from their partitions and the selection runs as
+        vectorized NumPy over their cosine similarities: each step picks the candidate
+        maximizing mmr_lambda * relevance - (1 - mmr_lambda) * (similarity to the
+        closest already selected hit). Candidates that would overflow token_budget are
+        skipped, and so are near-copies of a selected hit unless mmr_lambda is 1.0,
+        which ranks by relevance alone.
+        
+        Returns at most top_k hits in selection order, together with the number of
+        tokens the plain top-k (taken in the given order under the same budget) would
+        have spent on near-copies of a higher-ranked hit that were left out (0 when
+        mmr_lambda is 1.0).
+        """
+        if not hits or len(query_embedding) == 0:
+            return [], 0
+        
+        vectors = self.hit_vectors(hits)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)  # Not in place: the caller may have passed its own array
+        
+        relevance = vectors @ query
+        similarity = vectors @ vectors.T
+        tokens = np.array([hit["tokens"] or (token_counter(hit["content"]) if token_counter else 0) for hit in hits])
+        drop_near_copies = mmr_lambda < 1.0
+        
+        # Redundant tokens in the plain top-k: hits that nearly copy an earlier hit
+        baseline = []
+        used = 0
+        for i in range(min(top_k, len(hits))):
+            if used + tokens[i] > token_budget:
+                break
+            baseline.append(i)
+            used += int(tokens[i])
+        redundant_tokens = sum(int(tokens[i]) for i in baseline
+                               if i > 0 and similarity[i, baseline[:baseline.index(i)]].max() >= MMR_DUPLICATE_SIMILARITY) if drop_near_copies else 0
+        
+        available = np.ones(len(hits), dtype=bool)
+        max_similarity = np.zeros(len(hits), dtype=np.float32)  # Similarity to the closest selected hit
+        remaining = token_budget
+        selected = []
+        
+        while len(selected) < top_k:
+            available &= tokens <= remaining
+            if selected and drop_near_copies:
+                available &= max_similarity < MMR_DUPLICATE_SIMILARITY
+            if not available.any():
+                break
+            
+            scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            
+            selected.append(best)
+            available[best] = False
+            remaining -= int(tokens[best])
+            max_similarity = np.maximum(max_similarity, similarity[best])
+        
+        return [hits[i] for i in selected], redundant_tokens
+
+class SharedVectorIndex:
+    """
+    A single in-memory vector index shared by all companies.
+    
+    Every vector carries a company partition key, so searches can be scoped to one,
+    several or all companies with a metadata filter instead of loading separate
+    indexes. Each partition is persisted on its own under store_dir/<company>/, one
+    directory per version plus a CURRENT file naming the live one. Storing a new
+    version writes its directory first and then replaces CURRENT, so a crash never
+    leaves a half-written partition live, and adding, replacing or dropping one
+    company never touches the others.
+    
+    Changes are copy-on-write: a new IndexSnapshot, sharing the partitions that did
+    not change, is swapped in, so searches running against the previous one are never
+    affected by a half-applied change. Read self.db once per query and use that
+    snapshot throughout.
+    """
+    
+    def __init__(self, store_dir: str, dimension: int = 3072):
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.db = IndexSnapshot(dimension)
+        self.loaded: set = set()  # Companies whose partitions are in memory
+        self.versions: Dict[str, str] = {}  # Version of each partition in memory
+        self.load_times: Dict[str, float] = {}  # Seconds taken to load each partition
+        # Called with the company, outside the lock, after a partition is loaded or replaced in memory
+        self.on_partition_loaded: Optional[Callable[[str], Any]] = None
+        self._lock = threading.Lock()
+    
+    def partition_dir(self, company: str) -> str:
+        """Directory holding the versions of a company's partition."""
+        return os.path.join(self.store_dir, company.lower())
+    
+    def current_version(self, company: str) -> Optional[str]:
+        """Live on-disk version of a company's partition, or None if it has never been stored."""
+        try:
+            with open(os.path.join(self.partition_dir(company), CURRENT_VERSION_FILE), 'r', encoding='utf-8') as file:
+                return file.read().strip() or None
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+    
+    def legacy_segment(self, company: str) -> str:
+        """Partition file of the layout before versions, replaced by a version on first load."""
+        return os.path.join(self.store_dir, f"{company.lower()}{LEGACY_SEGMENT_SUFFIX}")
+    
+    def available_partitions(self) -> List[str]:
+        """Companies with a partition in memory or on disk."""
+        entries = os.listdir(self.store_dir)
+        on_disk = {company for company in entries if self.current_version(company)}
+        on_disk.update(entry[:-len(LEGACY_SEGMENT_SUFFIX)] for entry in entries if entry.endswith(LEGACY_SEGMENT_SUFFIX))
+        return sorted(on_disk | self.loaded)
+    
+    def has_partition(self, company: str) -> bool:
+        """Whether a company's partition is in memory or stored on disk."""
+        return (company.lower() in self.loaded or self.current_version(company) is not None
+                or os.path.exists(self.legacy_segment(company)))
+    
+    def load_partition(self, company: str) -> bool:
+        """Load a company's partition into the shared index; False if it has none on disk."""
+        company = company.lower()
+        with self._lock:
+            if company in self.loaded:
+                return True
+            version = self.current_version(company)
+            if os.path.exists(self.legacy_segment(company)):
+                version = self._migrate_legacy_segment(company, version)
+            if version is None:
+                return False
+            
+            start_time = time.perf_counter()
+            try:
+                with open(os.path.join(self.partition_dir(company), version, PARTITION_FILE), 'rb') as file:
+                    partition = pickle.load(file)
+            except Exception as e:
+                logger.error(f"Error loading vector index partition for {company}: {str(e)}")
+                return False
+            self.db = self.db.with_partition(company, partition)
+            self.loaded.add(company)
+            self.versions[company] = version
+            self.load_times[company] = time.perf_counter() - start_time
+        INDEX_LOAD_SECONDS.observe(self.load_times[company], company)
+        
+        logger.info(f"Loaded vector index partition for {company} (version {version}) with {partition.index.ntotal} chunks "
+                    f"in {self.load_times[company]:.2f}s")
+        if self.on_partition_loaded:
+            self.on_partition_loaded(company)
+        return True
+    
+    def ensure_loaded(self, companies: List[str]) -> List[str]:
+        """Load the given partitions if needed and return the companies that are searchable."""
+        return [company for company in companies if self.load_partition(company)]
+    
+    def put_partition(self, company: str, partition: VectorDatabase) -> str:
+        """
+        Store a new version of a company's partition, swap it into the shared index and return the version.
+        
+        The partition is only swapped in once its version is live on disk. If it cannot be
+        stored, the error is raised and the current version stays live, on disk and in memory.
+        """
+        company = company.lower()
+        version = self._write_version(company, partition)
+        try:
+            self._prune_versions(company)
+        except OSError as e:
+            logger.error(f"Error pruning old versions of the vector index partition for {company}: {str(e)}")
+        
+        with self._lock:
+            self.db = self.db.with_partition(company, partition)
+            self.loaded.add(company)
+            self.versions[company] = version
+        logger.info(f"Stored vector index partition for {company} (version {version}) with {partition.index.ntotal} chunks")
+        if self.on_partition_loaded:
+            self.on_partition_loaded(company)
+        return version
+    
+    def _write_version(self, company: str, partition: VectorDatabase) -> str:
+        """Write a partition as a new version directory and make it the live one; returns the version."""
+        partition_dir = self.partition_dir(company)
+        version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        version_dir = os.path.join(partition_dir, version)
+        try:
+            os.makedirs(version_dir)
+            with open(os.path.join(version_dir, PARTITION_FILE), 'wb') as file:
+                pickle.dump(partition, file)
+            
+            # Make the new version live with a single rename
+            current_file = os.path.join(partition_dir, CURRENT_VERSION_FILE)
+            with open(current_file + ".tmp", 'w', encoding='utf-8') as file:
+                file.write(version)
+            os.replace(current_file + ".tmp", current_file)
+        except Exception as e:
+            logger.error(f"Error saving vector index partition for {company}: {str(e)}")
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+        return version
+    
+    def _migrate_legacy_segment(self, company: str, version: Optional[str]) -> Optional[str]:
+        """
+        Replace a partition file of the layout before versions with a stored version.
+        
+        The file is removed once it is stored, or right away if the partition already has
+        a version, which is newer. Returns the live version, None if there is none.
+        """
+        segment = self.legacy_segment(company)
+        if version is None:
+            try:
+                with open(segment, 'rb') as file:
+                    partition = pickle.load(file)
+                version = self._write_version(company, partition)
+                logger.info(f"Migrated vector index partition {segment} to version {version}")
+            except Exception as e:
+                logger.error(f"Error migrating vector index partition {segment}: {str(e)}")
+                return None
+        os.remove(segment)
+        return version
+    
+    def _prune_versions(self, company: str) -> None:
+        """Delete the oldest version directories of a partition beyond PARTITION_VERSIONS_KEPT."""
+        partition_dir = self.partition_dir(company)
+        versions = sorted(entry for entry in os.listdir(partition_dir) if os.path.isdir(os.path.join(partition_dir, entry)))
+        for version in versions[:-PARTITION_VERSIONS_KEPT]:
+            shutil.rmtree(os.path.join(partition_dir, version), ignore_errors=True)
+    
+    def unload_partition(self, company: str) -> None:
+        """Drop a company's partition from memory; its stored versions stay on disk."""
+        company = company.lower()
+        with self._lock:
+            if company not in self.loaded:
+                return
+            self.db = self.db.with_partition(company)
+            self.loaded.discard(company)
+            self.versions.pop(company, None)
+    
+    def drop_partition(self, company: str) -> None:
+        """Remove a company's partition from memory and disk."""
+        self.unload_partition(company)
+        shutil.rmtree(self.partition_dir(company), ignore_errors=True)
+        if os.path.exists(self.legacy_segment(company)):
+            os.remove(self.legacy_segment(company))
+    
+    def partition_size(self, company: str) -> int:
+        """Number of chunks in a loaded partition."""
+        partition = self.db.partition(company)
+        return partition.index.ntotal if partition is not None else 0
+    
+    def partition_bytes(self, company: str) -> int:
+        """Approximate memory held by a loaded partition: vectors, metadata columns and chunk text."""
+        partition = self.db.partition(company)
+        if partition is None:
+            return 0
+        # One float32 per dimension plus the int32 metadata columns and an int64 offset per row
+        row_bytes = 4 * partition.dimension + 4 * (len(ChunkStore._INTERNED) + len(ChunkStore._COUNTERS)) + 8
+        return partition.index.ntotal * row_bytes + len(partition.chunks.content)
+
+# Shared indexes by store directory, so every ThemeQA in a process uses the same one
+_shared_indexes: Dict[str, SharedVectorIndex] = {}
+_shared_indexes_lock = threading.Lock()
+
+def get_shared_index(store_dir: str) -> SharedVectorIndex:
+    """Return the process-wide shared vector index stored in store_dir."""
+    store_dir = os.path.abspath(store_dir)
+    with _shared_indexes_lock:
+        if store_dir not in _shared_indexes:
+            _shared_indexes[store_dir] = SharedVectorIndex(store_dir)
+        return _shared_indexes[store_dir]
+
+def _collect_index_sizes(attribute: str):
+    """Samples of a per-company size of every loaded partition, for the metrics registry."""
+    with _shared_indexes_lock:
+        indexes = list(_shared_indexes.values())
+    for index in indexes:
+        for company in sorted(index.loaded):
+            size = index.partition_size(company) if attribute == "chunks" else index.partition_bytes(company)
+            yield (f"qa_index_{attribute}", {"company": company}, size)
+
+def collect_embedding_garbage(output_dir: str) -> int:
+    """
+    Remove the embeddings no stored index partition uses from an output directory's embedding store.
+    
+    Every kept version of every company's partition, in every retrieval mode, counts as
+    a reference, as do per-company caches from before the shared index, so any of them
+    can still be rebuilt without the embeddings API. Indexes are looked for in the
+    output directory's cache and in every custom cache directory an engine recorded in
+    the store. Returns the number removed.
+    """
+    store = get_embedding_store(output_dir, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    paths = set()
+    for cache_dir in sorted({os.path.abspath(os.path.join(output_dir, CACHE_DIR)), *store.cache_dirs()}):
+        if not os.path.isdir(cache_dir):
+            logger.warning(f"Cache directory {cache_dir} no longer exists; no embeddings are kept for its indexes")
+            continue
+        index_dir = os.path.join(cache_dir, VECTOR_INDEX_DIR)
+        paths.update(glob.glob(os.path.join(index_dir, "*", "*", "*", PARTITION_FILE)))
+        paths.update(glob.glob(os.path.join(index_dir, "*", f"*{LEGACY_SEGMENT_SUFFIX}")))
+        # Per-company caches from before the shared index, in company cache directories or a custom one
+        paths.update(glob.glob(os.path.join(cache_dir, "*", f"*_{VECTOR_DB_CACHE_FILE}")))
+        paths.update(glob.glob(os.path.join(cache_dir, f"*_{VECTOR_DB_CACHE_FILE}")))
+    
+    referenced = set()
+    for path in sorted(paths):
+        try:
+            with open(path, 'rb') as file:
+                partition = pickle.load(file)
+        except Exception as e:
+            # Removing embeddings a partition still uses would make its rebuild pay for them again
+            logger.error(f"Not collecting embedding garbage, could not read {path}: {str(e)}")
+            return 0
+        referenced.update(store.key(partition.chunks.content_at(row)) for row in range(len(partition.chunks)))
+    return store.collect_garbage(referenced)
+
+registry.add_collector("qa_index_chunks", "gauge", "Chunks in each loaded vector index partition", lambda: _collect_index_sizes("chunks"))
+registry.add_collector("qa_index_bytes", "gauge", "Approximate memory held by each loaded vector index partition", lambda: _collect_index_sizes("bytes"))
+
 class ThemeQA:
     """Handles question answering about themes using source documents."""
     
-    def __init__(self, api_key: str, input_dir: str, output_dir: str, cache_dir: str = None, company_id: str = "netflix"):
+    def __init__(self, api_key: str, input_dir: str, output_dir: str, cache_dir: str = None, company_id: str = "netflix", openai_client=None, retrieval_mode: str = RETRIEVAL_MODE_CHUNK, mmr_lambda: float = None,
+                 vector_index: SharedVectorIndex = None, async_openai_client=None, cpu_executor: Executor = None):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected one of {RETRIEVAL_MODES}")
+        if mmr_lambda is not None and not 0.0 <= mmr_lambda <= 1.0:
+            raise ValueError(f"MMR lambda must be between 0 and 1, got {mmr_lambda}")
+        
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.company_id = company_id.lower()
+        self.retrieval_mode = retrieval_mode
+        
+        # Relevance/diversity weight for MMR re-selection of hits (None disables MMR)
+        self.mmr_lambda = mmr_lambda
+        self.mmr_tokens_saved = 0  # Prompt tokens MMR avoided spending on redundant hits
         
-        # Set themes file based on company_id
-        self.themes_file = os.path.join(output_dir, f"{self.company_id}_themes.json")
+        # Themes are read from the filings database shared with the extractor and the backend
+        self.filings_db = get_filings_db(output_dir)
         
         # Set up cache directory
         self.cache_dir = cache_dir or os.path.join(output_dir, CACHE_DIR, self.company_id)
         os.makedirs(self.cache_dir, exist_ok=True)
         
         # Cache file paths with company_id to ensure isolation
-        self.text_cache_file = os.path.join(self.cache_dir, f"{self.company_id}_{TEXT_CACHE_FILE}")
-        self.vector_db_cache_file = os.path.join(self.cache_dir, f"{self.company_id}_{VECTOR_DB_CACHE_FILE}")
+        # Per-company vector database cache from before the shared index; imported on first load.
+        # Passage mode indexes different units, so it keeps its own vector database cache
+        vector_db_prefix = self.company_id if retrieval_mode == RETRIEVAL_MODE_CHUNK else f"{self.company_id}_{retrieval_mode}"
+        self.vector_db_cache_file = os.path.join(self.cache_dir, f"{vector_db_prefix}_{VECTOR_DB_CACHE_FILE}")
         self.file_hash_cache_file = os.path.join(self.cache_dir, f"{self.company_id}_{FILE_HASH_CACHE_FILE}")
         
         logger.info(f"Initializing ThemeQA for company: {self.company_id}")
         logger.info(f"Input directory: {self.input_dir}")
         logger.info(f"Cache directory: {self.cache_dir}")
-        logger.info(f"Themes file: {self.themes_file}")
+        logger.info(f"Themes database: {self.filings_db.db_file}")
+        logger.info(f"Retrieval mode: {self.retrieval_mode}")
         
-        # Initialize OpenAI client
-        self.openai_client = openai.OpenAI(api_key=api_key)
+        # OpenAI calls go through the shared, rate-limited gateway (callers may inject their own client, e.g. a local fake)
+        gateway = None if openai_client else get_openai_gateway(api_key)
+        self.openai_client = openai_client or gateway.client
+        # Async client for the a*-methods; without one they run the sync client's calls on the CPU executor
+        self.async_openai_client = async_openai_client or (None if openai_client else gateway.async_client)
+        # Executor for blocking work (search, tokenization, index loads) in the a*-methods; None uses the loop's default
+        self.cpu_executor = cpu_executor
         
         # Initialize components
-        self.doc_processor = DocumentProcessor()
         self.text_processor = TextProcessor(self.openai_client)
-        self.vector_db = VectorDatabase()
+        # Documents are parsed and chunked once, into artifacts shared with the extractor
+        self.artifacts = get_artifact_store(output_dir)
+        # Chunk embeddings are kept by content, shared by every company and every rebuild
+        self.embeddings = get_embedding_store(output_dir, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+        
+        # Shared, company-partitioned vector index; passage mode indexes different units, so it has its own.
+        # It lives with the caches: beside the company cache directories by default, or in a custom cache directory
+        index_root = os.path.join(output_dir, CACHE_DIR)
+        if os.path.abspath(self.cache_dir) != os.path.abspath(os.path.join(index_root, self.company_id)):
+            index_root = self.cache_dir
+        self.vector_index = vector_index or get_shared_index(os.path.join(index_root, VECTOR_INDEX_DIR, retrieval_mode))
+        # So garbage collection of the embedding store counts this index's references
+        self.embeddings.add_cache_dir(os.path.dirname(os.path.dirname(self.vector_index.store_dir)))
         
         # Load themes
         self.themes = self._load_themes()
         
-        # Load cached data
-        self.text_cache = self._load_text_cache()
+        # Content hashes of the documents indexed in this company's partition
         self.file_hashes = self._load_file_hashes()
     
-    def _load_themes(self) -> List[Dict]:
-        """Load existing themes from JSON file."""
-        if os.path.exists(self.themes_file):
-            try:
-                with open(self.themes_file, 'r', encoding='utf-8') as file:
-                    return json.load(file)
-            except Exception as e:
-                logger.error(f"Error loading themes: {str(e)}")
-                return []
-        return []
+    @property
+    def vector_db(self) -> IndexSnapshot:
+        """Current snapshot of the shared vector index."""
+        return self.vector_index.db
     
-    def _load_text_cache(self) -> Dict[str, str]:
-        """Load cached document text from file."""
-        if os.path.exists(self.text_cache_file):
-            try:
-                with open(self.text_cache_file, 'r', encoding='utf-8') as file:
-                    return json.load(file)
-            except Exception as e:
-                logger.error(f"Error loading text cache: {str(e)}")
-                return {}
-        return {}
-
-    def _save_text_cache(self) -> None:
-        """Save document text cache to file."""
+    def _load_themes(self) -> List[Dict]:
+        """Load existing themes from the filings database."""
         try:
-            with open(self.text_cache_file, 'w', encoding='utf-8') as file:
-                json.dump(self.text_cache, file, indent=2)
+            return self.filings_db.get_themes(self.company_id)
         except Exception as e:
-            logger.error(f"Error saving text cache: {str(e)}")
-
+            logger.error(f"Error loading themes: {str(e)}")
+            return []
+    
     def _load_file_hashes(self) -> Dict[str, str]:
         """Load cached file hashes from file."""
         if os.path.exists(self.file_hash_cache_file):
@@ -346,67 +1044,91 @@ class ThemeQA:
         except Exception as e:
             logger.error(f"Error saving file hashes: {str(e)}")
 
-    def _calculate_file_hash(self, file_path: str) -> str:
-        """Calculate MD5 hash of a file to detect changes."""
-        try:
-            with open(file_path, 'rb') as file:
-                return hashlib.md5(file.read()).hexdigest()
-        except Exception as e:
-            logger.error(f"Error calculating file hash: {str(e)}")
-            return ""
-
-    def _load_vector_db(self) -> bool:
-        """Load vector database from cache file."""
+    def _load_legacy_vector_db(self) -> Optional[VectorDatabase]:
+        """Load a per-company vector database cache written before the shared index existed."""
         if os.path.exists(self.vector_db_cache_file):
             try:
                 with open(self.vector_db_cache_file, 'rb') as file:
-                    self.vector_db = pickle.load(file)
-                logger.info(f"Loaded vector database from cache with {self.vector_db.index.ntotal} chunks")
-                return True
+                    vector_db = pickle.load(file)
+                logger.info(f"Loaded vector database from cache with {vector_db.index.ntotal} chunks")
+                return vector_db
             except Exception as e:
                 logger.error(f"Error loading vector database: {str(e)}")
-                return False
-        return False
-
-    def _save_vector_db(self) -> None:
-        """Save vector database to cache file."""
-        try:
-            with open(self.vector_db_cache_file, 'wb') as file:
-                pickle.dump(self.vector_db, file)
-            logger.info(f"Saved vector database to cache with {self.vector_db.index.ntotal} chunks")
-        except Exception as e:
-            logger.error(f"Error saving vector database: {str(e)}")
+                return None
+        return None
     
     def invalidate_cache(self) -> None:
         """Invalidate all caches to force reprocessing of documents."""
         logger.info("Invalidating all caches")
         
-        # Remove cache files
-        if os.path.exists(self.text_cache_file):
-            os.remove(self.text_cache_file)
+        # Keep the vectors of the stored partition, so the rebuild does not embed its chunks again
+        self._store_partition_embeddings()
         
+        # Remove cache files (document artifacts and embeddings are keyed by content, so they stay valid)
         if os.path.exists(self.vector_db_cache_file):
             os.remove(self.vector_db_cache_file)
         
         if os.path.exists(self.file_hash_cache_file):
             os.remove(self.file_hash_cache_file)
         
+        # Drop this company's partition from the shared index
+        self.vector_index.drop_partition(self.company_id)
+        
         # Reset in-memory caches
-        self.text_cache = {}
         self.file_hashes = {}
-        self.vector_db = VectorDatabase()
         
         logger.info("All caches invalidated")
     
+    def _store_partition_embeddings(self) -> None:
+        """Add the vectors of this company's stored partition to the embedding store (partitions built before it are not in it)."""
+        if not self.vector_index.load_partition(self.company_id):
+            return
+        partition = self.vector_index.db.partition(self.company_id)
+        if partition is not None and partition.index.ntotal:
+            contents = [partition.chunks.content_at(row) for row in range(len(partition.chunks))]
+            added = self.embeddings.put_many(contents, partition.index.reconstruct_n(0, partition.index.ntotal))
+            if added:
+                logger.info(f"Stored {added} embeddings from the partition for {self.company_id}")
+    
     def load_documents(self) -> None:
         """Load and process documents, adding them to the vector database."""
         logger.info("Loading and processing documents...")
         
-        # Try to load vector database from cache first
-        if self._load_vector_db():
-            logger.info("Using cached vector database")
+        if self.load_index():
             return
         
+        partition = self.build_partition()
+        if partition is not None:
+            self.vector_index.put_partition(self.company_id, partition)
+    
+    def load_index(self) -> bool:
+        """Make this company's existing index partition searchable without building it; False if there is none."""
+        # Try to load this company's partition of the shared index first
+        if self.vector_index.load_partition(self.company_id):
+            logger.info("Using cached vector index partition")
+            return True
+        
+        # Import a per-company cache from before the shared index existed
+        legacy_vector_db = self._load_legacy_vector_db()
+        if legacy_vector_db is not None:
+            logger.info("Importing cached vector database into the shared index")
+            self.vector_index.put_partition(self.company_id, legacy_vector_db)
+            return True
+        return False
+    
+    def build_partition(self, should_cancel: Callable[[], bool] = None,
+                        progress: Callable[[int, int], None] = None) -> Optional[VectorDatabase]:
+        """
+        Build this company's index partition from its documents.
+        
+        The partition is returned rather than swapped in, so the caller decides when it
+        goes live and searches keep using the current one meanwhile. should_cancel is
+        checked before each document and raises IndexBuildCancelled when it returns True;
+        progress is called with the number of documents done and the total. Returns None
+        if the input directory does not exist.
+        """
+        partition = VectorDatabase()
+        
         logger.info(f"Input directory: {self.input_dir}")
         
         # Check if input directory exists
@@ -414,7 +1136,7 @@ class ThemeQA:
             logger.error(f"Input directory does not exist: {self.input_dir}")
             logger.info(f"Current working directory: {os.getcwd()}")
             logger.info(f"Directory contents: {os.listdir('.')}")
-            return
+            return None
         
         # Find all PDF and JSON files
         pdf_files = []
@@ -433,123 +1155,325 @@ class ThemeQA:
                     json_files.append(file_path)
                     logger.info(f"Found JSON: {file_path}")
         
-        # Process PDF files
-        for pdf_file in pdf_files:
-            # Check if file has changed since last processing
-            current_hash = self._calculate_file_hash(pdf_file)
-            cached_hash = self.file_hashes.get(pdf_file)
-            
-            if pdf_file in self.text_cache and cached_hash == current_hash:
-                logger.info(f"Using cached text for PDF: {pdf_file}")
-                text = self.text_cache[pdf_file]
-            else:
-                # Extract text from PDF
-                logger.info(f"Extracting text from PDF: {pdf_file}")
-                text = self.doc_processor.extract_text_from_pdf(pdf_file)
-                if not text:
-                    logger.warning(f"No text extracted from PDF: {pdf_file}")
-                    continue
-                
-                # Update cache
-                self.text_cache[pdf_file] = text
-                self.file_hashes[pdf_file] = current_hash
-            
-            # Split text into chunks
-            chunks = self.text_processor.chunk_text(text)
-            
-            # Add chunks to vector database
-            for i, chunk in enumerate(chunks):
-                # Generate embedding
-                embedding = self.text_processor.generate_embedding(chunk)
-                
-                # Add to vector database
-                self.vector_db.add_document({
-                    "content": chunk,
-                    "source": os.path.basename(pdf_file),
-                    "chunk_id": i,
-                    "total_chunks": len(chunks),
-                    "type": "pdf"
-                }, embedding)
-        
-        # Process JSON files
-        for json_file in json_files:
-            # Check if file has changed since last processing
-            current_hash = self._calculate_file_hash(json_file)
-            cached_hash = self.file_hashes.get(json_file)
-            
-            if json_file in self.text_cache and cached_hash == current_hash:
-                logger.info(f"Using cached text for JSON: {json_file}")
-                text = self.text_cache[json_file]
-            else:
-                # Parse JSON file
-                logger.info(f"Parsing JSON file: {json_file}")
-                json_data = self.doc_processor.parse_json_file(json_file)
-                if not json_data:
-                    logger.warning(f"No data parsed from JSON: {json_file}")
-                    continue
-                
-                # Extract text from JSON
-                text = self.doc_processor.extract_text_from_sec_json(json_data)
-                if not text:
-                    logger.warning(f"No text extracted from JSON: {json_file}")
-                    continue
-                
-                # Update cache
-                self.text_cache[json_file] = text
-                self.file_hashes[json_file] = current_hash
+        total_files = len(pdf_files) + len(json_files)
+        done_files = 0
+        
+        def next_file() -> None:
+            nonlocal done_files
+            if progress:
+                progress(done_files, total_files)
+            if should_cancel and should_cancel():
+                raise IndexBuildCancelled(f"Index build for {self.company_id} was cancelled")
+            done_files += 1
+        
+        # Process PDF files, then JSON files
+        for file_path in pdf_files + json_files:
+            next_file()
             
-            # Split text into chunks
-            chunks = self.text_processor.chunk_text(text)
+            document = self.artifacts.document(file_path)
+            if document is None:
+                continue
             
-            # Add chunks to vector database
-            for i, chunk in enumerate(chunks):
-                # Generate embedding
-                embedding = self.text_processor.generate_embedding(chunk)
-                
-                # Add to vector database
-                self.vector_db.add_document({
-                    "content": chunk,
-                    "source": os.path.basename(json_file),
-                    "chunk_id": i,
-                    "total_chunks": len(chunks),
-                    "type": "json"
-                }, embedding)
+            # Add the document's chunks to the vector database
+            self._index_document(document, os.path.basename(file_path), partition)
+            self.file_hashes[file_path] = document.content_hash
+        
+        if progress:
+            progress(total_files, total_files)
         
         # Save caches
-        self._save_text_cache()
         self._save_file_hashes()
-        self._save_vector_db()
         
-        logger.info(f"Loaded {self.vector_db.index.ntotal} document chunks into vector database")
+        logger.info(f"Built {partition.index.ntotal} document chunks for {self.company_id}")
+        return partition
     
-    def answer_question(self, question: str) -> str:
-        """Answer a question about themes using the source documents."""
-        logger.info(f"Answering question: {question}")
+    def ingest_document(self, file_path: str) -> Optional[VectorDatabase]:
+        """
+        Build this company's partition with one new or changed document added incrementally.
+        
+        Only that document is extracted and embedded: the partition's other chunks are
+        carried over as stored vectors, and chunks previously indexed for the same file
+        name are replaced. Other companies' partitions are not read or copied. As with
+        build_partition, the partition is returned rather than swapped in. The company
+        must already have a stored partition. Returns None if the document is already
+        indexed and unchanged since.
+        """
+        if not self.vector_index.load_partition(self.company_id):
+            raise ValueError(f"No vector index partition for {self.company_id} to add {file_path} to")
+        
+        current = self.vector_index.db.partition(self.company_id)
+        if current is None:
+            raise ValueError(f"The vector index partition for {self.company_id} was unloaded while adding {file_path}")
+        source = os.path.basename(file_path)
+        source_rows = current.chunks.source_mask(source)
+        if source_rows.any() and self.file_hashes.get(file_path) == self.artifacts.file_hash(file_path):
+            logger.info(f"{source} is already indexed for {self.company_id}")
+            return None
+        partition = current.select(~source_rows)
+        
+        document = self.artifacts.document(file_path)
+        if document is not None:
+            document_db = VectorDatabase(current.dimension)
+            self._index_document(document, source, document_db)
+            partition.append(document_db)
+            
+            # Save caches
+            self.file_hashes[file_path] = document.content_hash
+            self._save_file_hashes()
+        
+        logger.info(f"Ingested {source} into the partition for {self.company_id} ({partition.index.ntotal} chunks)")
+        return partition
+    
+    def _split_passages(self, document: DocumentArtifact) -> List[Dict[str, Any]]:
+        """
+        Split a document into small passages for passage-mode retrieval.
+        
+        Passages never cross a page boundary. Consecutive passages are grouped into
+        parent chunks of up to MAX_TOKENS tokens, mirroring the chunks used for extraction.
+        """
+        chunks = self.artifacts.chunks(document, PASSAGE_CONFIG)
+        
+        passages = []
+        parent_id = 0
+        parent_tokens = 0
+        for passage, page, tokens in zip(chunks.contents(), chunks.pages, chunks.token_counts()):
+            # Start a new parent chunk once the current one is full
+            if parent_tokens and parent_tokens + tokens > MAX_TOKENS:
+                parent_id += 1
+                parent_tokens = 0
+            parent_tokens += tokens
+            
+            passages.append({
+                "content": passage,
+                "parent_id": parent_id,
+                "page": page,
+                "tokens": tokens
+            })
+        return passages
+    
+    def _index_document(self, document: DocumentArtifact, source: str, vector_db: VectorDatabase) -> None:
+        """Add a document's retrieval units to a vector database."""
+        if self.retrieval_mode == RETRIEVAL_MODE_PASSAGE:
+            units = self._split_passages(document)
+        else:
+            chunks = self.artifacts.chunks(document, CHUNK_CONFIG)
+            units = [{"content": chunk, "parent_id": i, "tokens": tokens}
+                     for i, (chunk, tokens) in enumerate(zip(chunks.contents(), chunks.token_counts()))]
+        
+        embeddings = self._embed_units([unit["content"] for unit in units], [unit["tokens"] for unit in units])
+        for i, (unit, embedding) in enumerate(zip(units, embeddings)):
+            # Add to vector database
+            vector_db.add_document(dict(unit, source=source, chunk_id=i, total_chunks=len(units), type=document.doc_type,
+                                        company=self.company_id), embedding)
+    
+    def _embed_units(self, contents: List[str], token_counts: List[int]) -> List[List[float]]:
+        """Embeddings of retrieval units, from the embedding store; only the ones it lacks are generated and then stored."""
+        embeddings = self.embeddings.get_many(contents)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            generated = self.text_processor.generate_embeddings([contents[i] for i in missing], [token_counts[i] for i in missing])
+            for i, embedding in zip(missing, generated):
+                embeddings[i] = embedding
+            # A failed batch comes back as empty embeddings, which are generated again next time
+            generated = [i for i in missing if embeddings[i]]
+            self.embeddings.put_many([contents[i] for i in generated], [embeddings[i] for i in generated])
+        return embeddings
+    
+    def retrieve_chunks(self, question: str, filters: Dict[str, List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Retrieve the document chunks most relevant to a question, best match first.
+        
+        Filters optionally restrict the search to given "sources", "types" or "periods".
+        The search covers this company unless filters name other "companies".
+        """
+        filters = self._scope_filters(filters)
         
         # Generate embedding for the question
         question_embedding = self.text_processor.generate_embedding(question)
         
-        # Search for relevant document chunks
-        relevant_chunks = self.vector_db.search(question_embedding)
+        return self._search(question_embedding, filters)
+    
+    async def aretrieve_chunks(self, question: str, filters: Dict[str, List[str]] = None) -> List[Dict[str, Any]]:
+        """Async variant of retrieve_chunks: the embedding request is awaited and the search runs on the CPU executor."""
+        filters = await self._run_cpu(self._scope_filters, filters)
         
-        if not relevant_chunks:
-            return "I couldn't find any relevant information in the source documents to answer your question."
+        if self.async_openai_client is None:
+            question_embedding = await self._run_cpu(self.text_processor.generate_embedding, question)
+        else:
+            try:
+                response = await self.async_openai_client.embeddings.create(model=EMBEDDING_MODEL, input=question)
+                question_embedding = response.data[0].embedding
+            except Exception as e:
+                logger.error(f"Error generating embedding: {str(e)}")
+                question_embedding = []
+        
+        return await self._run_cpu(self._search, question_embedding, filters)
+    
+    def _search(self, query_embedding: List[float], filters: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        """Search a snapshot of the vector index and turn the hits into prompt excerpts."""
+        vector_db = self.vector_db
+        relevant_chunks = vector_db.search(query_embedding, self._search_top_k(), filters)
+        return self._rank_hits(relevant_chunks, query_embedding, vector_db)
+    
+    async def _run_cpu(self, func: Callable, *args) -> Any:
+        """Run blocking work on the CPU executor so it does not stall the event loop, in the caller's context."""
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, functools.partial(contextvars.copy_context().run, func, *args))
+    
+    def _scope_filters(self, filters: Optional[Dict[str, List[str]]]) -> Dict[str, List[str]]:
+        """Scope filters to this company's partition unless they name companies, loading any partitions they need."""
+        filters = dict(filters or {})
+        companies = [company.lower() for company in filters.get("companies") or []]
+        
+        if not companies:
+            filters["companies"] = [self.company_id]
+        elif ALL_COMPANIES in companies:
+            filters["companies"] = [ALL_COMPANIES]
+            self.vector_index.ensure_loaded(self.vector_index.available_partitions())
+        else:
+            filters["companies"] = companies
+            missing = set(companies) - set(self.vector_index.ensure_loaded(companies))
+            if missing:
+                logger.warning(f"No vector index partition for companies: {', '.join(sorted(missing))}")
+        return filters
+    
+    def corpus_version(self, filters: Optional[Dict[str, List[str]]] = None) -> str:
+        """Versions of the in-memory partitions a search with these filters reads, e.g. for keying shared answers."""
+        companies = sorted(company.lower() for company in (filters or {}).get("companies") or [self.company_id])
+        versions = dict(self.vector_index.versions)
+        if ALL_COMPANIES in companies:
+            companies = sorted(versions)
+        return ",".join(f"{company}@{versions.get(company, '')}" for company in companies)
+    
+    def _result_top_k(self) -> int:
+        """Number of hits to keep per question for the current retrieval mode."""
+        return PASSAGE_TOP_K if self.retrieval_mode == RETRIEVAL_MODE_PASSAGE else TOP_K_RESULTS
+    
+    def _search_top_k(self) -> int:
+        """Number of index hits to fetch per question; MMR re-selects from a wider pool."""
+        if self.mmr_lambda is not None:
+            return self._result_top_k() * MMR_FETCH_FACTOR
+        return self._result_top_k()
+    
+    def _rank_hits(self, hits: List[ChunkView], query_embedding: List[float], vector_db: IndexSnapshot) -> List[Dict[str, Any]]:
+        """Order raw search hits from a vector database snapshot best first and turn them into prompt excerpts."""
+        # Sort chunks by relevance score (lower is better for L2 distance)
+        hits.sort(key=lambda x: x["score"])
+        
+        if self.mmr_lambda is not None:
+            hits = self._diversify_hits(hits, query_embedding, vector_db)
+        
+        if self.retrieval_mode == RETRIEVAL_MODE_PASSAGE:
+            return self._expand_passages(hits, vector_db)
+        return hits
+    
+    def _diversify_hits(self, hits: List[ChunkView], query_embedding: List[float], vector_db: IndexSnapshot) -> List[ChunkView]:
+        """Re-select hits with MMR and record the near-duplicate prompt tokens that avoided."""
+        top_k = self._result_top_k()
+        token_budget = PASSAGE_CONTEXT_TOKENS if self.retrieval_mode == RETRIEVAL_MODE_PASSAGE else MAX_PROMPT_TOKENS - 2000
+        
+        selected, tokens_saved = vector_db.mmr_select(query_embedding, hits, top_k, token_budget,
+                                                           self.mmr_lambda, self.text_processor.count_tokens)
+        
+        self.mmr_tokens_saved += tokens_saved
+        MMR_TOKENS_SAVED.inc(self.company_id, amount=tokens_saved)
+        logger.info(f"MMR selected {len(selected)} of {len(hits)} candidates; "
+                    f"{tokens_saved} prompt tokens of near-duplicate chunks avoided over plain top-{top_k}")
+        
+        # Keep the prompt ordered by relevance
+        selected.sort(key=lambda x: x["score"])
+        return selected
+    
+    def _expand_passages(self, hits: List[ChunkView], vector_db: IndexSnapshot,
+                         token_budget: int = PASSAGE_CONTEXT_TOKENS) -> List[Dict[str, Any]]:
+        """
+        Turn passage hits into prompt excerpts.
+        
+        Hits are taken best first while they fit the token budget. Each kept hit is then
+        widened with neighbouring passages from the same parent chunk, nearest first, as
+        long as the budget allows. Adjacent passages on the same page are merged into a
+        single excerpt.
+        """
+        # Rows are keyed by company, since each partition numbers its rows from 0
+        def store_of(key: Tuple[str, int]) -> ChunkStore:
+            return vector_db.partitions[key[0]].chunks
+        
+        def passage_tokens(key: Tuple[str, int]) -> int:
+            store = store_of(key)
+            return store.token_counts[key[1]] or self.text_processor.count_tokens(store.content_at(key[1]))
+        
+        def same_parent(key: Tuple[str, int], other: Tuple[str, int]) -> bool:
+            store, row = store_of(other), key[1]
+            return (key[0] == other[0] and 0 <= row < len(store)
+                    and store.source_ids[row] == store.source_ids[other[1]]
+                    and store.parent_ids[row] == store.parent_ids[other[1]])
+        
+        # Score of the hit each selected row was pulled in for
+        selected: Dict[Tuple[str, int], float] = {}
+        used_tokens = 0
+        
+        hit_keys = [(hit["company"], hit.row) for hit in hits]
+        for hit, key in zip(hits, hit_keys):
+            tokens = passage_tokens(key)
+            if used_tokens + tokens > token_budget:
+                continue
+            selected[key] = hit.score
+            used_tokens += tokens
+        
+        kept_hits = [(hit, key) for hit, key in zip(hits, hit_keys) if key in selected]
+        for distance in range(1, PASSAGE_EXPANSION_WINDOW + 1):
+            for hit, (company, hit_row) in kept_hits:
+                for step in (-1, 1):
+                    key = (company, hit_row + step * distance)
+                    # Only grow outwards from rows that are already part of this excerpt
+                    if key in selected or (company, key[1] - step) not in selected or not same_parent(key, (company, hit_row)):
+                        continue
+                    tokens = passage_tokens(key)
+                    if used_tokens + tokens > token_budget:
+                        continue
+                    selected[key] = hit.score
+                    used_tokens += tokens
         
+        # Merge runs of adjacent rows into excerpts
+        excerpts = []
+        for key in sorted(selected):
+            company, row = key
+            store = store_of(key)
+            previous = excerpts[-1] if excerpts else None
+            if (previous and previous["last_key"] == (company, row - 1) and same_parent(key, (company, row - 1))
+                    and store.pages[row] == store.pages[row - 1]):
+                previous["content"] += " " + store.content_at(row)
+                previous["tokens"] += store.token_counts[row]
+                previous["score"] = min(previous["score"], selected[key])
+                previous["last_key"] = key
+                continue
+            excerpt = dict(store.view(row, selected[key]))
+            excerpt["last_key"] = key
+            excerpts.append(excerpt)
+        
+        logger.info(f"Expanded {len(hits)} passage hits into {len(excerpts)} excerpts ({used_tokens} tokens)")
+        
+        excerpts.sort(key=lambda x: x["score"])
+        for excerpt in excerpts:
+            del excerpt["last_key"]
+        return excerpts
+    
+    def build_prompt(self, question: str, relevant_chunks: List[Dict[str, Any]]) -> str:
+        """Build the answer prompt from the question and the retrieved chunks."""
         # Prepare context for the LLM
         context = ""
         total_context_tokens = 0
         
-        # Sort chunks by relevance score (lower is better for L2 distance)
-        relevant_chunks.sort(key=lambda x: x["score"])
+        chunk_texts = []
+        for i, chunk in enumerate(relevant_chunks):
+            location = f"page {chunk['page']}, " if chunk.get("page") else ""
+            # Label excerpts from other companies when a search spans several partitions
+            company = chunk.get("company")
+            source = f"{company.capitalize()} / {chunk['source']}" if company and company != self.company_id else chunk['source']
+            chunk_text = f"\n--- Document {i+1}: {source} ({location}part {chunk['chunk_id']+1}/{chunk['total_chunks']}) ---\n"
+            chunk_texts.append(chunk_text + chunk["content"] + "\n")
         
         # Add chunks to context until we reach the token limit
-        for i, chunk in enumerate(relevant_chunks):
-            chunk_text = f"\n--- Document {i+1}: {chunk['source']} (part {chunk['chunk_id']+1}/{chunk['total_chunks']}) ---\n"
-            chunk_text += chunk["content"] + "\n"
-            
-            # Count tokens in this chunk
-            chunk_tokens = self.text_processor.count_tokens(chunk_text)
-            
+        for i, (chunk_text, chunk_tokens) in enumerate(zip(chunk_texts, self.text_processor.count_tokens_batch(chunk_texts))):
             # Check if adding this chunk would exceed our token limit
             if total_context_tokens + chunk_tokens > MAX_PROMPT_TOKENS - 2000:  # Leave 2000 tokens for the rest of the prompt
                 logger.info(f"Stopping at {i} chunks to stay under token limit")
@@ -702,21 +1626,250 @@ class ThemeQA:
                     {new_context}
                     """
         
+        return prompt
+    
+    def _chat_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Wrap a prompt in the chat messages sent to the completion model."""
+        return [
+            {"role": "system", "content": "You are a financial analyst specializing in identifying business growth and contraction themes from corporate documents."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def answer_question(self, question: str, filters: Dict[str, List[str]] = None) -> str:
+        """Answer a question about themes using the source documents, optionally restricted by metadata filters."""
+        logger.info(f"Answering question: {question}")
+        
+        relevant_chunks = self.retrieve_chunks(question, filters)
+        if not relevant_chunks:
+            return NO_CONTEXT_ANSWER
+        
+        prompt = self.build_prompt(question, relevant_chunks)
+        
+        # Generate answer using OpenAI
+        try:
+            return self._generate_answer(prompt)
+        
+        except Exception as e:
+            logger.error(f"Error generating answer: {str(e)}")
+            return f"An error occurred while generating the answer: {str(e)}"
+    
+    def _generate_answer(self, prompt: str) -> str:
+        """Run the completion for a prompt and return the answer text."""
+        response = self.openai_client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=self._chat_messages(prompt)
+        )
+        return response.choices[0].message.content
+    
+    async def aanswer_question(self, question: str, filters: Dict[str, List[str]] = None) -> str:
+        """Async variant of answer_question for callers running on an event loop."""
+        logger.info(f"Answering question: {question}")
+        
+        relevant_chunks = await self.aretrieve_chunks(question, filters)
+        if not relevant_chunks:
+            return NO_CONTEXT_ANSWER
+        
+        prompt = await self._run_cpu(self.build_prompt, question, relevant_chunks)
+        
         # Generate answer using OpenAI
         try:
-            response = self.openai_client.chat.completions.create(
+            if self.async_openai_client is None:
+                return await self._run_cpu(self._generate_answer, prompt)
+            response = await self.async_openai_client.chat.completions.create(
                 model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a financial analyst specializing in identifying business growth and contraction themes from corporate documents."},
-                    {"role": "user", "content": prompt}
-                ]
+                messages=self._chat_messages(prompt)
             )
-            
             return response.choices[0].message.content
         
         except Exception as e:
             logger.error(f"Error generating answer: {str(e)}")
             return f"An error occurred while generating the answer: {str(e)}"
+    
+    def answer_questions(self, questions: List[str], filters: Dict[str, List[str]] = None,
+                         max_concurrency: int = BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+        """
+        Answer a batch of questions.
+        
+        All questions are embedded in one embeddings request and searched with a single
+        multi-query FAISS call. The completions then run concurrently, at most
+        max_concurrency at a time. Results come back in input order as dictionaries with
+        the "question" and either an "answer" or an "error", so one failure does not
+        fail the batch.
+        """
+        logger.info(f"Answering batch of {len(questions)} questions")
+        results = [{"question": question, "answer": None, "error": None} for question in questions]
+        if not questions:
+            return results
+        
+        filters = self._scope_filters(filters)
+        embeddings = self.text_processor.generate_embeddings(questions)
+        vector_db = self.vector_db
+        hits_per_question = vector_db.search_batch(embeddings, self._search_top_k(), filters)
+        
+        prompts = {}
+        for i, (question, embedding, hits) in enumerate(zip(questions, embeddings, hits_per_question)):
+            if not embedding:
+                results[i]["error"] = "Could not generate an embedding for the question"
+            elif not hits:
+                results[i]["answer"] = NO_CONTEXT_ANSWER
+            else:
+                try:
+                    prompts[i] = self.build_prompt(question, self._rank_hits(hits, embedding, vector_db))
+                except Exception as e:
+                    logger.error(f"Error building prompt: {str(e)}")
+                    results[i]["error"] = f"An error occurred while preparing the answer: {str(e)}"
+        
+        if prompts:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts)))) as executor:
+                futures = {executor.submit(self._generate_answer, prompt): i for i, prompt in prompts.items()}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        results[i]["answer"] = future.result()
+                    except Exception as e:
+                        logger.error(f"Error generating answer: {str(e)}")
+                        results[i]["error"] = f"An error occurred while generating the answer: {str(e)}"
+        
+        return results
+    
+    def answer_question_stream(self, question: str, filters: Dict[str, List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Answer a question, yielding events as the answer is produced. Filters
+        restrict retrieval as in retrieve_chunks.
+        
+        Events are dictionaries with an "event" name and a "data" payload:
+        - "sources": the retrieved chunks, emitted as soon as retrieval finishes
+        - "token": a fragment of the answer as it arrives from the model
+        - "error": the completion failed; the message is also part of the answer
+        - "done": the full answer text and timings in milliseconds
+        """
+        logger.info(f"Streaming answer for question: {question}")
+        start_time = time.perf_counter()
+        
+        relevant_chunks = self.retrieve_chunks(question, filters)
+        retrieval_ms = (time.perf_counter() - start_time) * 1000
+        
+        yield self._sources_event(relevant_chunks)
+        
+        answer_parts = []
+        first_token_ms = None
+        
+        if not relevant_chunks:
+            answer_parts.append(NO_CONTEXT_ANSWER)
+            yield {"event": "token", "data": {"text": NO_CONTEXT_ANSWER}}
+        else:
+            prompt = self.build_prompt(question, relevant_chunks)
+            try:
+                stream = self.openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=self._chat_messages(prompt),
+                    stream=True
+                )
+                
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    text = chunk.choices[0].delta.content
+                    if not text:
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start_time) * 1000
+                    answer_parts.append(text)
+                    yield {"event": "token", "data": {"text": text}}
+            
+            except Exception as e:
+                logger.error(f"Error generating answer: {str(e)}")
+                message = f"An error occurred while generating the answer: {str(e)}"
+                answer_parts.append(message)
+                yield {"event": "error", "data": {"message": message}}
+        
+        yield self._done_event(answer_parts, start_time, retrieval_ms, first_token_ms)
+    
+    async def aanswer_question_stream(self, question: str, filters: Dict[str, List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of answer_question_stream, yielding the same events."""
+        logger.info(f"Streaming answer for question: {question}")
+        start_time = time.perf_counter()
+        
+        relevant_chunks = await self.aretrieve_chunks(question, filters)
+        retrieval_ms = (time.perf_counter() - start_time) * 1000
+        
+        yield self._sources_event(relevant_chunks)
+        
+        answer_parts = []
+        first_token_ms = None
+        
+        if not relevant_chunks:
+            answer_parts.append(NO_CONTEXT_ANSWER)
+            yield {"event": "token", "data": {"text": NO_CONTEXT_ANSWER}}
+        else:
+            prompt = await self._run_cpu(self.build_prompt, question, relevant_chunks)
+            try:
+                async for text in self._astream_completion(prompt):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start_time) * 1000
+                    answer_parts.append(text)
+                    yield {"event": "token", "data": {"text": text}}
+            
+            except Exception as e:
+                logger.error(f"Error generating answer: {str(e)}")
+                message = f"An error occurred while generating the answer: {str(e)}"
+                answer_parts.append(message)
+                yield {"event": "error", "data": {"message": message}}
+        
+        yield self._done_event(answer_parts, start_time, retrieval_ms, first_token_ms)
+    
+    async def _astream_completion(self, prompt: str) -> AsyncIterator[str]:
+        """Stream the completion for a prompt, yielding non-empty text fragments."""
+        messages = self._chat_messages(prompt)
+        if self.async_openai_client is None:
+            # Pull each chunk of the sync stream on the CPU executor
+            stream = iter(await self._run_cpu(functools.partial(
+                self.openai_client.chat.completions.create, model=OPENAI_MODEL, messages=messages, stream=True)))
+            while (chunk := await self._run_cpu(next, stream, None)) is not None:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            return
+        
+        stream = await self.async_openai_client.chat.completions.create(model=OPENAI_MODEL, messages=messages, stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    @staticmethod
+    def _sources_event(relevant_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """The "sources" stream event for the retrieved chunks."""
+        return {
+            "event": "sources",
+            "data": {
+                "sources": [
+                    {
+                        "source": chunk["source"],
+                        "chunk_id": chunk["chunk_id"],
+                        "total_chunks": chunk["total_chunks"],
+                        "page": chunk.get("page"),
+                        "period": chunk.get("period"),
+                        "company": chunk.get("company"),
+                        "score": chunk["score"]
+                    }
+                    for chunk in relevant_chunks
+                ]
+            }
+        }
+    
+    @staticmethod
+    def _done_event(answer_parts: List[str], start_time: float, retrieval_ms: float, first_token_ms: Optional[float]) -> Dict[str, Any]:
+        """The final "done" stream event with the full answer and timings."""
+        return {
+            "event": "done",
+            "data": {
+                "answer": "".join(answer_parts),
+                "timings": {
+                    "retrieval_ms": round(retrieval_ms, 1),
+                    "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+                    "total_ms": round((time.perf_counter() - start_time) * 1000, 1)
+                }
+            }
+        }
 
 def main():
     """Main entry point for the script."""
@@ -728,6 +1881,15 @@ def main():
     parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Output directory containing themes.json")
     parser.add_argument("--cache-dir", help="Directory to store cache files")
     parser.add_argument("--invalidate-cache", action="store_true", help="Invalidate all caches")
+    parser.add_argument("--source", action="append", dest="sources", help="Only search this document (repeatable)")
+    parser.add_argument("--type", action="append", dest="types", choices=["pdf", "json"], help="Only search documents of this type (repeatable)")
+    parser.add_argument("--period", action="append", dest="periods", help="Only search documents for this fiscal period, e.g. Q3-24 (repeatable)")
+    parser.add_argument("--search-company", action="append", dest="companies",
+                        help=f"Search this company's documents instead of the asked company's (repeatable; '{ALL_COMPANIES}' for all companies)")
+    parser.add_argument("--mmr-lambda", type=float, nargs="?", const=MMR_LAMBDA,
+                        help=f"Re-select diverse hits with MMR; weight of relevance vs diversity, 0-1 (default when given: {MMR_LAMBDA})")
+    parser.add_argument("--retrieval-mode", choices=RETRIEVAL_MODES, default=RETRIEVAL_MODE_CHUNK,
+                        help="Index full-size chunks or small passages expanded around each hit")
     
     args = parser.parse_args()
     
@@ -736,14 +1898,9 @@ def main():
         args.input_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
                                      "filingsdata", "trackedcompanies", args.company_id.capitalize())
     
-    # Set themes file name based on company_id
-    global THEMES_JSON_FILE
-    THEMES_JSON_FILE = f"{args.company_id}_themes.json"
-    
     print(f"Answering question for company: {args.company_id}")
     print(f"Input directory: {args.input_dir}")
     print(f"Output directory: {args.output_dir}")
-    print(f"Themes file: {THEMES_JSON_FILE}")
     
     # Initialize ThemeQA
     theme_qa = ThemeQA(
@@ -751,7 +1908,9 @@ def main():
         input_dir=args.input_dir,
         output_dir=args.output_dir,
         cache_dir=args.cache_dir,
-        company_id=args.company_id
+        company_id=args.company_id,
+        retrieval_mode=args.retrieval_mode,
+        mmr_lambda=args.mmr_lambda
     )
     
     # Invalidate cache if requested
@@ -768,7 +1927,8 @@ def main():
     contextualized_question = f"Question about {company_name}: {args.question}"
     
     # Answer question
-    answer = theme_qa.answer_question(contextualized_question)
+    filters = {key: getattr(args, key) for key in FILTER_KEYS if getattr(args, key)}
+    answer = theme_qa.answer_question(contextualized_question, filters or None)
     
     # Print answer
     print("\n" + "="*80)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tokenizer Service
+
+One shared tokenizer for the scripts and the backend. The tiktoken encoding is
+loaded once per process, instead of once per TextProcessor, from a local cache
+directory that is seeded ahead of time, so machines without network access can
+count tokens. tiktoken otherwise downloads the encoding file on first use. It
+offers batch encoding and counting on threads (tiktoken releases the GIL while
+encoding), and keeps an LRU of the token counts of recently counted strings,
+since the same chunks are counted again for every question that retrieves them.
+
+Seed the cache with:
+    python tokenizer_service.py seed                        # download the encoding
+    python tokenizer_service.py seed --file cl100k_base.tiktoken   # copy a downloaded file
+"""
+
+import os
+import hashlib
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import tiktoken
+from tiktoken.load import read_file
+
+from metrics_registry import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+ENCODING_SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+
+# Directory the encoding is loaded from, laid out as a tiktoken cache; TIKTOKEN_CACHE_DIR takes precedence
+DEFAULT_CACHE_DIR = os.environ.get("TOKENIZER_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "filingsdata", "tokenizer"))
+TOKENIZER_THREADS = int(os.environ.get("TOKENIZER_THREADS", "4"))  # Threads for batch encoding
+COUNT_CACHE_CHARS = int(os.environ.get("TOKENIZER_COUNT_CACHE_CHARS", str(8 * 1024 * 1024)))  # Characters of counted strings kept in the LRU
+MIN_THREADED_BATCH = 8  # Smaller batches are encoded on the calling thread
+
+class TokenizerService:
+    """
+    The process-wide tokenizer.
+
+    encode/decode match the encoding's own, except that special-token text such as
+    "<|endoftext|>" in a document is encoded as ordinary text instead of raising.
+    count and count_batch look strings up in the LRU first; the LRU is bounded by
+    the total length of the strings it holds rather than by their number, since
+    chunks and prompts vary from a few hundred to tens of thousands of characters.
+    """
+
+    def __init__(self, encoding: tiktoken.Encoding, threads: int = TOKENIZER_THREADS, count_cache_chars: int = COUNT_CACHE_CHARS):
+        self.encoding = encoding
+        self.threads = threads
+        self.count_cache_chars = count_cache_chars
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._cached_chars = 0
+        self._lock = threading.Lock()
+
+    def encode(self, text: str) -> List[int]:
+        """Encode a text into tokens"""
+        return self.encoding.encode_ordinary(text)
+
+    def decode(self, tokens: Sequence[int]) -> str:
+        """Decode tokens back into text"""
+        return self.encoding.decode(tokens)
+
+    def encode_batch(self, texts: Sequence[str]) -> List[List[int]]:
+        """Encode many texts, on several threads when there are enough of them"""
+        if len(texts) < MIN_THREADED_BATCH or self.threads <= 1:
+            return [self.encoding.encode_ordinary(text) for text in texts]
+        return self.encoding.encode_ordinary_batch(list(texts), num_threads=self.threads)
+
+    def count(self, text: str, cache: bool = True) -> int:
+        """Count the tokens in a text; pass cache=False for one-off strings not worth keeping in the LRU"""
+        if not cache:
+            return len(self.encoding.encode_ordinary(text))
+        with self._lock:
+            tokens = self._counts.get(text)
+            if tokens is not None:
+                self._counts.move_to_end(text)
+        CACHE_REQUESTS.inc("token_counts", "miss" if tokens is None else "hit")
+        if tokens is None:
+            tokens = len(self.encoding.encode_ordinary(text))
+            self._remember([(text, tokens)])
+        return tokens
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """Count the tokens in many texts, encoding the ones not in the LRU as a batch"""
+        counts: List[Optional[int]] = []
+        with self._lock:
+            for text in texts:
+                tokens = self._counts.get(text)
+                if tokens is not None:
+                    self._counts.move_to_end(text)
+                counts.append(tokens)
+        missing = [i for i, tokens in enumerate(counts) if tokens is None]
+        CACHE_REQUESTS.inc("token_counts", "hit", amount=len(texts) - len(missing))
+        CACHE_REQUESTS.inc("token_counts", "miss", amount=len(missing))
+
+        if missing:
+            # Encode each distinct text once
+            distinct = list(dict.fromkeys(texts[i] for i in missing))
+            distinct_counts = dict(zip(distinct, (len(tokens) for tokens in self.encode_batch(distinct))))
+            for i in missing:
+                counts[i] = distinct_counts[texts[i]]
+            self._remember(distinct_counts.items())
+        return counts
+
+    def _remember(self, entries) -> None:
+        """Add token counts to the LRU, evicting the least recently used beyond its size"""
+        with self._lock:
+            for text, tokens in entries:
+                if len(text) > self.count_cache_chars or text in self._counts:
+                    continue
+                self._counts[text] = tokens
+                self._cached_chars += len(text)
+            while self._cached_chars > self.count_cache_chars:
+                text, _ = self._counts.popitem(last=False)
+                self._cached_chars -= len(text)
+
+def _cache_path(cache_dir: str) -> str:
+    """Where tiktoken looks for the encoding file in a cache directory"""
+    return os.path.join(cache_dir, hashlib.sha1(ENCODING_URL.encode()).hexdigest())
+
+def load_encoding(cache_dir: str = DEFAULT_CACHE_DIR) -> tiktoken.Encoding:
+    """
+    Load the encoding from the local cache.
+
+    TIKTOKEN_CACHE_DIR, when set, is used as it is; otherwise tiktoken is pointed at
+    cache_dir for this one load, and the environment is left as it was. If the
+    encoding is in neither, tiktoken downloads it into the cache, which fails
+    without network access.
+    """
+    env_cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR")
+    cache_dir = env_cache_dir or cache_dir
+    if not os.path.exists(_cache_path(cache_dir)):
+        logger.warning(f"Tokenizer encoding {ENCODING_NAME} is not in {cache_dir}; downloading it "
+                       f"(seed the cache with `python scripts/tokenizer_service.py seed` to work offline)")
+    if env_cache_dir is not None:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    # tiktoken only reads the cache directory from the environment
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    finally:
+        os.environ.pop("TIKTOKEN_CACHE_DIR", None)
+
+def seed_cache(cache_dir: str = DEFAULT_CACHE_DIR, source: Optional[str] = None) -> str:
+    """Put the encoding file into a cache directory, from a local copy or downloaded; returns its path"""
+    data = read_file(source or ENCODING_URL)
+    if hashlib.sha256(data).hexdigest() != ENCODING_SHA256:
+        raise ValueError(f"{source or ENCODING_URL} is not the {ENCODING_NAME} encoding (SHA-256 mismatch)")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return path
+
+# The process-wide tokenizer, loaded on first use
+_tokenizer: Optional[TokenizerService] = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer() -> TokenizerService:
+    """Get the process-wide tokenizer shared by every TextProcessor"""
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            _tokenizer = TokenizerService(load_encoding())
+        return _tokenizer
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Manage the local tokenizer encoding cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    seed_parser = subparsers.add_parser("seed", help="Put the encoding into the local cache so it loads without network access")
+    seed_parser.add_argument("--file", help="Copy of cl100k_base.tiktoken to seed from, instead of downloading it")
+    seed_parser.add_argument("--cache-dir", default=os.environ.get("TIKTOKEN_CACHE_DIR", DEFAULT_CACHE_DIR), help="Cache directory to seed")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        path = seed_cache(args.cache_dir, args.file)
+        print(f"Seeded {ENCODING_NAME} into {path}")
+
+if __name__ == "__main__":
+    main()